@@ -2,6 +2,205 @@ import pandas as pd
 import numpy as np
 import timeit
 import datetime
+import os
+import shutil
+import tempfile
+import concurrent.futures
+import collections
+import hashlib
+import threading
+import ColumnStore
+import Identifiers
+import Instrumentation
+import PartitionedAgencyStore
+
+
+# layout of each agency feed:
+# file: the data warehouse export with the agency's rating actions
+# id: the column with the bond identifier (cusip or isin) that lookups join on
+# key: the agency's own instrument id, used as the canonical instrument key by the crosswalk
+# date: the rating action date
+# drop: columns that lookups don't return (the rating date is only returned for 'incremental' lookups)
+# rename: names of the returned rating columns
+AGENCY_FIELDS = {'moodys': {'file': 'moodys_issue_rating_history.csv',
+                            'id': 'instrument_id_value',
+                            'key': 'instrument_id',
+                            'date': 'rating_date',
+                            'drop': ['instrument_id',
+                                     'moodys_rating_id',
+                                     'security_class_short_description',
+                                     'id_type_text',
+                                     'instrument_id_value',
+                                     'rating_date',
+                                     'rating_class_text',
+                                     'rating_direction_short_description',
+                                     'rating_type_short_description',
+                                     'rating_currency_iso_code'],
+                            'rename': {'rating_text': 'moodys_rating',
+                                       'seniority_short_description': 'moodys_seniority'}},
+                 'sp': {'file': 's_p_issue_rating_history.csv',
+                        'id': 'id_value',
+                        'key': 'security_id',
+                        'date': 'rating_date',
+                        'drop': ['security_id',
+                                 'security_symbol_value',
+                                 'id_type',
+                                 'id_value',
+                                 'rating_date'],
+                        'rename': {'rating': 'sp_rating'}},
+                 'fitch': {'file': 'fitch_issue_rating_history.csv',
+                           'id': 'id_value',
+                           'key': 'fitch_issue_id_number',
+                           'date': 'long_term_issue_rating_effective_date',
+                           'drop': ['agent_common_id',
+                                    'issuer_name',
+                                    'fitch_issue_id_number',
+                                    'id_type',
+                                    'id_value',
+                                    'issue_description',
+                                    'long_term_issue_rating_effective_date'],
+                           'rename': {'long_term_issue_rating': 'fitch_rating',
+                                      'long_term_issue_rating_effective_date': 'rating_date',
+                                      'issue_debt_level_code': 'fitch_seniority'}}}
+
+
+# seniority notching: (agency, seniority) -> notches added to that agency's numeric rating before the ratings are
+# averaged, eg {('moodys', 'Sub'): -1, ('fitch', 'SUB'): -1}. empty by default, so the composite is the plain average.
+# set AgencyRatings.seniority_notching (or pass notching to get_average_ratings) to use a different table for a study
+SENIORITY_NOTCHING = {}
+
+# the column with each agency's seniority in the lookups, only moodys and fitch report one
+SENIORITY_COLUMNS = {'moodys': 'moodys_seniority', 'fitch': 'fitch_seniority'}
+
+
+# the column with the id type of each feed, and the id types that are cusips and isins
+ID_TYPE_FIELDS = {'moodys': 'id_type_text', 'sp': 'id_type', 'fitch': 'id_type'}
+ID_TYPES = {'CUSIP': 'cusip',
+            'CUSIP 3': 'cusip',
+            'CUSIP 4': 'cusip',
+            'CUSIP 5': 'cusip',
+            'CUSIP - Previous': 'cusip',
+            'CUSIP - Second': 'cusip',
+            'CUSIP-2ndary Wrap Orig. CUSIP': 'cusip',
+            'CUSIP-Deriv/Underlying Bond': 'cusip',
+            'Cusip1': 'cusip', 'Cusip2': 'cusip', 'Cusip3': 'cusip', 'Cusip4': 'cusip', 'Cusip5': 'cusip',
+            'Cusip6': 'cusip',
+            'ISIN': 'isin'}
+
+
+def _notching_table(notching):
+    '''
+    normalize a notching table to agency -> {seniority: notches}
+    :param notching: {(agency, seniority): notches} or a list of (agency, seniority, notches)
+    '''
+    items = notching.items() if isinstance(notching, dict) else [((a, s), n) for a, s, n in notching]
+    table = {}
+    for (agency, seniority), notches in items:
+        assert agency in SENIORITY_COLUMNS, 'error: no seniority to notch on for {}'.format(agency)
+        table.setdefault(agency, {})[seniority] = int(notches)
+    return table
+
+
+def _same_as_previous(df, columns):
+    '''
+    flag the rows of df that have the same values as the row before them in all of the given columns
+    (two nulls count as the same value)
+    '''
+    same = np.zeros(df.shape[0], dtype = bool)
+    same[1:] = True
+    for c in columns:
+        col = df[c].to_numpy()
+        same[1:] &= (col[1:] == col[:-1]) | (pd.isnull(col[1:]) & pd.isnull(col[:-1]))
+    return same
+
+
+def _bond_order(ids, date):
+    '''
+    the stable order that sorts rows by bond and date, and the code of each row's bond (-1 without an id)
+    '''
+    codes = pd.factorize(ids)[0]
+    return np.lexsort((date, codes)), codes
+
+
+def _later_same_day(ids, date, day):
+    '''
+    flag the rows that are followed by another action of the same bond on the same day
+    (rows without an id are never found through it, so they are always flagged)
+    '''
+    order, codes = _bond_order(ids, date)
+    later = np.zeros(len(codes), dtype = bool)
+    later[:-1] = (codes[order][1:] == codes[order][:-1]) & (day[order][1:] == day[order][:-1])
+    flags = np.empty(len(codes), dtype = bool)
+    flags[order] = later
+    return flags | (codes < 0)
+
+
+def _unchanged(df, bond, date, values):
+    '''
+    flag the rows that repeat the values of the bond's previous action
+    (rows without an id are never found through it, so they are always flagged)
+    '''
+    order, codes = _bond_order(df[bond], date)
+    flags = np.empty(len(codes), dtype = bool)
+    flags[order] = _same_as_previous(df.iloc[order], [bond] + values)
+    return flags | (codes < 0)
+
+
+# agency ratings object used by the worker processes of get_ratings_parallel
+# each worker loads it once from a memory-mapped snapshot when the process pool starts
+_worker_ratings = None
+
+
+def _init_worker(snapshot_path, config):
+    '''
+    process pool initializer: load the agency data from a snapshot into this worker process
+    the string columns stay dictionary encoded on the memory-mapped files, only the rows a lookup returns are decoded
+    :param config: the settings of the parent object that change lookup results (seniority_notching and the
+                   crosswalk), as dictionary
+    '''
+    global _worker_ratings
+    _worker_ratings = AgencyRatings()
+    _worker_ratings.load_snapshot(snapshot_path, mmap = True, decode = False)
+    _worker_ratings.seniority_notching = config['seniority_notching']
+    if config['crosswalk'] is not None:
+        _worker_ratings._set_crosswalk(config['crosswalk'], config['crosswalk_stats'])
+
+
+def _decoded(df):
+    '''
+    df with its categorical columns (dictionary encoded strings of a snapshot, see ColumnStore) turned back into
+    object columns
+    '''
+    categorical = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if len(categorical) == 0:
+        return df
+    df = df.copy()
+    for c in categorical:
+        df[c] = df[c].to_numpy(dtype = object)
+    return df
+
+
+def _index_codes(index, values):
+    '''
+    position of every value in index (-1 if missing), categoricals are looked up once per category
+    '''
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        lookup = np.append(index.get_indexer(values.cat.categories), -1)
+        return lookup[values.cat.codes.to_numpy()]
+    return index.get_indexer(values.to_numpy())
+
+
+def _run_partition(task):
+    '''
+    run the lookup (and optionally the composite rating) for one partition of bonds inside a worker process
+    '''
+    method, part, kwargs, average, require_two_agencies = task
+    df = getattr(_worker_ratings, method)(part, **kwargs)
+    if average:
+        df = _worker_ratings.get_average_ratings(df, require_two_agencies = require_two_agencies)
+    return df
+
+
 class AgencyRatings():
 
     '''
@@ -11,7 +210,8 @@ class AgencyRatings():
 
     This class pulls from Y:\QuantitativeStrategy\data-warehouse-exports
 
-    To start, load the agency rating data feeds ingo self.moodys, self.sp, self.fitch by using load_agency_data.
+    The agency rating data feeds in self.moodys, self.sp, self.fitch are each loaded the first time they are used,
+    so a quick look at one agency only reads that agency's export. Use preload (or load_agency_data) to load them all.
     This is a lot of data! It is therfore slow to load but once it's loaded you have fast access to
     everything as it is stored in memory
 
@@ -19,115 +219,720 @@ class AgencyRatings():
 
     '''
 
-    def __init__(self):
-        self.moodys = None
-        self.sp = None
-        self.fitch = None
+    def __init__(self, data_path = 'Y:\\QuantitativeStrategy\\data-warehouse-exports\\', compact = False):
+        '''
+        :param data_path: the directory with the data warehouse exports the agencies are loaded from, as string
+                          (None: only use data that is loaded explicitly, eg with load_snapshot)
+        :param compact: compact each agency's rating history when it is loaded, see compact_agency_data, as boolean
+        '''
+
+        # agency data, loaded on first use through the moodys, sp and fitch properties
+        self._moodys = None
+        self._sp = None
+        self._fitch = None
+        self.data_path = data_path
+        self.compact_on_load = compact
+
+        # rows kept, cusips, isins and ids failing validation of each feed at load, see Identifiers.factorize_ids
+        self.id_stats = {}
+
+        # (agency, seniority) -> notches applied by get_average_ratings and build_composite_history
+        self.seniority_notching = dict(SENIORITY_NOTCHING)
 
         # save baml constituents for use in backfill when we need to search through the baml bonds
         self.baml_constituents = None
         self.baml_constituents_loaded = False
 
-    def load_agency_data(self, verbose = False):
+        # mapping from alphanumeric to numeric rating
+        self.numeric_dict = {'AAA': 21,
+                            'AA1': 20, 'AA2': 19, 'AA3': 18,
+                            'A1': 17, 'A2': 16, 'A3': 15,
+                            'BBB1': 14, 'BBB2': 13, 'BBB3': 12,
+                            'BB1': 11, 'BB2': 10, 'BB3': 9,
+                            'B1': 8, 'B2': 7, 'B3': 6,
+                            'CCC1': 5, 'CCC2': 4, 'CCC3': 3,
+                            'CC': 2, 'C': 1, 'D': 0,
+
+                            'Aaa': 21, 'Aa1': 20, 'Aa2': 19, 'Aa3': 18,
+                            'A1': 17, 'A2': 16, 'A3': 15,
+                            'Baa1': 14, 'Baa2': 13, 'Baa3': 12,
+                            'Ba1': 11, 'Ba2': 10, 'Ba3': 9,
+                            'Caa1': 5, 'Caa2': 4, 'Caa3': 3,
+                            'Ca': 2, 'C': 1,
+
+                            'AA+': 20, 'AA': 19, 'AA-': 18,
+                            'A+': 17, 'A': 16, 'A-': 15,
+                            'BBB+': 14, 'BBB': 13, 'BBB-': 12,
+                            'BB+': 11, 'BB':10, 'BB-': 9,
+                            'B+': 8, 'B':7, 'B-': 6,
+                            'CCC+': 5, 'CCC': 4, 'CCC-': 3,
+
+                            'SD': 0, 'RD': 0, 'WR': np.NaN, 'NR': np.NaN, 'WD': np.NaN
+                             }
+
+        # mapping from numeric to alphanumeric rating
+        self.alphanumeric_dict = {21: 'AAA',
+                                  20: 'AA1', 19: 'AA2', 18: 'AA3',
+                                  17: 'A1', 16: 'A2', 15: 'A3',
+                                  14: 'BBB1', 13: 'BBB2', 12: 'BBB3',
+                                  11: 'BB1', 10: 'BB2', 9: 'BB3',
+                                  8: 'B1', 7: 'B2', 6: 'B3',
+                                  5: 'CCC1', 4: 'CCC2', 3: 'CCC3',
+                                  2: 'CC', 1: 'C', 0: 'D',
+                                  'NaN': 'NR'
+                                  }
+
+        # directory of the snapshot the agency data was loaded from (if any), see save_snapshot
+        self.snapshot_path = None
+
+        # bumped every time the agency data is (re)loaded, so cached lookups from older data are never reused
+        self.data_version = 0
+
+        # rows removed by compact_agency_data, per agency
+        self.compaction_stats = {}
+
+        # optional identifier crosswalk, see build_crosswalk
+        self.crosswalk = None
+        self.crosswalk_history = None
+        self.crosswalk_stats = None
+
+        # optional materialized composite rating history, see build_composite_history
+        self.composite_history = None
+        self.composite_index = None
+
+        # optional timing and memory instrumentation, see enable_instrumentation
+        self.instrumentation = None
+        self._own_instrumentation = False
+
+        # optional lookup result cache, see enable_cache
+        self.cache = None
+        self.cache_max_bytes = 0
+        self.cache_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # the cache is shared by the request threads of a RatingsService
+        self.cache_lock = threading.Lock()
+
+    @property
+    def moodys(self):
         '''
-        get the incremental agency ratings from data warehouse exports
-        read in moodys, sp and fitch incremental data and store as attributes of class object
-        save in self.moodys, self.sp, self.fitch
+        moodys rating actions, read from the data warehouse export the first time they are used
         '''
+        if self._moodys is None and self.data_path is not None:
+            self.load_agency('moodys')
+        return self._moodys
 
-        start = timeit.default_timer()
-        moodys = pd.read_csv('Y:\\QuantitativeStrategy\\data-warehouse-exports\\moodys_issue_rating_history.csv')
-        #moodys = pd.read_csv('Y:\\QuantitativeStrategy\\staging-dw-exports\\moodys_issue_rating_history.csv')
-        #moodys = pd.read_csv('moodys_issue_rating_history.csv')
+    @moodys.setter
+    def moodys(self, value):
+        self._moodys = value
 
-        if verbose:
-            print('moodys loaded in {} seconds'.format(timeit.default_timer() - start))
+    @property
+    def sp(self):
+        '''
+        s&p rating actions, read from the data warehouse export the first time they are used
+        '''
+        if self._sp is None and self.data_path is not None:
+            self.load_agency('sp')
+        return self._sp
 
-        start = timeit.default_timer()
-        sp = pd.read_csv('Y:\\QuantitativeStrategy\\data-warehouse-exports\\s_p_issue_rating_history.csv')
-        #sp = pd.read_csv('Y:\\QuantitativeStrategy\\staging-dw-exports\\s_p_issue_rating_history.csv')
+    @sp.setter
+    def sp(self, value):
+        self._sp = value
 
-        if verbose:
-            print('sp loaded in {} seconds'.format(timeit.default_timer() - start))
+    @property
+    def fitch(self):
+        '''
+        fitch rating actions, read from the data warehouse export the first time they are used
+        '''
+        if self._fitch is None and self.data_path is not None:
+            self.load_agency('fitch')
+        return self._fitch
+
+    @fitch.setter
+    def fitch(self, value):
+        self._fitch = value
+
+    def loaded_agencies(self):
+        '''
+        :return: the agencies whose rating data is in memory, as list of strings
+        '''
+        return [agency for agency in ['moodys', 'sp', 'fitch'] if getattr(self, '_' + agency) is not None]
+
+    def preload(self, verbose = False):
+        '''
+        load every agency that hasn't been loaded yet, eg at the start of a batch job rather than on first use
+        :param verbose: print progress, as boolean
+        :return: None
+        '''
+        missing = [agency for agency in ['moodys', 'sp', 'fitch'] if getattr(self, '_' + agency) is None]
+        for agency in missing:
+            setattr(self, agency, self.read_agency(agency, verbose = verbose))
+        if len(missing) > 0:
+            self.data_reloaded()
+
+    @Instrumentation.instrumented
+    def load_agency(self, agency, verbose = False):
+        '''
+        read and clean one agency's incremental ratings from its data warehouse export in self.data_path
+        the other agencies are left as they are, the lookups cached from the old data are dropped (see data_reloaded)
+        :param agency: 'moodys', 'sp' or 'fitch'
+        :param verbose: print progress, as boolean
+        :return: None
+        '''
+        setattr(self, agency, self.read_agency(agency, verbose = verbose))
+        self.data_reloaded()
+
+    def read_agency(self, agency, verbose = False):
+        '''
+        read and clean one agency's export without storing it: the agency data, the caches and the derived
+        histories are left as they are, so several agencies can be read on different threads. store the results
+        (eg ratings.sp = df) and call data_reloaded once, or use load_agency
+        :param agency: 'moodys', 'sp' or 'fitch'
+        :param verbose: print progress, as boolean
+        :return: the cleaned rating actions, in the layout of self.moodys / sp / fitch, as dataframe
+        '''
+
+        assert agency in AGENCY_FIELDS, 'error: unknown agency {}'.format(agency)
+        assert self.data_path is not None, 'error: no data_path to load the agency data from'
 
-        # get the csv files
         start = timeit.default_timer()
-        fitch = pd.read_csv('Y:\\QuantitativeStrategy\\data-warehouse-exports\\fitch_issue_rating_history.csv')
-        #fitch = pd.read_csv('Y:\\QuantitativeStrategy\\staging-dw-exports\\fitch_issue_rating_history.csv')
-        #fitch = pd.read_csv('fitch_issue_rating_history.csv')
+        with Instrumentation.stage(self, 'read {} csv'.format(agency)) as record:
+            df = pd.read_csv(os.path.join(self.data_path, AGENCY_FIELDS[agency]['file']))
+            record['rows_out'] = df.shape[0]
 
         if verbose:
-            print('fitch loaded in {} seconds'.format(timeit.default_timer() - start))
+            print('{} loaded in {} seconds'.format(agency, timeit.default_timer() - start))
+
+        # the moodys rows are filtered first, so only the rows kept have their ids normalized
+        if agency == 'moodys':
+            # for moodys, only keep certain types of ratings
+            # exclude ratings like bank credit facility, preferred stock
+            # sometimes a bond can have multiples types of ratings, but we only want the 'regular bond rating'
+            keep = df['security_class_short_description'].isin(['REG',   # regular bond/debenture
+                                                                'MTN',   # medium term note
+                                                                'PRF',   # preferred
+                                                                'CON'])  # convertible
+
+            # exclude LGD ratings, checked once per rating class rather than per row
+            codes, classes = pd.factorize(df['rating_class_text'])
+            lgd = np.append(np.array(['LGD' in str(c) for c in classes], dtype = bool), False)[codes]
+            df = df.take(np.flatnonzero(keep.to_numpy() & ~lgd))
 
         # the agency rating feed gives cusip as 9 digits
         # but many sources like baml might only give 8 cusips (no check digit)
         # for consistency, convert all cusips in the incremental agency rating data to 8 digits
         # (for isins, assume 12 digits)
+        self._normalize_ids(agency, df)
+
+        if self.compact_on_load:
+            df = self._compact(agency, df, verbose = verbose)
+
+        return df
+
+    def _normalize_ids(self, agency, df):
+        '''
+        clean the id column of a raw agency feed in place: cusips are cut to 8 characters, every cusip and isin has its
+        check digit validated (see Identifiers.factorize_ids) and the counts end up in self.id_stats[agency]. ids of
+        any other id type are left exactly as they are in the feed
+        '''
+        id_field = AGENCY_FIELDS[agency]['id']
+
+        # the feeds repeat each id and id type for every rating action, so both are mapped and normalized once per
+        # distinct value and taken back to the rows by code
+        type_codes, feed_types = pd.factorize(df[ID_TYPE_FIELDS[agency]])
+        mapped = pd.Categorical(pd.Series(feed_types, dtype = object).map(ID_TYPES), categories = ['cusip', 'isin'])
+        id_types = pd.Categorical.from_codes(np.append(mapped.codes, -1)[type_codes], categories = ['cusip', 'isin'])
+        codes, ids = Identifiers.factorize_ids(df[id_field], id_type = id_types)
+
+        # ids of any other type keep their feed value, they are join keys as they are. the column is overwritten in
+        # place, a new column would make pandas copy every object column of the feed into one block later on
+        typed = ids['id_type'].notnull().to_numpy()
+        df.loc[:, id_field] = np.where(typed[codes], ids['id'].to_numpy(dtype = object)[codes],
+                                       df[id_field].to_numpy(dtype = object))
+
+        rows = np.bincount(codes, minlength = ids.shape[0])
+        self.id_stats[agency] = {'rows': int(df.shape[0]),
+                                 'cusip': int(rows[(ids['id_type'] == 'cusip').to_numpy()].sum()),
+                                 'isin': int(rows[(ids['id_type'] == 'isin').to_numpy()].sum()),
+                                 'invalid': int(rows[typed & ~ids['valid'].to_numpy()].sum())}
+
+    @Instrumentation.instrumented
+    def load_agency_data(self, verbose = False, compact = None, path = None):
+        '''
+        get the incremental agency ratings from data warehouse exports
+        read in moodys, sp and fitch incremental data and store as attributes of class object
+        save in self.moodys, self.sp, self.fitch
+
+        there is no need to call this for ad-hoc work: each agency is read by itself the first time it is used. call
+        it (or preload) to read everything up front, or to re-read the exports after they were updated
+        :param verbose: print progress, as boolean
+        :param compact: collapse the rating histories to genuine rating changes, see compact_agency_data, as boolean
+                        (default: the compact setting the object was made with)
+        :param path: the directory with the data warehouse exports, as string (default: self.data_path)
+        '''
+
+        if path is not None:
+            self.data_path = path
+        if compact is not None:
+            self.compact_on_load = compact
+        self.compaction_stats = {}
+
+        for agency in ['moodys', 'sp', 'fitch']:
+            setattr(self, agency, self.read_agency(agency, verbose = verbose))
+
+        self.data_reloaded()
+
+    def _compact(self, agency, df, verbose = False):
+        '''
+        compact one agency's rating actions, see compact_agency_data
+        :return: the compacted rating actions, as dataframe
+        '''
+
+        fields = AGENCY_FIELDS[agency]
+        rows_before = df.shape[0]
+
+        # the columns that make up the rating the lookups return
+        values = [c for c in df.columns if c not in fields['drop']]
+        bond = [fields['id'], fields['key']]
+
+        # order each bond's actions by time, keeping the feed order for actions at the same time
+        date = pd.to_datetime(df[fields['date']])
+        order = pd.DataFrame({'date': date.to_numpy()})
+        for c in bond:
+            order[c] = df[c].to_numpy()
+        order.sort_values(by = bond + ['date'], kind = 'mergesort', inplace = True)
+        df = df.iloc[order.index]
+        date = order['date'].to_numpy()
+        day = date.astype('datetime64[D]')
+
+        # the lookups find a bond's actions by its identifier and the crosswalk by its agency instrument, and one
+        # identifier can be shared by several instruments (and the other way round). an action is only dropped if it
+        # makes no difference to either: it has to be redundant among the actions of its identifier and among the
+        # actions of its instrument
+
+        # build_crosswalk picks between the instruments of an identifier by the date of their latest action, so the
+        # last action of every identifier and instrument pair is always kept
+        last_of_pair = np.ones(df.shape[0], dtype = bool)
+        last_of_pair[:-1] = ~_same_as_previous(df, bond)[1:]
+
+        # keep the last action per bond and day
+        later_same_day = ~last_of_pair
+        for c in bond:
+            later_same_day &= _later_same_day(df[c], date, day)
+        df = df[~later_same_day]
+        date = date[~later_same_day]
+        last_of_pair = last_of_pair[~later_same_day]
+        same_day_removed = int(later_same_day.sum())
+
+        # drop actions that repeat the previous rating of the bond
+        unchanged = ~last_of_pair
+        for c in bond:
+            unchanged &= _unchanged(df, c, date, values)
+        df = df[~unchanged]
+
+        self.compaction_stats[agency] = {'rows_before': rows_before,
+                                         'rows_after': int(df.shape[0]),
+                                         'same_day_removed': same_day_removed,
+                                         'unchanged_removed': int(unchanged.sum())}
         if verbose:
-            print('converting to 8 digit cusip')
-
-        mask = sp['id_type'].isin(['Cusip1', 'Cusip2', 'Cusip3', 'Cusip4', 'Cusip5', 'Cusip6'])
-        sp.loc[mask, 'id_value'] = sp.loc[mask, 'id_value'].map(lambda x: x[:8])
-
-        mask = fitch['id_type'].isin(['Cusip1', 'Cusip2', 'Cusip3', 'Cusip4', 'Cusip5', 'Cusip6'])
-        fitch.loc[mask, 'id_value'] = fitch.loc[mask, 'id_value'].map(lambda x: x[:8])
-
-        mask = moodys['id_type_text'].isin(['CUSIP',
-                                            'CUSIP 3',
-                                            'CUSIP 4',
-                                            'CUSIP 5',
-                                            'CUSIP - Previous',
-                                            'CUSIP - Second',
-                                            'CUSIP-2ndary Wrap Orig. CUSIP',
-                                            'CUSIP-Deriv/Underlying Bond'])
-        moodys.loc[mask, 'instrument_id_value'] = moodys.loc[mask, 'instrument_id_value'].map(lambda x: x[:8])
-
-        # for moodys, only keep certain types of ratings
-        # exclude ratings like bank credit facility, preferred stock
-        # sometimes a bond can have multiples types of ratings, but we only want the 'regular bond rating'
-        mask1 = moodys['security_class_short_description'] == 'REG'  # regular bond/debenture
-        mask2 = moodys['security_class_short_description'] == 'MTN'  # medium term note
-        mask3 = moodys['security_class_short_description'] == 'PRF'  # medium term note
-        mask4 = moodys['security_class_short_description'] == 'CON'  # medium term note
-        moodys = moodys[mask1 | mask2 | mask3 | mask4]
-
-        # exclude LGD ratings
-        mask = moodys['rating_class_text'].map(lambda x: 'LGD' in x)
-        moodys = moodys[-mask]
-
-        # save as attributes of class
-        self.moodys = moodys
-        self.sp = sp
-        self.fitch = fitch
+            print('{} compacted from {} to {} rows'.format(agency, rows_before, df.shape[0]))
+        return df
 
-    def get_fitch_ratings(self, data, id_col, date = 'current'):
+    @Instrumentation.instrumented
+    def compact_agency_data(self, verbose = False):
+        '''
+        collapse the rating history of every bond to its genuine rating changes
+
+        the feeds keep every raw rating action, including several actions on the same day and actions that leave the
+        rating unchanged (affirmations, outlook-only actions). for each bond this keeps the last action of each day, then
+        drops actions where none of the columns the lookups return (rating, seniority) changed. the lookups know a bond
+        by its identifier and the crosswalk by its agency instrument, so an action is only dropped if it is redundant
+        for both. the ratings returned for any date are the same, but lookups, time series and the composite
+        history scan far fewer rows.
+
+        how many rows were removed is saved in self.compaction_stats
+        :param verbose: print the number of rows removed, as boolean
+        :return: None
+        '''
 
+        self.compaction_stats = {}
+        for agency in ['moodys', 'sp', 'fitch']:
+            setattr(self, agency, self._compact(agency, getattr(self, agency), verbose = verbose))
+
+        self.data_reloaded()
+
+    def save_snapshot(self, path):
+        '''
+        save the loaded agency data as a snapshot directory with one memory-mappable file per column
+        a snapshot loads much faster than the raw csv exports and can be shared between processes
+        :param path: the directory to write the snapshot to, as string
+        :return: None
         '''
-        attach a column with fitch ratings to a dataset
 
-        pass in a dataframe with a group of bonds in the rows. we want to add a new column with the fitch rating
+        assert self.moodys is not None, 'error: load the agency data before saving a snapshot'
 
-        :param data: a dataset that contains bonds that you want the rating for, as dataframe
-        :id_col: the name of the column in the datset that contains either the cusip or isin, as string
-        :param date: date(s) of the ratings you want, either 'current', a date in datetime.date, or 'incremental'
-        :return: a dataset with an added fitch_rating column, as dataframe
+        for agency in ['moodys', 'sp', 'fitch']:
+            ColumnStore.write_frame(getattr(self, agency), os.path.join(path, agency))
+
+        # the composite rating history is saved with the snapshot so it doesn't have to be rebuilt
+        if self.composite_history is not None:
+            ColumnStore.write_frame(self.composite_history, os.path.join(path, 'composite'))
+
+        self.snapshot_path = path
+
+    def load_snapshot(self, path, mmap = True, decode = True):
+        '''
+        load the agency data from a snapshot written by save_snapshot, instead of using load_agency_data
+        :param path: the snapshot directory, as string
+        :param mmap: memory map the snapshot files rather than reading them into memory, as boolean
+        :param decode: turn the string columns back into strings. if False they stay categoricals over the
+                       memory-mapped codes and the lookups only decode the rows they return (the get_ratings_parallel
+                       workers do this), other methods expect decoded data, as boolean
+        :return: None
         '''
 
-        original = data.copy()
+        for agency in ['moodys', 'sp', 'fitch']:
+            setattr(self, agency, ColumnStore.read_frame(os.path.join(path, agency), mmap = mmap, decode = decode))
 
-        # organize the bonds you want to get ratings for
-        # keep just a dataframe with a single column of bond identifiers (cusip or isin)
-        df = data.copy()
-        df = df[[id_col]]
+        # use the saved composite rating history instead of rebuilding it
+        saved_composite = os.path.exists(os.path.join(path, 'composite', 'columns.json'))
+        if saved_composite:
+            self.composite_history = None
+
+        self.data_reloaded()
+        self.snapshot_path = path
+
+        if saved_composite:
+            self.composite_history = ColumnStore.read_frame(os.path.join(path, 'composite'), mmap = mmap,
+                                                            decode = decode)
+            self._index_composite_history()
+
+    def save_partitioned_store(self, path, n_partitions = 64):
+        '''
+        save the agency data hash-partitioned by bond identifier, with a bloom filter per partition
+        so the ratings of a small universe of bonds can be loaded on their own, see load_partitioned_store
+        :param path: the directory to write the store to, as string
+        :param n_partitions: number of partitions per agency, as int
+        :return: None
+        '''
+        PartitionedAgencyStore.PartitionedAgencyStore(path).write(self, n_partitions = n_partitions)
+
+    @Instrumentation.instrumented
+    def load_partitioned_store(self, path, ids):
+        '''
+        load only the rating actions of the given bonds from a store written by save_partitioned_store
+        only the partitions that can hold the bonds are read, so this is quick and small for a universe of a few
+        thousand bonds. lookups afterwards only know about these bonds
+        :param path: the store directory, as string
+        :param ids: the bond identifiers (8 digit cusip or isin), as list-like
+        :return: None
+        '''
+
+        store = PartitionedAgencyStore.PartitionedAgencyStore(path)
+        for agency in ['moodys', 'sp', 'fitch']:
+            setattr(self, agency, store.read(agency, ids))
+
+        # the agencies are loaded, nothing is read lazily from the exports
+        self.data_path = None
+        self.data_reloaded()
+
+    def enable_instrumentation(self, instrumentation = None, trace_memory = False):
+        '''
+        record wall time, rows in / out and memory for every lookup, see Instrumentation
+        :param instrumentation: collect into this Instrumentation object, eg one shared with a RatingsTransitionMatrix
+        :param trace_memory: also trace peak memory with tracemalloc (slower), as boolean
+        :return: the Instrumentation object collecting the records
+        '''
+        self.disable_instrumentation()
+        self._own_instrumentation = instrumentation is None
+        if instrumentation is None:
+            instrumentation = Instrumentation.Instrumentation(trace_memory = trace_memory)
+        self.instrumentation = instrumentation
+        return instrumentation
+
+    def disable_instrumentation(self):
+        '''
+        stop recording, an Instrumentation object created by enable_instrumentation is closed (a shared one is not)
+        '''
+        if self._own_instrumentation:
+            self.instrumentation.close()
+        self._own_instrumentation = False
+        self.instrumentation = None
+
+    def data_reloaded(self):
+        '''
+        call this after changing self.moodys, self.sp or self.fitch by hand
+        moves the agency data to a new version and drops every cached lookup made from the old data. the data no longer
+        matches the snapshot it may have been loaded from, so get_ratings_parallel writes a new one for its workers
+        '''
+        self.data_version += 1
+        self.snapshot_path = None
+        if self.cache is not None:
+            self.clear_cache()
+        if self.crosswalk is not None:
+            self.build_crosswalk()
+        if self.composite_history is not None:
+            self.build_composite_history()
+
+    @Instrumentation.instrumented
+    def build_crosswalk(self):
+        '''
+        build an identifier crosswalk for each agency
 
-        # merge the entire incremental fitch ratings dataset and only keep bonds from the target group above
-        df = df.merge(self.fitch, how = 'left', left_on = id_col, right_on = 'id_value')
+        the feeds carry several identifiers per instrument (cusip 1-6 and isin for s&p / fitch, the moodys id_type_text
+        variants) and every rating action is repeated for each of them. the crosswalk maps every known 8 digit cusip
+        and isin to one canonical instrument key per agency (moodys instrument_id, s&p security_id, fitch
+        fitch_issue_id_number). once it is built, the lookups resolve any mix of cusips and isins to instruments
+        with a single hash probe, and join on the instrument's de-duplicated rating history.
 
+        a US / CA isin embeds the cusip of the bond: the cusip of an isin in the feed resolves to the isin's instrument
+        if the feed has no row for that cusip, and an isin that isn't in the feed resolves through its cusip.
+        the agency instrument ids are kept apart from the cusips and isins (a numeric agency id can look like a
+        cusip), they are only resolved by resolve_ids with id_type = 'native'
+
+        if an identifier maps to several instruments, the instrument with the most recent rating action is used.
+        the number of such identifiers is reported in self.crosswalk_stats
+
+        :return: None
+        '''
+
+        crosswalk = {}
+        stats = {}
+        for agency in ['moodys', 'sp', 'fitch']:
+            fields = AGENCY_FIELDS[agency]
+            agency_data = getattr(self, agency)
+
+            # encode the canonical instrument keys as integer codes
+            key_codes, keys = pd.factorize(agency_data[fields['key']])
+
+            # pair every identifier with its instrument, the instrument with the latest action wins if there are several
+            pairs = pd.DataFrame({'id': agency_data[fields['id']].to_numpy(),
+                                  'key': key_codes,
+                                  'date': pd.to_datetime(agency_data[fields['date']]).to_numpy()})
+            pairs = pairs[pairs['id'].notnull() & (pairs['key'] >= 0)]
+            ambiguous = int((pairs.drop_duplicates(subset = ['id', 'key'])['id'].value_counts() > 1).sum())
+            pairs.sort_values(by = ['id', 'date'], inplace = True)
+            pairs.drop_duplicates(subset = 'id', keep = 'last', inplace = True)
+
+            # the cusips embedded in the isins resolve to the isin's instrument, unless the feed has the cusip itself
+            cusips = Identifiers.normalize_ids(pairs['id'], id_type = 'isin')['cusip'].to_numpy(dtype = object)
+            embedded = pd.DataFrame({'id': cusips, 'key': pairs['key'].to_numpy(), 'date': pairs['date'].to_numpy()})
+            embedded = embedded[embedded['id'].notnull() & ~embedded['id'].isin(pairs['id'])]
+            embedded.sort_values(by = ['id', 'date'], inplace = True)
+            embedded.drop_duplicates(subset = 'id', keep = 'last', inplace = True)
+
+            ids = pd.Index(np.concatenate([pairs['id'].to_numpy(dtype = object),
+                                           embedded['id'].to_numpy(dtype = object)]))
+            crosswalk[agency] = (ids, np.concatenate([pairs['key'].to_numpy(), embedded['key'].to_numpy()]), keys)
+
+            stats[agency] = {'identifiers': len(ids),
+                             'instruments': len(keys),
+                             'ambiguous_identifiers': ambiguous,
+                             'feed_rows': int(agency_data.shape[0])}
+
+        self._set_crosswalk(crosswalk, stats)
+
+    def _set_crosswalk(self, crosswalk, stats):
+        '''
+        use a crosswalk made by build_crosswalk (eg in the parent of a get_ratings_parallel worker) and derive the
+        de-duplicated rating history of every instrument from the loaded agency data
+        '''
+
+        self.crosswalk = crosswalk
+        self.crosswalk_history = {}
+        self.crosswalk_stats = {agency: dict(values) for agency, values in stats.items()}
+
+        # the lookups resolve ids differently from now on, so nothing cached before can be reused
+        self.clear_cache()
+
+        for agency in ['moodys', 'sp', 'fitch']:
+            fields = AGENCY_FIELDS[agency]
+            agency_data = getattr(self, agency)
+
+            # rating history per instrument: the feed without its identifier columns,
+            # with the copies of each action under the different identifiers removed
+            keep = [c for c in agency_data.columns
+                    if ((c not in fields['drop']) or (c == fields['date'])) and (c != fields['id'])]
+            history = agency_data[keep].copy()
+            history['_instrument_key'] = _index_codes(pd.Index(crosswalk[agency][2]), agency_data[fields['key']])
+            history = history[history['_instrument_key'] >= 0].drop_duplicates()
+            self.crosswalk_history[agency] = history
+            self.crosswalk_stats[agency]['history_rows'] = int(history.shape[0])
+
+    def resolve_ids(self, data, id_col, agency, id_type = 'id'):
+        '''
+        resolve a column of cusips / isins (or agency instrument ids) to the agency's canonical instrument key
+        :param data: a dataset that contains bonds, as dataframe
+        :id_col: the name of the column in the datset that contains the identifiers, as string
+        :param agency: 'moodys', 'sp' or 'fitch'
+        :param id_type: 'id' for cusips and isins, 'native' for the agency's own instrument ids
+        :return: the instrument key for every row of data (NaN if the identifier is unknown), as series
+        '''
+
+        assert id_type in ['id', 'native'], 'error: id_type must be id or native'
+        if self.crosswalk is None:
+            self.build_crosswalk()
+
+        keys = self.crosswalk[agency][2]
+        if id_type == 'native':
+            key_codes = pd.Index(keys.astype(str)).get_indexer(data[id_col].astype(str).to_numpy(dtype = object))
+            key_codes[data[id_col].isnull().to_numpy()] = -1
+        else:
+            key_codes = self._resolve_key_codes(data[id_col], agency)
+        values = np.full(len(key_codes), np.NaN, dtype = object)
+        values[key_codes >= 0] = keys[key_codes[key_codes >= 0]]
+        return pd.Series(values, index = data.index, name = AGENCY_FIELDS[agency]['key'])
+
+    def _resolve_key_codes(self, ids, agency):
+        '''
+        one hash probe per identifier into the crosswalk, returns the instrument key code or -1 if unknown
+        '''
+        index, key_codes, _ = self.crosswalk[agency]
+        ids = ids.to_numpy(dtype = object)
+        rows = index.get_indexer(ids)
+
+        # an isin that isn't in the feed resolves through the cusip it embeds (US / CA isins)
+        missing = np.flatnonzero((rows < 0) & pd.notnull(ids))
+        if len(missing) > 0:
+            cusips = Identifiers.normalize_ids(ids[missing], id_type = 'isin')['cusip'].to_numpy(dtype = object)
+            known = pd.notnull(cusips)
+            rows[missing[known]] = index.get_indexer(cusips[known])
+
+        return np.where(rows >= 0, key_codes[rows], -1)
+
+    def enable_cache(self, max_megabytes = 512):
+        '''
+        turn on the lookup result cache
+        get_agency_ratings_by_id and get_average_ratings remember their results, keyed by a fingerprint of the
+        bonds (or ratings) passed in, the date and the version of the agency data. calling them again for the same
+        constituent set and date skips the merges. the least recently used results are evicted once the cache holds
+        more than max_megabytes
+        :param max_megabytes: memory limit of the cache, as number of megabytes
+        :return: None
+        '''
+        self.cache = collections.OrderedDict()
+        self.cache_max_bytes = max_megabytes * 2 ** 20
+        self.cache_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def disable_cache(self):
+        '''
+        turn off the lookup result cache and free its memory
+        '''
+        self.cache = None
+        self.cache_bytes = 0
+
+    def clear_cache(self):
+        '''
+        drop every cached lookup, but keep the cache turned on
+        '''
+        if self.cache is not None:
+            with self.cache_lock:
+                self.cache.clear()
+        self.cache_bytes = 0
+
+    def cache_info(self):
+        '''
+        :return: hits, misses, number of cached results and their size in bytes, as dictionary
+        '''
+        return {'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'entries': 0 if self.cache is None else len(self.cache),
+                'bytes': self.cache_bytes,
+                'max_bytes': self.cache_max_bytes}
+
+    def _fingerprint(self, values, ordered = True):
+        '''
+        hash a column (or columns) of values into a short string
+        if ordered is False, only the set of distinct values matters, not their order or repeats
+        '''
+        hashes = pd.util.hash_pandas_object(values, index = False).to_numpy()
+        if not ordered:
+            hashes = np.unique(hashes)
+        return hashlib.sha1(hashes.tobytes()).hexdigest() + '-{}'.format(len(hashes))
+
+    def _cache_get(self, key):
+        '''
+        look up a cached result and mark it as most recently used
+        '''
+        if self.cache is None:
+            return None
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+                return self.cache[key][0]
+            self.cache_misses += 1
+        return None
+
+    def _cache_put(self, key, value):
+        '''
+        store a result, evicting the least recently used results until the cache fits in memory again
+        '''
+        if self.cache is None:
+            return
+        size = int(value.memory_usage(index = True, deep = True).sum())
+        if size > self.cache_max_bytes:
+            return
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache_bytes -= self.cache.pop(key)[1]
+            self.cache[key] = (value, size)
+            self.cache_bytes += size
+            while self.cache_bytes > self.cache_max_bytes:
+                _, (_, evicted_size) = self.cache.popitem(last = False)
+                self.cache_bytes -= evicted_size
+
+    def _agency_rows(self, agency, ids):
+        '''
+        the agency's rating actions, for a snapshot loaded with decode = False only those of the given ids, decoded
+        (the string columns of such a snapshot are categoricals over the memory-mapped codes, see load_snapshot)
+        '''
+        agency_data = getattr(self, agency)
+        id_values = agency_data[AGENCY_FIELDS[agency]['id']]
+        if not isinstance(id_values.dtype, pd.CategoricalDtype):
+            return agency_data
+        wanted = id_values.cat.categories.get_indexer(pd.unique(ids.to_numpy(dtype = object)))
+        rows = np.flatnonzero(np.isin(id_values.cat.codes.to_numpy(), wanted[wanted >= 0]))
+        return _decoded(agency_data.iloc[rows])
+
+    def _get_ratings(self, agency, data, id_col, date):
+        '''
+        shared lookup behind get_fitch_ratings, get_moodys_ratings and get_sp_ratings
+        only the id column of data is used, so wide caller frames are never copied
+        :param agency: 'moodys', 'sp' or 'fitch'
+        :return: one row per bond (or per rating action if date is 'incremental'), as dataframe
+        '''
+
+        fields = AGENCY_FIELDS[agency]
+        id_field = fields['id']
+        date_field = fields['date']
+
+        # organize the bonds you want to get ratings for
+        # keep just a dataframe with a single column of distinct bond identifiers (cusip or isin)
+        df = data[[id_col]].drop_duplicates()
+
+        if self.crosswalk is None:
+            # only bring along the agency columns the lookup returns, not the whole feed
+            agency_data = self._agency_rows(agency, df[id_col])
+            keep = [c for c in agency_data.columns if (c not in fields['drop']) or (c in [id_field, date_field])]
+
+            # merge the incremental agency ratings and only keep bonds from the target group above
+            df = df.merge(agency_data[keep], how = 'left', left_on = id_col, right_on = id_field)
+            if id_field != id_col:
+                del df[id_field]
+        else:
+            # resolve the identifiers to instruments and merge the instruments' rating histories
+            df['_instrument_key'] = self._resolve_key_codes(df[id_col], agency)
+            df = df.merge(self.crosswalk_history[agency], how = 'left', on = '_instrument_key')
+            del df['_instrument_key']
+            df = _decoded(df)
 
         # data cleanup
         # set a datetime object and sort
-        df['long_term_issue_rating_effective_date'] = pd.to_datetime(df['long_term_issue_rating_effective_date'])
-        df.sort_values(by = [id_col, 'long_term_issue_rating_effective_date'], inplace = True)
+        df[date_field] = pd.to_datetime(df[date_field])
+        df.sort_values(by = [id_col, date_field], inplace = True)
 
         # get the ratings you want
         # if you just want the current ratings, then keep the last rating action for each bond
@@ -140,35 +945,36 @@ class AgencyRatings():
         # then keep the most recent rating prior to the historical date
         else:
             end_of_date = datetime.datetime(date.year, date.month, date.day, 23,59,59)
-            df = df[df['long_term_issue_rating_effective_date'] <= end_of_date]
+            df = df[df[date_field] <= end_of_date]
             df.drop_duplicates(subset = id_col, keep = 'last', inplace = True)
 
-        # data cleanup
-        fitch_fields = ['agent_common_id',
-                        'issuer_name',
-                        'fitch_issue_id_number',
-                        'id_type',
-                        'id_value',
-                        'issue_description',
-                        'long_term_issue_rating_effective_date']
-
         # delete columns that aren't needed
-        for f in fitch_fields:
-
-            # if incremental production, then keep everything
-            if (date == 'incremental') & (f == 'long_term_issue_rating_effective_date'):
-                pass
-            # but if current or historical production, just keep the rating, rating date, and seniority
-            else:
-                del df[f]
+        # if incremental production, then keep the rating date
+        # but if current or historical production, just keep the rating and seniority
+        if date != 'incremental':
+            del df[date_field]
 
-        # data cleanup
-        df.rename(columns = {'long_term_issue_rating': 'fitch_rating',
-                            'long_term_issue_rating_effective_date': 'rating_date',
-                            'issue_debt_level_code': 'fitch_seniority'}, inplace = True)
+        df.rename(columns = fields['rename'], inplace = True)
 
         return df
 
+    @Instrumentation.instrumented
+    def get_fitch_ratings(self, data, id_col, date = 'current'):
+
+        '''
+        attach a column with fitch ratings to a dataset
+
+        pass in a dataframe with a group of bonds in the rows. we want to add a new column with the fitch rating
+
+        :param data: a dataset that contains bonds that you want the rating for, as dataframe
+        :id_col: the name of the column in the datset that contains either the cusip or isin, as string
+        :param date: date(s) of the ratings you want, either 'current', a date in datetime.date, or 'incremental'
+        :return: a dataset with an added fitch_rating column, as dataframe
+        '''
+
+        return self._get_ratings('fitch', data, id_col, date)
+
+    @Instrumentation.instrumented
     def get_moodys_ratings(self, data, id_col, date):
         '''
         attach a column with moodys ratings to a dataset
@@ -178,45 +984,9 @@ class AgencyRatings():
         :return: a dataset with an added moodys_rating column, as dataframe
         '''
 
+        return self._get_ratings('moodys', data, id_col, date)
 
-        df = data.copy()
-        df = df[[id_col]]
-
-
-        df = df.merge(self.moodys, how = 'left', left_on = id_col, right_on = 'instrument_id_value')
-
-        df['rating_date'] = pd.to_datetime(df['rating_date'])
-        df.sort_values(by = [id_col, 'rating_date'], inplace = True)
-
-        if date == 'current':
-            df.drop_duplicates(subset = id_col, keep = 'last', inplace = True)
-        elif date == 'incremental':
-            pass
-        else:
-            end_of_date = datetime.datetime(date.year, date.month, date.day, 23,59,59)
-            df = df[df['rating_date'] <= end_of_date]
-            df.drop_duplicates(subset = id_col, keep = 'last', inplace = True)
-
-        moodys_fields = ['instrument_id',
-                         'moodys_rating_id',
-                         'security_class_short_description',
-                         'id_type_text',
-                         'instrument_id_value',
-                         'rating_date',
-                         'rating_class_text',
-                         'rating_direction_short_description',
-                         'rating_type_short_description',
-                         'rating_currency_iso_code']
-        for f in moodys_fields:
-            if (date == 'incremental') & (f == 'rating_date'):
-                pass
-            else:
-                del df[f]
-        df.rename(columns = {'rating_text': 'moodys_rating',
-                            'seniority_short_description': 'moodys_seniority'}, inplace = True)
-
-        return df
-
+    @Instrumentation.instrumented
     def get_sp_ratings(self, data, id_col, date):
         '''
         attach a column with S&P ratings to a dataset
@@ -226,39 +996,9 @@ class AgencyRatings():
         :return: a dataset with an added sp_rating column, as dataframe
         '''
 
-        df = data.copy()
-        df = df[[id_col]]
-
-        df = df.merge(self.sp, how = 'left', left_on = id_col, right_on = 'id_value')
-
-        df['rating_date'] = pd.to_datetime(df['rating_date'])
-        df.sort_values(by = [id_col, 'rating_date'], inplace = True)
-
-        if date == 'current':
-            df.drop_duplicates(subset = id_col, keep = 'last', inplace = True)
-        elif date == 'incremental':
-            pass
-        else:
-            end_of_date = datetime.datetime(date.year, date.month, date.day, 23,59,59)
-            df = df[df['rating_date'] <= end_of_date]
-            df.drop_duplicates(subset = id_col, keep = 'last', inplace = True)
-
-        sp_fields = ['security_id',
-                     'security_symbol_value',
-                     'id_type',
-                     'id_value',
-                     'rating_date']
-
-        for f in sp_fields:
-            # don't delete rating date if incremental
-            if (date == 'incremental') & (f == 'rating_date'):
-                pass
-            else:
-                del df[f]
-        df.rename(columns = {'rating': 'sp_rating'}, inplace = True)
-
-        return df
+        return self._get_ratings('sp', data, id_col, date)
 
+    @Instrumentation.instrumented
     def get_time_series_by_id(self, data, id_col, start_date, end_date, verbose = False):
         '''
         generate a daily time series of ratings given a set of bonds
@@ -302,9 +1042,7 @@ class AgencyRatings():
         dates['from_date_template'] = 1
 
         # get a df with a columns of all cusips/isins
-        bonds = data.copy()
-        bonds = bonds[[id_col]]
-        bonds.drop_duplicates(subset = id_col, inplace = True)
+        bonds = data[[id_col]].drop_duplicates(subset = id_col)
         bonds['join'] = 1
 
         # combine daily date range with the bonds
@@ -349,7 +1087,12 @@ class AgencyRatings():
         dates.sort_values(by = [id_col, 'date'], inplace = True)
 
         # fill forward the ratings to convert from incremental to daily
-        dates = dates.groupby(by = id_col, as_index = False).fillna(method='ffill')
+        filled = dates.groupby(by = id_col, as_index = False).fillna(method='ffill')
+
+        # newer versions of pandas leave the grouping column out of the filled frame, so put it back
+        if id_col not in filled.columns:
+            filled[id_col] = dates[id_col]
+        dates = filled[dates.columns]
 
         # drop cases that are not from the date template
         # ie cases where we instantiate the rating at 1/1/1900
@@ -359,14 +1102,16 @@ class AgencyRatings():
 
 
 
-    def get_agency_ratings_by_id(self, data, id_col, date = 'current'):
+    @Instrumentation.instrumented
+    def get_agency_ratings_by_id(self, data, id_col, date = 'current', inplace = False):
         '''
         pass in a dataset that contains a column with cusips that you want to get agency ratings for
         get the agency rating for either the 'current' date or a specified historical date
         :param data: a dataset that contains bonds that you want the rating for, as dataframe
         :id_col: the name of the column in the datset that contains either the cusip or isin, as string
         :param date: date(s) of the ratings you want, either 'current', a date in datetime.date format, or 'incremental'
-        :return: a dataset with an added moodys_rating column, as dataframe
+        :param inplace: add the rating columns to data itself instead of returning a new dataframe, as boolean
+        :return: a dataset with an added moodys_rating column, as dataframe (data itself if inplace)
 
         '''
 
@@ -375,101 +1120,623 @@ class AgencyRatings():
         if date != 'current':
             assert isinstance(date, datetime.date), 'error: for non current date values you must pass date as datetime.date'
 
-        # get fitch ratings
-        fitch = self.get_fitch_ratings(data, id_col, date)
-        moodys = self.get_moodys_ratings(data, id_col, date)
-        sp = self.get_sp_ratings(data, id_col, date)
-
-        df = data.copy()
-
-        df = df.merge(moodys, how = 'left', left_on = id_col, right_on = id_col)
-
-        df = df.merge(sp, how = 'left', left_on = id_col, right_on = id_col)
-        df = df.merge(fitch, how = 'left', left_on = id_col, right_on = id_col)
+        # the ratings only depend on the set of bonds, the date, the agency data and whether the crosswalk is used
+        key = None
+        if self.cache is not None:
+            key = ('get_agency_ratings_by_id', self._fingerprint(data[id_col], ordered = False), id_col, date,
+                   self.data_version, self.crosswalk is not None)
+        ratings = self._cache_get(key)
+
+        if ratings is None:
+            # get fitch ratings
+            fitch = self.get_fitch_ratings(data, id_col, date)
+            moodys = self.get_moodys_ratings(data, id_col, date)
+            sp = self.get_sp_ratings(data, id_col, date)
+
+            # each lookup has one row per bond, so combine them first and join to data once
+            ratings = moodys.merge(sp, how = 'outer', left_on = id_col, right_on = id_col)
+            ratings = ratings.merge(fitch, how = 'outer', left_on = id_col, right_on = id_col)
+            self._cache_put(key, ratings)
+
+        if inplace:
+            # ratings has one row per bond, so line it up with the rows of data and copy the columns straight in
+            df = data
+            aligned = ratings.set_index(id_col).reindex(data[id_col].to_numpy())
+            for c in aligned.columns:
+                df[c] = aligned[c].to_numpy()
+        else:
+            df = data.merge(ratings, how = 'left', left_on = id_col, right_on = id_col)
 
         for rating in ['moodys_rating', 'sp_rating', 'fitch_rating']:
             df.loc[df[rating].isnull(), rating] = 'NR'
 
         return df
 
-    def get_average_ratings(self, data, require_two_agencies = True):
+    @Instrumentation.instrumented
+    def get_agency_ratings_by_dates(self, data, id_col, dates):
+        '''
+        agency ratings of a group of bonds on several historical dates
+        :param data: a dataset that contains bonds that you want the rating for, as dataframe
+        :id_col: the name of the column in the datset that contains either the cusip or isin, as string
+        :param dates: the dates of the ratings you want, as list of datetime.date
+        :return: one row per bond and date with columns id_col, date, moodys_rating, sp_rating, fitch_rating, as dataframe
+        '''
+
+        assert id_col in data.columns, 'error: could not find the id column in data'
+        bonds = data[[id_col]].drop_duplicates()
+
+        frames = []
+        for date in dates:
+            df = self.get_agency_ratings_by_id(bonds, id_col, date)
+            df.insert(1, 'date', date)
+            frames.append(df)
+        if len(frames) == 0:
+            return pd.DataFrame(columns = [id_col, 'date', 'moodys_rating', 'sp_rating', 'fitch_rating'])
+        return pd.concat(frames, ignore_index = True)
+
+    @Instrumentation.instrumented
+    def get_average_ratings(self, data, require_two_agencies = True, inplace = False, notching = None):
         '''
         calculate the average agency rating
         :param data: , a dataset with columns for moodys, sp and fitch alphanumeric ratings, as dataframe
         :param require_two_agencies: require at least two agency ratings in order to calculate average, as boolean,
+        :param inplace: add the new columns to data itself instead of to a copy, as boolean
+        :param notching: seniority notching table, {(agency, seniority): notches} or a list of (agency, seniority,
+                         notches), as dictionary or list (default: self.seniority_notching). data needs the seniority
+                         column of every agency in the table
         :return: the input dataset with new columns for average ratings
         '''
 
         for c in ['moodys_rating', 'sp_rating', 'fitch_rating']:
             assert c in data.columns, 'error: cannot find {} in data'.format(c)
 
-        # mapping from alphanumeric to numeric rating
-        self.numeric_dict = {'AAA': 21,
-                            'AA1': 20, 'AA2': 19, 'AA3': 18,
-                            'A1': 17, 'A2': 16, 'A3': 15,
-                            'BBB1': 14, 'BBB2': 13, 'BBB3': 12,
-                            'BB1': 11, 'BB2': 10, 'BB3': 9,
-                            'B1': 8, 'B2': 7, 'B3': 6,
-                            'CCC1': 5, 'CCC2': 4, 'CCC3': 3,
-                            'CC': 2, 'C': 1, 'D': 0,
+        notching = _notching_table(self.seniority_notching if notching is None else notching)
+        seniorities = [SENIORITY_COLUMNS[agency] for agency in sorted(notching)]
+        for c in seniorities:
+            assert c in data.columns, 'error: cannot find {} in data, it is needed for notching'.format(c)
+
+        # the average only depends on the three rating columns (and the seniorities that are notched on)
+        key = None
+        if self.cache is not None:
+            key = ('get_average_ratings',
+                   self._fingerprint(data[['moodys_rating', 'sp_rating', 'fitch_rating'] + seniorities]),
+                   require_two_agencies, tuple(sorted((a, s, n) for a in notching for s, n in notching[a].items())))
+        averages = self._cache_get(key)
+
+        df = data if inplace else data.copy()
+        if averages is not None:
+            for c in averages.columns:
+                df[c] = averages[c].to_numpy()
+            return df
 
-                            'Aaa': 21, 'Aa1': 20, 'Aa2': 19, 'Aa3': 18,
-                            'A1': 17, 'A2': 16, 'A3': 15,
-                            'Baa1': 14, 'Baa2': 13, 'Baa3': 12,
-                            'Ba1': 11, 'Ba2': 10, 'Ba3': 9,
-                            'Caa1': 5, 'Caa2': 4, 'Caa3': 3,
-                            'Ca': 2, 'C': 1,
+        # map alphanumeric ratings to a number
+        # (kept as arrays rather than temporary columns of df)
+        # notching based on seniority, applied to each agency's codes before averaging
+        nums = np.column_stack([self._notch(self._rating_codes(data[agency + '_rating']), notching.get(agency),
+                                            data[SENIORITY_COLUMNS[agency]] if agency in notching else None)
+                                for agency in ['moodys', 'sp', 'fitch']])
+        count = np.isfinite(nums).sum(axis = 1)
 
-                            'AA+': 20, 'AA': 19, 'AA-': 18,
-                            'A+': 17, 'A': 16, 'A-': 15,
-                            'BBB+': 14, 'BBB': 13, 'BBB-': 12,
-                            'BB+': 11, 'BB':10, 'BB-': 9,
-                            'B+': 8, 'B':7, 'B-': 6,
-                            'CCC+': 5, 'CCC': 4, 'CCC-': 3,
+        # calculate average agency rating
+        # offset numeric average by a small amount so that X.5 it gets rounded down to X and not rounded up to X + 1
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            average = np.nansum(nums, axis = 1) / count - 0.0002
+        average = np.round(average)
 
-                            'SD': 0, 'RD': 0, 'WR': np.NaN, 'NR': np.NaN, 'WD': np.NaN
-                             }
+        # null average if less than two agency ratings
+        if require_two_agencies == True:
+            average[count < 2] = np.NaN
 
-        # mapping from numeric to alphanumeric rating
-        self.alphanumeric_dict = {21: 'AAA',
-                                  20: 'AA1', 19: 'AA2', 18: 'AA3',
-                                  17: 'A1', 16: 'A2', 15: 'A3',
-                                  14: 'BBB1', 13: 'BBB2', 12: 'BBB3',
-                                  11: 'BB1', 10: 'BB2', 9: 'BB3',
-                                  8: 'B1', 7: 'B2', 6: 'B3',
-                                  5: 'CCC1', 4: 'CCC2', 3: 'CCC3',
-                                  2: 'CC', 1: 'C', 0: 'D',
-                                  'NaN': 'NR'
-                                  }
+        df['average_rating_num'] = average
+        df['agency_rating_count'] = count
 
-        df = data.copy()
+        # map numeric average to alphanumeric rating
+        df['average_rating'] = df['average_rating_num'].map(self.alphanumeric_dict)
+        df['average_rating'] = df['average_rating'].fillna('NR')
 
-        # map alphanumeric ratings to a number
-        df['moodys_num'] = df['moodys_rating'].map(self.numeric_dict)
-        df['sp_num'] = df['sp_rating'].map(self.numeric_dict)
-        df['fitch_num'] = df['fitch_rating'].map(self.numeric_dict)
+        self._cache_put(key, df[['average_rating_num', 'agency_rating_count', 'average_rating']])
 
-        # calculate average agency rating
-        # offset numeric average by a small amount so that X.5 it gets rounded down to X and not rounded up to X + 1
-        df['average_rating_num'] = df[ ['moodys_num', 'sp_num', 'fitch_num'] ].apply(np.mean, axis = 1) - 0.0002
-        mask = df['average_rating_num'].notnull()
-        df.loc[mask, 'average_rating_num'] = df.loc[mask, 'average_rating_num'].map(round)
-        df['agency_rating_count'] = df[ ['moodys_num', 'sp_num', 'fitch_num'] ].count(axis = 1)
+        return df
+
+    def _rating_codes(self, ratings):
+        '''
+        numeric codes of a column of alphanumeric ratings (NaN for NR, WR, WD and missing ratings)
+        each distinct rating is looked up once, so this stays cheap for daily panels with millions of rows
+        '''
+        codes, uniques = pd.factorize(ratings)
+        lookup = np.array([self.numeric_dict.get(r, np.NaN) for r in uniques] + [np.NaN], dtype = float)
+        return lookup[codes]
+
+    def _notch(self, nums, notches, seniority):
+        '''
+        add seniority notches to one agency's numeric ratings
+        notched ratings stay within C .. AAA and D (or a missing rating) is never notched
+        :param nums: numeric ratings, as array
+        :param notches: seniority -> notches for the agency, as dictionary (None: no notching)
+        :param seniority: the seniority of each rating, as series or array
+        '''
+        if not notches:
+            return nums
+        codes, uniques = pd.factorize(seniority)
+        lookup = np.array([notches.get(s, 0) for s in uniques] + [0], dtype = float)
+        notched = np.clip(nums + lookup[codes], 1, 21)
+        return np.where(nums == 0, nums, notched)
+
+    @Instrumentation.instrumented
+    def get_eligibility(self, data, inplace = False):
+        '''
+        flag C ratings, split ratings and IG portfolio eligibility from the moodys, sp and fitch ratings
+        works on any frame with the three rating columns: a point-in-time lookup or a daily panel from
+        get_time_series_by_id
+
+        c_rating: at least one agency rates the bond CCC+ / Caa1 or lower
+        split_2ig_1hy, split_1ig_2hy, split_1ig_1hy: the number of investment grade (BBB- / Baa3 or higher) and
+        high yield agency ratings
+        ig_portfolio_eligible: at least one investment grade rating and no more high yield than investment grade ratings
+        :param data: a dataset with columns for moodys, sp and fitch alphanumeric ratings, as dataframe
+        :param inplace: add the new columns to data itself instead of to a copy, as boolean
+        :return: the input dataset with the flag columns added (as 0 / 1), as dataframe
+        '''
+
+        for c in ['moodys_rating', 'sp_rating', 'fitch_rating']:
+            assert c in data.columns, 'error: cannot find {} in data'.format(c)
+
+        nums = np.column_stack([self._rating_codes(data[c]) for c in ['moodys_rating', 'sp_rating', 'fitch_rating']])
+
+        # comparisons with NaN are False, so unrated agencies count as neither
+        n_ig = (nums >= 12).sum(axis = 1)
+        n_hy = (nums <= 11).sum(axis = 1)
+
+        df = data if inplace else data.copy()
+        df['c_rating'] = (nums <= 5).any(axis = 1).astype(np.int8)
+        df['split_2ig_1hy'] = ((n_ig == 2) & (n_hy == 1)).astype(np.int8)
+        df['split_1ig_2hy'] = ((n_ig == 1) & (n_hy == 2)).astype(np.int8)
+        df['split_1ig_1hy'] = ((n_ig == 1) & (n_hy == 1)).astype(np.int8)
+        df['ig_portfolio_eligible'] = ((n_ig >= 1) & (n_ig >= n_hy)).astype(np.int8)
+
+        return df
+
+    @Instrumentation.instrumented
+    def build_composite_history(self):
+        '''
+        precompute the full agency composite rating (ACR) history of every bond
+
+        rather than running the three agency lookups and get_average_ratings for every date you need, this builds
+        the composite rating spells once: a new spell starts whenever any agency acts on a bond (consecutive spells
+        with the same average and agency count are merged). each spell has the average rating, the number of agencies
+        rating the bond and valid_from / valid_to dates (valid_to is NaT for the current spell).
+
+        the spells are kept sorted by bond and valid_from in self.composite_history, so a point-in-time composite
+        rating is one binary search per bond (see get_composite_ratings_asof). the history is saved with the snapshot.
+        the ratings are notched with self.seniority_notching as it is when the history is built.
+
+        bonds are identified by the id values in the feeds (8 digit cusip or isin), as in the lookups without a crosswalk
+        :return: None
+        '''
+
+        notching = _notching_table(self.seniority_notching)
+
+        ids = []
+        days = []
+        nums = []
+        agencies = []
+        for a, agency in enumerate(['moodys', 'sp', 'fitch']):
+            fields = AGENCY_FIELDS[agency]
+            agency_data = getattr(self, agency)
+            rating = [c for c, new in fields['rename'].items() if new == agency + '_rating'][0]
+            num = self._rating_codes(agency_data[rating])
+            if agency in notching:
+                seniority = [c for c, new in fields['rename'].items() if new == SENIORITY_COLUMNS[agency]][0]
+                num = self._notch(num, notching[agency], agency_data[seniority])
+
+            df = pd.DataFrame({'id': agency_data[fields['id']].to_numpy(dtype = object),
+                               'date': pd.to_datetime(agency_data[fields['date']]).to_numpy(),
+                               'num': num})
+            df = df[df['id'].notnull() & df['date'].notnull()]
+
+            # the rating on a day is the last action of that day, like the point-in-time lookups
+            df.sort_values(by = ['id', 'date'], kind = 'mergesort', inplace = True)
+            df['date'] = df['date'].dt.floor('D')
+            df.drop_duplicates(subset = ['id', 'date'], keep = 'last', inplace = True)
+
+            ids.append(df['id'].to_numpy())
+            days.append(df['date'].to_numpy())
+            nums.append(df['num'].to_numpy())
+            agencies.append(np.full(df.shape[0], a))
+
+        codes, unique_ids = pd.factorize(np.concatenate(ids))
+        days = np.concatenate(days)
+        nums = np.concatenate(nums)
+        agencies = np.concatenate(agencies)
+
+        # one spell start per bond and day on which any agency acted
+        order = np.lexsort((days, codes))
+        codes, days, nums, agencies = codes[order], days[order], nums[order], agencies[order]
+        new_spell = np.ones(len(codes), dtype = bool)
+        new_spell[1:] = (codes[1:] != codes[:-1]) | (days[1:] != days[:-1])
+        spell = np.cumsum(new_spell) - 1
+        spell_codes = codes[new_spell]
+        spell_days = days[new_spell]
+        n = len(spell_codes)
+
+        # first spell of each bond, so ratings are never carried forward from one bond to the next
+        first = np.ones(n, dtype = bool)
+        first[1:] = spell_codes[1:] != spell_codes[:-1]
+        bond_start = np.maximum.accumulate(np.where(first, np.arange(n), 0))
+
+        # carry each agency's latest rating forward through the spells of the bond
+        ratings = np.full((n, 3), np.NaN)
+        for a in range(3):
+            mask = agencies == a
+            acted = np.full(n, -1)
+            acted[spell[mask]] = spell[mask]
+            value = np.full(n, np.NaN)
+            value[spell[mask]] = nums[mask]
+            last = np.maximum.accumulate(acted)
+            valid = last >= bond_start
+            ratings[valid, a] = value[last[valid]]
+
+        # average agency rating, with the same offset and rounding as get_average_ratings
+        count = np.isfinite(ratings).sum(axis = 1)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            average = np.round(np.nansum(ratings, axis = 1) / count - 0.0002)
+
+        # merge consecutive spells of a bond that have the same composite rating
+        same = np.zeros(n, dtype = bool)
+        same[1:] = (~first[1:]) & (count[1:] == count[:-1]) & \
+                   ((average[1:] == average[:-1]) | (np.isnan(average[1:]) & np.isnan(average[:-1])))
+        keep = ~same
+        spell_codes, spell_days, average, count, first = \
+            spell_codes[keep], spell_days[keep], average[keep], count[keep], first[keep]
+
+        # a spell is valid until the day before the next spell of the same bond starts
+        valid_to = np.full(len(spell_codes), np.datetime64('NaT'), dtype = 'datetime64[ns]')
+        last_spell = np.ones(len(spell_codes), dtype = bool)
+        last_spell[:-1] = first[1:]
+        valid_to[~last_spell] = spell_days[1:][~last_spell[:-1]] - np.timedelta64(1, 'D')
+
+        self.composite_history = pd.DataFrame({'id': unique_ids[spell_codes],
+                                               'valid_from': spell_days,
+                                               'valid_to': valid_to,
+                                               'average_rating_num': average,
+                                               'agency_rating_count': count.astype(np.int8)})
+        self._index_composite_history()
+
+    def _index_composite_history(self):
+        '''
+        set up the arrays used for the as-of binary search over self.composite_history
+        each spell gets a sort key combining the bond code and the number of days since the earliest spell
+        '''
+
+        history = self.composite_history
+        codes, ids = pd.factorize(history['id'], sort = False)
+        days = history['valid_from'].to_numpy().astype('datetime64[D]').astype(np.int64)
+        first_day = days.min() if len(days) > 0 else 0
+        span = (days.max() - first_day + 2) if len(days) > 0 else 2
+        self.composite_index = {'ids': pd.Index(ids),
+                                'codes': codes,
+                                'days': days,
+                                'first_day': first_day,
+                                'span': span,
+                                'keys': codes.astype(np.int64) * span + (days - first_day)}
+
+    @Instrumentation.instrumented
+    def get_composite_ratings_asof(self, data, id_col, date, require_two_agencies = True, inplace = False):
+        '''
+        point-in-time agency composite ratings from the materialized history (see build_composite_history)
+        gives the same average_rating_num, agency_rating_count and average_rating columns as running
+        get_agency_ratings_by_id and then get_average_ratings, without any merges
+        :param data: a dataset that contains bonds that you want the rating for, as dataframe
+        :id_col: the name of the column in the datset that contains either the cusip or isin, as string
+        :param date: the date of the ratings, as datetime.date, or the name of a column in data with a date per row
+        :param require_two_agencies: require at least two agency ratings in order to calculate average, as boolean,
+        :param inplace: add the new columns to data itself instead of to a copy, as boolean
+        :return: the input dataset with new columns for average ratings
+        '''
+
+        assert id_col in data.columns, 'error: could not find the id column in data'
+        if self.composite_history is None:
+            self.build_composite_history()
+        index = self.composite_index
+
+        if isinstance(date, str):
+            assert date in data.columns, 'error: could not find the date column in data'
+            days = pd.to_datetime(data[date]).to_numpy().astype('datetime64[D]').astype(np.int64)
+        else:
+            assert isinstance(date, datetime.date), 'error: date must be a datetime.date or a column of data'
+            days = np.full(data.shape[0], np.datetime64(date, 'D').astype(np.int64))
 
-        del df['moodys_num']
-        del df['sp_num']
-        del df['fitch_num']
+        # one binary search per bond: the last spell of the bond that starts on or before the date
+        codes = index['ids'].get_indexer(data[id_col].to_numpy(dtype = object))
+        offset = np.clip(days - index['first_day'], 0, index['span'] - 1)
+        pos = np.searchsorted(index['keys'], codes.astype(np.int64) * index['span'] + offset, side = 'right') - 1
+        pos_ok = np.clip(pos, 0, None)
+        found = (codes >= 0) & (pos >= 0) & (index['codes'][pos_ok] == codes) & (index['days'][pos_ok] <= days)
+
+        average = np.where(found, self.composite_history['average_rating_num'].to_numpy()[pos_ok], np.NaN)
+        count = np.where(found, self.composite_history['agency_rating_count'].to_numpy()[pos_ok], 0).astype(np.int64)
 
         # null average if less than two agency ratings
         if require_two_agencies == True:
-            mask1 = df['agency_rating_count'] < 2
-            df.loc[mask1, 'average_rating_num'] = np.NaN
-
-        # notching based on seniority
-        # TO DO
+            average[count < 2] = np.NaN
 
-        # map numeric average to alphanumeric rating
+        df = data if inplace else data.copy()
+        df['average_rating_num'] = average
+        df['agency_rating_count'] = count
         df['average_rating'] = df['average_rating_num'].map(self.alphanumeric_dict)
         df['average_rating'] = df['average_rating'].fillna('NR')
 
-        return df
\ No newline at end of file
+        return df
+
+    @Instrumentation.instrumented
+    def get_native_transition_matrices(self, start_date, end_date, ids = None, rated_at_start = True):
+        '''
+        transition matrices of each agency on its own rating scale, from start_date to end_date
+        unlike the composite matrices these keep the agency symbols (eg Baa2, BBB-), SD / RD and the withdrawn and not
+        rated states (WR, WD, NR), see RatingsTransitionMatrix.NATIVE_SCALES
+
+        every instrument of an agency (by the agency's own instrument key, so a bond with both a cusip and an isin row
+        is counted once) is one case: its last rating on or before each date. the rating on each date is found with a
+        binary search over the sorted rating actions of all instruments at once, no lookup or merge per bond
+        :param start_date: the start of the period, as datetime.date
+        :param end_date: the end of the period, as datetime.date
+        :param ids: only the instruments with one of these cusips or isins, as list-like (default: all of them)
+        :param rated_at_start: leave out instruments that are withdrawn or not rated at the start, as boolean
+        :return: agency -> RatingsTransitionMatrix over its native scale, as dictionary
+        '''
+        # RatingsTransitionMatrix brings in sqlalchemy, only import it when native matrices are asked for
+        import RatingsTransitionMatrix
+
+        assert start_date <= end_date, 'error: start_date must not be after end_date'
+        start_day = np.datetime64(start_date, 'D').astype(np.int64)
+        end_day = np.datetime64(end_date, 'D').astype(np.int64)
+        if ids is not None:
+            ids = pd.unique(Identifiers.normalize_ids(ids)['id'].dropna().to_numpy(dtype = object))
+
+        matrices = {}
+        for agency in ['moodys', 'sp', 'fitch']:
+            fields = AGENCY_FIELDS[agency]
+            agency_data = getattr(self, agency)
+            rtm = RatingsTransitionMatrix.RatingsTransitionMatrix.native(agency)
+            rating = [c for c, new in fields['rename'].items() if new == agency + '_rating'][0]
+
+            keys = agency_data[fields['key']].to_numpy(dtype = object)
+            days = pd.to_datetime(agency_data[fields['date']]).to_numpy().astype('datetime64[D]')
+            known = pd.notnull(keys) & ~np.isnat(days)
+            if ids is not None:
+                # every action of the instruments that have one of the ids
+                wanted = pd.unique(keys[known & agency_data[fields['id']].isin(ids).to_numpy()])
+                known &= pd.Series(keys, dtype = object).isin(wanted).to_numpy()
+            codes, _ = pd.factorize(keys[known])
+            days = days[known].astype(np.int64)
+            states = rtm._codes(agency_data[rating].to_numpy(dtype = object)[known])
+
+            # sort the actions by instrument and day (stable, so the last action of a day wins the search)
+            first_day = min(days.min(), start_day) if len(days) > 0 else start_day
+            span = max(days.max() if len(days) > 0 else end_day, end_day) - first_day + 2
+            sort_keys = codes.astype(np.int64) * span + (days - first_day)
+            order = np.argsort(sort_keys, kind = 'mergesort')
+            sort_keys, codes, days, states = sort_keys[order], codes[order], days[order], states[order]
+
+            # the last action of each instrument on or before each date
+            instruments = np.arange(codes.max() + 1 if len(codes) > 0 else 0, dtype = np.int64)
+            found = []
+            for day in [start_day, end_day]:
+                pos = np.searchsorted(sort_keys, instruments * span + (day - first_day), side = 'right') - 1
+                pos_ok = np.clip(pos, 0, None)
+                ok = (pos >= 0) & (codes[pos_ok] == instruments) & (days[pos_ok] <= day)
+                found.append(np.where(ok, states[pos_ok], -1))
+
+            start, end = found
+            if rated_at_start:
+                start = np.where(start < rtm.n_ratings, start, -1)
+            rtm.load_codes(start, end)
+            matrices[agency] = rtm
+
+        return matrices
+
+    @Instrumentation.instrumented
+    def get_default_spells(self, start_date = None, end_date = None, require_two_agencies = True):
+        '''
+        one time-to-default spell per bond from the composite rating history, the input of DefaultSurvival
+
+        a bond enters on start_date with its composite rating on that date (a cohort), or without a start_date on the
+        first day it has a composite rating. it leaves on the first day after it enters that any agency rates it
+        D / SD / RD (defaulted), the first day it no longer has a composite rating, eg because the agencies withdrew
+        their ratings (withdrawn, ie censored), or at end_date (censored), whichever comes first.
+        bonds rated D when they enter are left out. everything is found with binary searches over the sorted spells
+        and default actions of all bonds, there is no daily panel
+        :param start_date: the cohort date, as datetime.date (default: each bond enters when it is first rated)
+        :param end_date: the end of the observation period, as datetime.date (default: the latest rating action)
+        :param require_two_agencies: a bond only has a composite rating with at least two agency ratings, as boolean
+        :return: id, entry_date, initial_rating_num, initial_rating, exit_date, days, defaulted (0 / 1) and
+                 withdrawn (0 / 1) columns, one row per bond, as dataframe
+        '''
+
+        if self.composite_history is None:
+            self.build_composite_history()
+        history = self.composite_history
+        index = self.composite_index
+        codes = index['codes']
+        days = index['days']
+        average = history['average_rating_num'].to_numpy()
+        rated = np.isfinite(average) & (history['agency_rating_count'].to_numpy() >= (2 if require_two_agencies else 1))
+        n = len(codes)
+        n_bonds = len(index['ids'])
+        last_day = days.max() if n > 0 else 0
+        end_day = last_day if end_date is None else np.datetime64(end_date, 'D').astype(np.int64)
+
+        # the spell each bond enters with
+        if start_date is not None:
+            start_day = np.datetime64(start_date, 'D').astype(np.int64)
+            bonds = np.arange(n_bonds, dtype = np.int64)
+            offset = np.clip(start_day - index['first_day'], 0, index['span'] - 1)
+            entry = np.searchsorted(index['keys'], bonds * index['span'] + offset, side = 'right') - 1
+            entry_ok = np.clip(entry, 0, None)
+            keep = (entry >= 0) & (codes[entry_ok] == bonds) & (days[entry_ok] <= start_day)
+            entry = entry_ok[keep]
+            keep = rated[entry]
+            entry = entry[keep]
+            entry_day = np.full(len(entry), start_day)
+        else:
+            # the first rated spell of each bond
+            first_rated = np.ones(int(rated.sum()), dtype = bool)
+            rated_codes = codes[rated]
+            first_rated[1:] = rated_codes[1:] != rated_codes[:-1]
+            entry = np.flatnonzero(rated)[first_rated]
+            entry_day = days[entry]
+        keep = (average[entry] > 0) & (entry_day <= end_day)
+        entry, entry_day = entry[keep], entry_day[keep]
+        bond = codes[entry]
+
+        # withdrawn: the first spell after the entry spell without a composite rating
+        positions = np.arange(n)
+        next_unrated = np.where(rated, n, positions)
+        next_unrated = np.minimum.accumulate(np.append(next_unrated, n)[::-1])[::-1]
+        withdrawal = next_unrated[entry + 1]
+        withdrawal_ok = np.clip(withdrawal, 0, max(n - 1, 0))
+        never = np.iinfo(np.int64).max
+        if n > 0:
+            withdrawn_day = np.where((withdrawal < n) & (codes[withdrawal_ok] == bond), days[withdrawal_ok], never)
+        else:
+            withdrawn_day = np.full(0, never)
+
+        # defaulted: the first action of any agency rating the bond D / SD / RD after it enters
+        default_codes = []
+        default_days = []
+        for agency in ['moodys', 'sp', 'fitch']:
+            fields = AGENCY_FIELDS[agency]
+            agency_data = getattr(self, agency)
+            rating = [c for c, new in fields['rename'].items() if new == agency + '_rating'][0]
+            defaulted = self._rating_codes(agency_data[rating]) == 0
+            ids = agency_data[fields['id']].to_numpy(dtype = object)[defaulted]
+            default_codes.append(index['ids'].get_indexer(ids))
+            dates = pd.to_datetime(agency_data[fields['date']][defaulted]).to_numpy()
+            default_days.append(dates.astype('datetime64[D]'))
+        default_codes = np.concatenate(default_codes).astype(np.int64)
+        default_days = np.concatenate(default_days)
+        known = (default_codes >= 0) & ~np.isnat(default_days)
+        default_codes = default_codes[known]
+        default_days = default_days[known].astype(np.int64)
+
+        # same kind of sort key as the composite index, bonds can't default before their first spell
+        known = default_days >= index['first_day']
+        default_codes, default_days = default_codes[known], default_days[known] - index['first_day']
+        span = max(int(default_days.max()) if len(default_days) > 0 else 0, int(end_day - index['first_day'])) + 2
+        default_keys = np.sort(default_codes * span + default_days)
+        pos = np.searchsorted(default_keys, bond * span + (entry_day - index['first_day']), side = 'right')
+        pos_ok = np.clip(pos, 0, len(default_keys) - 1)
+        if len(default_keys) > 0:
+            found = (pos < len(default_keys)) & (default_keys[pos_ok] // span == bond)
+            default_day = np.where(found, default_keys[pos_ok] % span + index['first_day'], never)
+        else:
+            default_day = np.full(len(bond), never)
+
+        # the spell ends at whichever comes first
+        exit_day = np.minimum(np.minimum(default_day, withdrawn_day), end_day)
+        defaulted = (default_day <= withdrawn_day) & (default_day <= end_day)
+        withdrawn = (withdrawn_day < default_day) & (withdrawn_day <= end_day)
+
+        df = pd.DataFrame({'id': index['ids'][bond],
+                           'entry_date': entry_day.astype('datetime64[D]').astype('datetime64[ns]'),
+                           'initial_rating_num': average[entry],
+                           'exit_date': exit_day.astype('datetime64[D]').astype('datetime64[ns]'),
+                           'days': exit_day - entry_day,
+                           'defaulted': defaulted.astype(np.int8),
+                           'withdrawn': withdrawn.astype(np.int8)})
+        df.insert(3, 'initial_rating', df['initial_rating_num'].map(self.alphanumeric_dict))
+        return df
+
+    @Instrumentation.instrumented
+    def get_ratings_parallel(self, data, id_col, method = 'get_agency_ratings_by_id', average = False,
+                             require_two_agencies = True, n_jobs = None, snapshot_path = None, **kwargs):
+        '''
+        run a lookup over a process pool
+        the bonds are hash-partitioned on id_col so every bond lands in exactly one partition, each partition runs
+        the lookup (and the composite rating if average is True) in a worker process, and the partition results are
+        put back together in the original order
+
+        the workers do not receive a pickled copy of the agency data. they memory map a snapshot of it instead:
+        either the snapshot this object was loaded from, the one given in snapshot_path, or a temporary one.
+        the settings that change the results (self.seniority_notching and the crosswalk, if built) are passed on to
+        the workers
+
+        :param data: a dataset that contains bonds that you want the rating for, as dataframe
+        :id_col: the name of the column in the datset that contains either the cusip or isin, as string
+        :param method: the lookup to run, one of 'get_agency_ratings_by_id', 'get_time_series_by_id' or 'get_average_ratings'
+        :param average: also calculate the average agency rating of each partition, as boolean
+        :param require_two_agencies: passed to get_average_ratings, as boolean
+        :param n_jobs: number of worker processes, as int (default: number of cpus)
+        :param snapshot_path: directory of an existing snapshot (or where to write one) for the workers, as string
+        :param kwargs: other arguments for the lookup, ie date or start_date and end_date
+        :return: the same rows in the same order as calling the lookup directly, as dataframe (time series come back
+                 with a new 0 .. n - 1 index rather than the index left over from the merges)
+        '''
+
+        assert method in ['get_agency_ratings_by_id', 'get_time_series_by_id', 'get_average_ratings'], \
+            'error: cannot run {} in parallel'.format(method)
+        assert id_col in data.columns, 'error: could not find the id column in data'
+
+        if method != 'get_average_ratings':
+            kwargs['id_col'] = id_col
+
+        # nothing to partition: run the lookup (and the composite rating) here, exactly as a worker would
+        if data.shape[0] == 0:
+            df = getattr(self, method)(data, **kwargs)
+            if average:
+                df = self.get_average_ratings(df, require_two_agencies = require_two_agencies)
+            return df
+
+        if n_jobs is None:
+            n_jobs = os.cpu_count() or 1
+
+        # the workers need a snapshot of the agency data to memory map
+        temp_dir = None
+        if snapshot_path is None:
+            snapshot_path = self.snapshot_path
+        if snapshot_path is None:
+            temp_dir = tempfile.mkdtemp(prefix = 'agency_snapshot_')
+            snapshot_path = temp_dir
+            self.save_snapshot(snapshot_path)
+        elif not os.path.exists(os.path.join(snapshot_path, 'moodys', 'columns.json')):
+            self.save_snapshot(snapshot_path)
+
+        # keep track of the original row order so we can restore it after the partitions come back
+        df = data.copy() if method != 'get_time_series_by_id' else data[[id_col]].copy()
+        df['_parallel_row'] = np.arange(df.shape[0])
+
+        # hash-partition the bonds on their identifier
+        partition = pd.util.hash_pandas_object(df[id_col], index = False).to_numpy() % n_jobs
+
+        tasks = []
+        for p in range(n_jobs):
+            part = df[partition == p]
+            if part.shape[0] > 0:
+                tasks.append((method, part.reset_index(drop = True), kwargs, average, require_two_agencies))
+
+        config = {'seniority_notching': self.seniority_notching,
+                  'crosswalk': self.crosswalk,
+                  'crosswalk_stats': self.crosswalk_stats}
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers = n_jobs,
+                                                        initializer = _init_worker,
+                                                        initargs = (snapshot_path, config)) as pool:
+                results = list(pool.map(_run_partition, tasks))
+        finally:
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors = True)
+                self.snapshot_path = None
+
+        df = pd.concat(results, ignore_index = True, sort = False)
+
+        # put the rows back in the original order
+        if '_parallel_row' in df.columns:
+            df.sort_values(by = '_parallel_row', kind = 'mergesort', inplace = True)
+            del df['_parallel_row']
+        else:
+            # time series: sorted by bond and date, like get_time_series_by_id
+            df.sort_values(by = [id_col, 'date'], kind = 'mergesort', inplace = True)
+
+        df.reset_index(drop = True, inplace = True)
+        return df
@@ -0,0 +1,133 @@
+'''
+Column-per-file storage for dataframes.
+
+Every column is written as its own .npy file next to a small columns.json that records the column names and
+how each column was encoded. Numeric, boolean and datetime columns are saved as-is, string columns are dictionary
+encoded: integer codes (-1 for null) plus a small array with each distinct string once.
+
+Because every column is a plain .npy file, a frame can be read back with numpy memory mapping: several processes
+reading the same directory share the pages through the OS file cache instead of each receiving a pickled copy.
+read_frame(..., decode = False) keeps the string columns as categoricals over the memory-mapped codes, so a process
+only turns the rows it actually uses back into strings.
+'''
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+def _code_dtype(n_categories):
+    '''
+    the integer type pandas uses for the codes of a categorical with n_categories categories, codes stored with
+    this type are used by the categorical as they are (no copy of a memory-mapped file)
+    '''
+    for dtype in [np.int8, np.int16, np.int32]:
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def write_frame(df, path):
+    '''
+    write a dataframe to a directory with one .npy file per column
+    :param df: the data to write, as dataframe
+    :param path: the directory to write to (created if it does not exist), as string
+    :return: None
+    '''
+
+    os.makedirs(path, exist_ok = True)
+
+    meta = {'rows': int(df.shape[0]), 'columns': []}
+    for i, c in enumerate(df.columns):
+        values = df.iloc[:, i]
+        file_name = 'col{}'.format(i)
+
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # categoricals keep their (small) integer codes and a separate list of categories
+            np.save(os.path.join(path, file_name + '.npy'), values.cat.codes.to_numpy())
+            categories = values.cat.categories.to_numpy()
+            np.save(os.path.join(path, file_name + '.categories.npy'), categories.astype(str))
+            kind = 'category'
+        elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_datetime64_dtype(values):
+            np.save(os.path.join(path, file_name + '.npy'), values.to_numpy())
+            kind = 'array'
+        else:
+            # strings (and anything else) are dictionary encoded: a code per row and each distinct string once
+            codes, categories = pd.factorize(values.where(values.isnull(), values.astype(str)))
+            np.save(os.path.join(path, file_name + '.npy'), codes.astype(_code_dtype(len(categories))))
+            np.save(os.path.join(path, file_name + '.categories.npy'), np.asarray(categories, dtype = str))
+            kind = 'dictionary'
+
+        meta['columns'].append({'name': c, 'file': file_name, 'kind': kind})
+
+    with open(os.path.join(path, 'columns.json'), 'w') as f:
+        json.dump(meta, f)
+
+    return None
+
+
+def read_frame(path, columns = None, mmap = True, rows = None, decode = True):
+    '''
+    read a dataframe written by write_frame
+    :param path: the directory the frame was written to, as string
+    :param columns: only read these columns, as list of strings (default: all columns)
+    :param mmap: memory map the column files instead of reading them into memory, as boolean
+    :param rows: only read these row positions, as array of ints or boolean mask (default: all rows)
+    :param decode: turn string columns back into strings, else they are categoricals over the stored codes, as boolean
+    :return: the stored data, as dataframe
+    '''
+
+    with open(os.path.join(path, 'columns.json')) as f:
+        meta = json.load(f)
+
+    mmap_mode = 'r' if mmap else None
+    data = {}
+    for c in meta['columns']:
+        if (columns is not None) and (c['name'] not in columns):
+            continue
+
+        values = np.load(os.path.join(path, c['file'] + '.npy'), mmap_mode = mmap_mode)
+        if rows is not None:
+            # with memory mapping only the pages holding the selected rows are read from disk
+            values = values[rows]
+        if c['kind'] == 'category':
+            categories = np.load(os.path.join(path, c['file'] + '.categories.npy'))
+            data[c['name']] = pd.Categorical.from_codes(np.asarray(values), categories = categories)
+        elif c['kind'] == 'dictionary':
+            categories = np.load(os.path.join(path, c['file'] + '.categories.npy'))
+            if decode:
+                codes = np.asarray(values)
+                decoded = np.full(codes.shape[0], np.NaN, dtype = object)
+                decoded[codes >= 0] = categories.astype(object)[codes[codes >= 0]]
+                data[c['name']] = decoded
+            else:
+                data[c['name']] = pd.Categorical.from_codes(values, categories = categories)
+        else:
+            data[c['name']] = values
+
+    if rows is None:
+        n_rows = meta['rows']
+    elif np.asarray(rows).dtype == bool:
+        n_rows = int(np.count_nonzero(rows))
+    else:
+        n_rows = len(rows)
+    # copy = False keeps the columns on the memory-mapped files
+    df = pd.DataFrame(data, index = pd.RangeIndex(n_rows), copy = False)
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+
+def row_ranges(starts, ends):
+    '''
+    the row positions of several row ranges, eg for read_frame(..., rows = ...): the concatenation of
+    np.arange(s, e) for every pair of starts and ends, without a python loop
+    :param starts: the first row of each range, as array of ints
+    :param ends: one past the last row of each range, as array of ints
+    :return: the row positions, as array of ints
+    '''
+    lengths = ends - starts
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype = np.int64)
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(lengths.sum()) + offsets
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+
+
+class DefaultSurvival():
+    '''
+    Kaplan-Meier time-to-default curves per initial rating (or any other segment), at daily resolution
+
+    get_default_prob gives the probability of default over one period of a transition matrix. This class takes one
+    spell per bond instead (the days from entering the cohort to defaulting, or to being censored when the ratings are
+    withdrawn or the observation period ends, see AgencyRatings.get_default_spells) and estimates the whole term
+    structure of default probabilities:
+
+        spells = agency_ratings.get_default_spells(start_date=datetime.date(2010, 1, 1))
+        survival = DefaultSurvival.from_spells(spells)
+        survival.curves(days=[365, 730, 1825])   # cumulative default probability at 1, 2 and 5 years
+
+    Withdrawal is censoring: a bond whose ratings are withdrawn counts as at risk up to the withdrawal and is then
+    left out, it is not counted as a default or as a survivor.
+
+    All groups are estimated in one pass: the spells are sorted by group and day, the defaults and censorings of each
+    distinct (group, day) are counted with np.unique and the number at risk is the group size minus the exits before
+    that day. self.table holds one row per group and day with an exit:
+    group, day, at_risk, defaults, censored, survival, default_probability (1 - survival) and std_error (Greenwood)
+    '''
+
+    def __init__(self, days, defaulted, groups=None):
+        '''
+        :param days: days from entry to default or censoring of each spell, as int array
+        :param defaulted: whether each spell ended in default (else it was censored), as boolean array
+        :param groups: the group of each spell, eg its initial rating, as list-like (default: one group 'all')
+        '''
+        days = np.asarray(days, dtype=np.int64)
+        defaulted = np.asarray(defaulted).astype(bool)
+        assert days.shape == defaulted.shape, 'error: need one default flag per spell'
+        assert (days >= 0).all(), 'error: days must not be negative'
+        if groups is None:
+            groups = np.full(len(days), 'all', dtype=object)
+        assert len(groups) == len(days), 'error: need one group per spell'
+
+        # groups keep the order in which they first appear
+        group_codes, self.groups = pd.factorize(np.asarray(groups, dtype=object))
+        self.groups = list(self.groups)
+        k = len(self.groups)
+        span = int(days.max()) + 1 if len(days) > 0 else 1
+
+        # defaults and exits per distinct (group, day)
+        keys, inverse = np.unique(group_codes.astype(np.int64) * span + days, return_inverse=True)
+        exits = np.bincount(inverse, minlength=len(keys))
+        defaults = np.bincount(inverse, weights=defaulted, minlength=len(keys)).astype(np.int64)
+        group = keys // span
+        day = keys % span
+
+        # at risk: the group size minus everything that left on an earlier day of the group
+        sizes = np.bincount(group_codes, minlength=k)
+        left = np.cumsum(exits) - exits
+        group_start = np.searchsorted(group, np.arange(k))
+        at_risk = sizes[group] - (left - left[group_start[group]])
+
+        # survival = product over days of (1 - defaults / at_risk), as a sum of logs within each group. a day on which
+        # everyone at risk defaults sets the survival to 0 for the rest of the group
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wiped_out = defaults == at_risk
+            log_terms = np.where(wiped_out, 0.0, np.log1p(-defaults / at_risk))
+            greenwood_terms = np.where(wiped_out, 0.0, defaults / (at_risk * (at_risk - defaults)))
+        survival = np.where(self._group_cumsum(wiped_out, group, group_start) > 0, 0.0,
+                            np.exp(self._group_cumsum(log_terms, group, group_start)))
+        std_error = survival * np.sqrt(self._group_cumsum(greenwood_terms, group, group_start))
+
+        labels = np.empty(k, dtype=object)
+        labels[:] = self.groups
+        self.table = pd.DataFrame({'group': labels[group],
+                                   'day': day,
+                                   'at_risk': at_risk,
+                                   'defaults': defaults,
+                                   'censored': exits - defaults,
+                                   'survival': survival,
+                                   'default_probability': 1 - survival,
+                                   'std_error': std_error})
+        self.sizes = dict(zip(self.groups, sizes))
+        self._keys = keys
+        self._span = span
+
+    @staticmethod
+    def _group_cumsum(values, group, group_start):
+        '''
+        running sum of values restarting at each group (the rows are sorted by group)
+        '''
+        total = np.cumsum(values, dtype=float)
+        before = total - values
+        return total - before[group_start[group]]
+
+    @classmethod
+    def from_spells(cls, spells, group_col='initial_rating'):
+        '''
+        :param spells: the days and defaulted columns of AgencyRatings.get_default_spells, plus any segment column,
+                       as dataframe
+        :param group_col: the column to estimate a curve for each value of, as string (None: one curve for all spells)
+        :return: DefaultSurvival, initial ratings are ordered best first
+        '''
+        assert 'days' in spells.columns and 'defaulted' in spells.columns, \
+            'error: spells need days and defaulted columns'
+        if group_col is None:
+            return cls(spells['days'].to_numpy(), spells['defaulted'].to_numpy())
+        assert group_col in spells.columns, 'error: could not find the group column in spells'
+        if group_col == 'initial_rating' and 'initial_rating_num' in spells.columns:
+            spells = spells.sort_values(by='initial_rating_num', ascending=False, kind='mergesort')
+        return cls(spells['days'].to_numpy(), spells['defaulted'].to_numpy(), groups=spells[group_col].to_numpy())
+
+    def curves(self, days=None, kind='default_probability'):
+        '''
+        term structures of every group on a grid of days, the estimates are step functions of the day
+        :param days: horizons in days since entry, as list-like (default: every day up to the last exit)
+        :param kind: 'default_probability', 'survival' or 'std_error'
+        :return: one row per day and one column per group, as dataframe
+        '''
+        assert kind in ['default_probability', 'survival', 'std_error'], \
+            'error: kind must be default_probability, survival or std_error'
+        if days is None:
+            days = np.arange(self._span)
+        days = np.asarray(days, dtype=np.int64)
+        values = self.table[kind].to_numpy()
+
+        # the last row of the group on or before each day, before the first exit nothing has happened yet
+        k = len(self.groups)
+        clipped = np.clip(days, 0, self._span - 1)
+        groups = np.repeat(np.arange(k, dtype=np.int64), len(days))
+        targets = groups * self._span + np.tile(clipped, k)
+        pos = np.searchsorted(self._keys, targets, side='right') - 1
+        pos_ok = np.clip(pos, 0, None)
+        found = (pos >= 0) & (self._keys[pos_ok] // self._span == groups) if len(self._keys) > 0 \
+            else np.zeros(len(targets), dtype=bool)
+        start = 0.0 if kind != 'survival' else 1.0
+        result = np.where(found, values[pos_ok] if len(values) > 0 else start, start)
+        return pd.DataFrame(result.reshape(k, len(days)).T, index=pd.Index(days, name='day'), columns=self.groups)
+
+    def summary(self, days=(365, 730, 1095, 1825)):
+        '''
+        one row per group with the number of spells, defaults and censorings and the default probability at a few
+        horizons
+        :param days: the horizons, as list-like
+        :return: group, spells, defaults, censored and default_probability_<day> columns, as dataframe
+        '''
+        counts = self.table.groupby('group', sort=False)[['defaults', 'censored']].sum()
+        df = pd.DataFrame({'group': self.groups, 'spells': [self.sizes[g] for g in self.groups]})
+        df['defaults'] = counts['defaults'].reindex(self.groups).fillna(0).to_numpy().astype(np.int64)
+        df['censored'] = counts['censored'].reindex(self.groups).fillna(0).to_numpy().astype(np.int64)
+        curves = self.curves(days=days)
+        for day in days:
+            df['default_probability_{}'.format(day)] = curves.loc[day].to_numpy()
+        return df
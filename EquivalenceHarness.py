@@ -0,0 +1,535 @@
+'''
+Golden-output equivalence harness for the optimized AgencyRatings and RatingsTransitionMatrix code paths.
+
+reference/ holds the original implementations of AgencyRatings and RatingsTransitionMatrix (unchanged apart from
+the data path of load_agency_data). The harness generates synthetic agency feeds and constituents with
+SyntheticAgencyData, runs every check through the reference implementation and through each optimized path on the
+same inputs, and asserts the outputs are identical:
+
+- load_agency_data: the cleaned moodys, sp and fitch frames
+- get_agency_ratings_by_id: plain, compacted and partitioned-store lookups ('NR' for bonds without a rating), and
+  compacted lookups on feeds where one cusip is shared by several agency instruments
+- the lookup modes: inplace, crosswalk, get_ratings_parallel (with and without the crosswalk) and the result cache,
+  including a hit and the lookups after load_agency / load_agency_data switched to other feeds
+- get_average_ratings: the composite rating with the - 0.0002 rounding offset, with and without two agencies
+- get_composite_ratings_asof: the materialized composite history against lookup + average
+- get_time_series_by_id: the daily panel
+- load_rtm / load_oas_change_matrix: the skip rules for NR and missing oas changes, and the three matrices
+- StudyPipeline: the whole study with the constituents read from csv files and from a SQLite database
+
+Every path records its wall time and peak traced memory (see Instrumentation). A path fails its gate when it is
+slower or uses more memory than a configured limit, or than the same path in an earlier run by more than the
+tolerance:
+
+    python EquivalenceHarness.py --n-bonds 5000 --output equivalence.json
+    python EquivalenceHarness.py --n-bonds 5000 --baseline equivalence.json --tolerance 0.25
+'''
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import AgencyRatings
+import Instrumentation
+import RatingsTransitionMatrix
+import StudyPipeline
+import SyntheticAgencyData
+
+
+REFERENCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference')
+
+RATING_COLUMNS = ['moodys_rating', 'sp_rating', 'fitch_rating']
+AVERAGE_COLUMNS = ['average_rating_num', 'agency_rating_count', 'average_rating']
+
+
+def _load_reference(name):
+    '''
+    import reference/<name>.py under its own module name, so it can't be mistaken for the optimized module
+    '''
+    spec = importlib.util.spec_from_file_location('reference_' + name, os.path.join(REFERENCE_PATH, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _same_frames(reference, optimized, columns = None, keys = None):
+    '''
+    compare two frames on the given columns (default: the reference columns), after sorting by keys
+    :return: None if they are identical, else a description of the first difference, as string
+    '''
+    columns = list(reference.columns) if columns is None else columns
+    missing = [c for c in columns if c not in optimized.columns]
+    if missing:
+        return 'missing columns {}'.format(missing)
+
+    reference = reference[columns]
+    optimized = optimized[columns]
+    if keys is not None:
+        reference = reference.sort_values(by = keys, kind = 'mergesort')
+        optimized = optimized.sort_values(by = keys, kind = 'mergesort')
+    try:
+        pd.testing.assert_frame_equal(reference.reset_index(drop = True), optimized.reset_index(drop = True),
+                                      check_dtype = False, check_exact = False, rtol = 1e-9, atol = 1e-12)
+    except AssertionError as e:
+        return str(e).strip().split('\n')[0]
+    return None
+
+
+class EquivalenceHarness():
+
+    '''
+    run the reference and optimized paths side by side, see the module docstring
+    '''
+
+    def __init__(self, n_bonds = 5000, seed = 0, work_dir = None, ts_bonds = 500, ts_days = 10, trace_memory = True,
+                 max_seconds = None, max_megabytes = None, baseline = None, tolerance = 0.25, min_seconds = 0.05):
+        '''
+        :param n_bonds: number of bonds in the synthetic universe, as int
+        :param seed: random seed of the synthetic data, as int
+        :param work_dir: directory for the synthetic csv files and stores, as string (default: a temporary directory)
+        :param ts_bonds: number of bonds in the time series check (the reference is slow), as int
+        :param ts_days: number of days in the time series check, as int
+        :param trace_memory: record the peak memory of each path with tracemalloc (slows the paths down), as boolean
+        :param max_seconds: limits on wall time, path -> seconds, as dictionary (paths are named '<check>: <path>')
+        :param max_megabytes: limits on peak traced memory, path -> megabytes, as dictionary
+        :param baseline: the results of an earlier run to compare against, as dataframe, list of records or the
+                         name of a JSON file written by save
+        :param tolerance: how much slower / bigger than in the baseline a path may get, as fraction
+        :param min_seconds: don't gate timings against the baseline below this many seconds (too noisy), as float
+        '''
+        self.n_bonds = n_bonds
+        self.seed = seed
+        self.work_dir = work_dir
+        self.ts_bonds = ts_bonds
+        self.ts_days = ts_days
+        self.trace_memory = trace_memory
+        self.max_seconds = max_seconds if max_seconds is not None else {}
+        self.max_megabytes = max_megabytes if max_megabytes is not None else {}
+        self.tolerance = tolerance
+        self.min_seconds = min_seconds
+
+        if isinstance(baseline, str):
+            with open(baseline) as f:
+                baseline = json.load(f)['results']
+        self.baseline = pd.DataFrame(baseline) if baseline is not None else None
+
+        self.start_date = datetime.date(2016, 12, 31)
+        self.end_date = datetime.date(2017, 12, 31)
+
+        # one record per check and path, and the gate failures of the last run
+        self.records = []
+        self.failures = []
+
+    def _run(self, check, path, func, *args):
+        '''
+        run one path of a check, recording its time and peak memory
+        :return: the result of func
+        '''
+        inst = Instrumentation.Instrumentation(trace_memory = self.trace_memory)
+        try:
+            with inst.stage(check + ': ' + path):
+                result = func(*args)
+        finally:
+            # traces every path on its own, and doesn't leave tracemalloc running after the harness
+            inst.close()
+        record = inst.records[-1]
+        peak = record['peak_traced_bytes']
+        self.records.append({'check': check,
+                             'path': path,
+                             'name': record['stage'],
+                             'seconds': record['seconds'],
+                             'peak_megabytes': peak / 2 ** 20 if peak is not None else None,
+                             'equal': None,
+                             'difference': None})
+        return result
+
+    def _compare(self, check, path, difference):
+        '''
+        mark the last record of a path as equal (or not) to the reference
+        '''
+        for record in reversed(self.records):
+            if (record['check'] == check) and (record['path'] == path):
+                record['equal'] = difference is None
+                record['difference'] = difference
+                break
+        if difference is not None:
+            self.failures.append('{}: {} differs from the reference: {}'.format(check, path, difference))
+
+    def _check_load(self, reference_module):
+        ref = reference_module.AgencyRatings()
+        self._run('load_agency_data', 'reference', ref.load_agency_data, False, self.data_path)
+
+        opt = AgencyRatings.AgencyRatings(data_path = self.data_path)
+        self._run('load_agency_data', 'optimized', opt.preload)
+
+        differences = []
+        for agency in ['moodys', 'sp', 'fitch']:
+            difference = _same_frames(getattr(ref, agency), getattr(opt, agency))
+            if difference is not None:
+                differences.append('{}: {}'.format(agency, difference))
+        self._compare('load_agency_data', 'optimized', '; '.join(differences) if differences else None)
+        return ref, opt
+
+    def _check_lookups(self, ref, opt, baml):
+        check = 'get_agency_ratings_by_id'
+        expected = self._run(check, 'reference', ref.get_agency_ratings_by_id, baml, 'cusip', self.start_date)
+        columns = [c for c in expected.columns if c in baml.columns or c in RATING_COLUMNS]
+
+        result = self._run(check, 'optimized', opt.get_agency_ratings_by_id, baml, 'cusip', self.start_date)
+        self._compare(check, 'optimized', _same_frames(expected, result, columns, ['cusip']))
+
+        compact = AgencyRatings.AgencyRatings(data_path = self.data_path, compact = True)
+        compact.preload()
+        result = self._run(check, 'compact', compact.get_agency_ratings_by_id, baml, 'cusip', self.start_date)
+        self._compare(check, 'compact', _same_frames(expected, result, columns, ['cusip']))
+
+        store_path = os.path.join(self.work_dir, 'partitioned_store')
+        opt.save_partitioned_store(store_path)
+        partitioned = AgencyRatings.AgencyRatings(data_path = None)
+        partitioned.load_partitioned_store(store_path, baml['cusip'])
+        result = self._run(check, 'partitioned store', partitioned.get_agency_ratings_by_id, baml, 'cusip',
+                           self.start_date)
+        self._compare(check, 'partitioned store', _same_frames(expected, result, columns, ['cusip']))
+        return expected
+
+    def _check_shared_ids(self, reference_module, baml):
+        '''
+        compacted lookups on a copy of the feeds where every fourth instrument takes over the cusip of the instrument
+        before it, so the lookups see the actions of two instruments under one id
+        :return: the feed directory, the reference object loaded from it and its lookup, as tuple
+        '''
+        check = 'get_agency_ratings_by_id (shared ids)'
+        path = os.path.join(self.work_dir, 'shared_feeds') + os.sep
+        os.makedirs(path, exist_ok = True)
+        for agency, fields in AgencyRatings.AGENCY_FIELDS.items():
+            df = pd.read_csv(os.path.join(self.data_path, fields['file']), dtype = str)
+            cusip = df[AgencyRatings.ID_TYPE_FIELDS[agency]].map(AgencyRatings.ID_TYPES) == 'cusip'
+            first_id = df[cusip].drop_duplicates(fields['key']).set_index(fields['key'])[fields['id']]
+            keys = first_id.index.to_numpy()
+            shared_id = dict(zip(keys[3::4], first_id.loc[keys[2::4]].to_numpy()))
+            shared = cusip & df[fields['key']].isin(shared_id)
+            df.loc[shared, fields['id']] = df.loc[shared, fields['key']].map(shared_id)
+            df.to_csv(os.path.join(path, fields['file']), index = False)
+
+        ref = reference_module.AgencyRatings()
+        ref.load_agency_data(False, path)
+        expected = self._run(check, 'reference', ref.get_agency_ratings_by_id, baml, 'cusip', self.start_date)
+        columns = [c for c in expected.columns if c in baml.columns or c in RATING_COLUMNS]
+
+        compact = AgencyRatings.AgencyRatings(data_path = path, compact = True)
+        compact.preload()
+        result = self._run(check, 'compact', compact.get_agency_ratings_by_id, baml, 'cusip', self.start_date)
+        self._compare(check, 'compact', _same_frames(expected, result, columns, ['cusip']))
+        return path, ref, expected
+
+    def _check_modes(self, reference_module, ref, baml, expected, shared):
+        '''
+        the other ways of running a lookup against the reference: inplace, crosswalk, process pool and cache
+        :param shared: the feed directory, reference object and reference lookup of _check_shared_ids, as tuple
+        '''
+        check = 'get_agency_ratings_by_id'
+        columns = [c for c in expected.columns if c in baml.columns or c in RATING_COLUMNS]
+
+        opt = AgencyRatings.AgencyRatings(data_path = self.data_path)
+        opt.preload()
+        data = baml.copy()
+        result = self._run(check, 'inplace', opt.get_agency_ratings_by_id, data, 'cusip', self.start_date, True)
+        difference = None if result is data else 'the lookup did not return data itself'
+        self._compare(check, 'inplace', difference or _same_frames(expected, result, columns, ['cusip']))
+
+        result = self._run(check, 'parallel',
+                           lambda: opt.get_ratings_parallel(baml, 'cusip', n_jobs = 2, date = self.start_date))
+        self._compare(check, 'parallel', _same_frames(expected, result, columns, ['cusip']))
+
+        crosswalk = AgencyRatings.AgencyRatings(data_path = self.data_path)
+        crosswalk.preload()
+        crosswalk.build_crosswalk()
+        result = self._run(check, 'crosswalk', crosswalk.get_agency_ratings_by_id, baml, 'cusip', self.start_date)
+        self._compare(check, 'crosswalk', _same_frames(expected, result, columns, ['cusip']))
+        result = self._run(check, 'parallel crosswalk',
+                           lambda: crosswalk.get_ratings_parallel(baml, 'cusip', n_jobs = 2, date = self.start_date))
+        self._compare(check, 'parallel crosswalk', _same_frames(expected, result, columns, ['cusip']))
+
+        # the cache: a miss, a hit, then the same lookup after moodys and after all agencies were reloaded from the
+        # shared id feeds, which must not come from the cache
+        shared_path, shared_ref, shared_expected = shared
+        mixed_ref = reference_module.AgencyRatings()
+        mixed_ref.moodys = shared_ref.moodys
+        mixed_ref.sp = ref.sp
+        mixed_ref.fitch = ref.fitch
+        mixed_expected = mixed_ref.get_agency_ratings_by_id(baml, 'cusip', self.start_date)
+
+        cached = AgencyRatings.AgencyRatings(data_path = self.data_path)
+        cached.preload()
+        cached.enable_cache()
+        for path, reload, reference in [('cache miss', None, expected),
+                                        ('cache hit', None, expected),
+                                        ('cache after load_agency', lambda: cached.load_agency('moodys'),
+                                         mixed_expected),
+                                        ('cache after load_agency_data', cached.load_agency_data, shared_expected)]:
+            if reload is not None:
+                cached.data_path = shared_path
+                reload()
+            hits = cached.cache_hits
+            result = self._run(check, path, cached.get_agency_ratings_by_id, baml, 'cusip', self.start_date)
+            difference = None
+            if (path == 'cache hit') != (cached.cache_hits > hits):
+                difference = 'expected {} cache hit'.format('a' if path == 'cache hit' else 'no')
+            self._compare(check, path, difference or _same_frames(reference, result, columns, ['cusip']))
+
+    def _check_averages(self, ref, opt, lookup):
+        expected = {}
+        for two in [True, False]:
+            check = 'get_average_ratings (require_two_agencies = {})'.format(two)
+            expected[two] = self._run(check, 'reference', ref.get_average_ratings, lookup.copy(), two)
+            result = self._run(check, 'optimized', opt.get_average_ratings, lookup, two)
+            self._compare(check, 'optimized', _same_frames(expected[two], result, ['cusip'] + AVERAGE_COLUMNS))
+        return expected
+
+    def _check_composite(self, opt, baml, averages):
+        check = 'get_composite_ratings_asof'
+        self._run(check, 'build history', opt.build_composite_history)
+        for two in [True, False]:
+            path = 'optimized (require_two_agencies = {})'.format(two)
+            result = self._run(check, path, opt.get_composite_ratings_asof, baml, 'cusip', self.start_date, two)
+            self._compare(check, path, _same_frames(averages[two], result, ['cusip'] + AVERAGE_COLUMNS, ['cusip']))
+
+    def _check_time_series(self, ref, opt, baml):
+        check = 'get_time_series_by_id'
+        bonds = baml[['cusip']].head(self.ts_bonds)
+        start = str(self.start_date)
+        end = str(self.start_date + datetime.timedelta(days = self.ts_days - 1))
+        expected = self._run(check, 'reference', ref.get_time_series_by_id, bonds, 'cusip', start, end)
+        result = self._run(check, 'optimized', opt.get_time_series_by_id, bonds, 'cusip', start, end)
+
+        # with pandas >= 1.5 the reference panel comes back without the id column (groupby(...).fillna drops it), its
+        # rows are the bond x date template sorted by id and date, so the ids can be put back from that order
+        ids = bonds['cusip'].drop_duplicates().sort_values(kind = 'mergesort')
+        days = pd.date_range(start = start, end = end, freq = 'D')
+        if 'cusip' not in expected.columns:
+            expected = expected.copy()
+            if expected.shape[0] != len(ids) * len(days):
+                self._compare(check, 'optimized', 'the reference panel is not one row per bond and date')
+                return
+            expected['cusip'] = np.repeat(ids.to_numpy(), len(days))
+            if not (pd.to_datetime(expected['date']).to_numpy() == np.tile(days.to_numpy(), len(ids))).all():
+                self._compare(check, 'optimized', 'the reference panel is not sorted by bond and date')
+                return
+
+        for df in [expected, result]:
+            df['date'] = pd.to_datetime(df['date'])
+        # the same bonds and dates, with the same ratings
+        self._compare(check, 'optimized', _same_frames(expected, result, keys = ['cusip', 'date']))
+
+    def _check_rtm(self, reference_module, cohort):
+        check = 'load_rtm / load_oas_change_matrix'
+
+        def build(rtm):
+            rtm.load_rtm(cohort)
+            rtm.load_oas_change_matrix(cohort)
+            return rtm
+
+        ref = self._run(check, 'reference', build, reference_module.RatingsTransitionMatrix())
+        opt = self._run(check, 'optimized', build, RatingsTransitionMatrix.RatingsTransitionMatrix())
+
+        differences = []
+        for i in [1, 2, 3]:
+            method = 'get_transition_matrix_{}'.format(i)
+            difference = _same_frames(getattr(ref, method)(), getattr(opt, method)())
+            if difference is not None:
+                differences.append('{}: {}'.format(method, difference))
+        self._compare(check, 'optimized', '; '.join(differences) if differences else None)
+        return ref
+
+    def _check_pipeline(self, reference, baml, baml_end):
+        '''
+        the study pipeline, with fresh agency data and the constituents from csv files and from SQLite, against the
+        reference matrices
+        '''
+        check = 'StudyPipeline'
+        path = os.path.join(self.work_dir, 'constituents')
+        os.makedirs(path, exist_ok = True)
+        dates = ['2017-01-03', '2017-12-31']
+        connection = sqlite3.connect(os.path.join(path, 'baml.db'), check_same_thread = False)
+        for date, df in zip(dates, [baml, baml_end]):
+            df = df.assign(date = date)
+            df.to_csv(os.path.join(path, 'baml_{}.csv'.format(date)), index = False)
+            # replace the table of an earlier run in the same work_dir, then add the other dates
+            if_exists = 'replace' if date == dates[0] else 'append'
+            df.to_sql('flattened_w_index', connection, if_exists = if_exists, index = False)
+
+        sources = {'file source': StudyPipeline.FileConstituentSource(path),
+                   'sqlite source': StudyPipeline.SqlConstituentSource(connection, table = 'flattened_w_index')}
+        try:
+            for name, source in sources.items():
+                pipeline = StudyPipeline.StudyPipeline(AgencyRatings.AgencyRatings(data_path = self.data_path), source,
+                                                       self.start_date, self.end_date, start_snapshot = dates[0],
+                                                       end_snapshot = dates[1])
+                rtm = self._run(check, name, pipeline.run)
+                differences = []
+                for i in [1, 2, 3]:
+                    method = 'get_transition_matrix_{}'.format(i)
+                    difference = _same_frames(getattr(reference, method)(), getattr(rtm, method)())
+                    if difference is not None:
+                        differences.append('{}: {}'.format(method, difference))
+                self._compare(check, name, '; '.join(differences) if differences else None)
+        finally:
+            connection.close()
+
+    def _cohort(self, opt, baml, baml_end, start):
+        '''
+        the cohort frame of the study notebook, from the start composite ratings
+        '''
+        baml = start[start.columns].copy()
+        baml['mkt_val'] = (baml['price'] / 100) * baml['face_value_loc']
+        baml['mkt_val'] += (baml['face_value_loc'] / 100) * baml['accrued_interest']
+        cohort = baml[['cusip', 'average_rating', 'prevmend_oas', 'mkt_val']]
+        cohort = cohort.rename(columns = {'average_rating': 'average_rating_0', 'prevmend_oas': 'oas_0'})
+
+        end = baml[['cusip']].merge(baml_end[['cusip', 'oas']], how = 'left', on = 'cusip')
+        end = opt.get_average_ratings(opt.get_agency_ratings_by_id(end, 'cusip', self.end_date),
+                                      require_two_agencies = False)
+        end = end[['cusip', 'average_rating', 'oas']].rename(columns = {'average_rating': 'average_rating_1',
+                                                                       'oas': 'oas_1'})
+        cohort = cohort.merge(end, how = 'left', on = 'cusip')
+        cohort['oas_change'] = cohort['oas_1'] - cohort['oas_0']
+
+        # the reference load_rtm looks rows up by label
+        return cohort.reset_index(drop = True)
+
+    def _gate(self):
+        '''
+        check every path against the configured limits and the baseline
+        '''
+        for record in self.records:
+            name = record['name']
+            if (name in self.max_seconds) and (record['seconds'] > self.max_seconds[name]):
+                self.failures.append('{} took {:.3f} seconds, the limit is {}'.format(
+                    name, record['seconds'], self.max_seconds[name]))
+            peak = record['peak_megabytes']
+            if (name in self.max_megabytes) and (peak is not None) and (peak > self.max_megabytes[name]):
+                self.failures.append('{} peaked at {:.1f} MB, the limit is {}'.format(
+                    name, peak, self.max_megabytes[name]))
+
+            if (self.baseline is None) or (record['path'] == 'reference'):
+                continue
+            before = self.baseline[self.baseline['name'] == name]
+            if before.shape[0] == 0:
+                continue
+            before = before.iloc[0]
+            limit = 1 + self.tolerance
+            if (before['seconds'] >= self.min_seconds) and (record['seconds'] > before['seconds'] * limit):
+                self.failures.append('{} took {:.3f} seconds, {:.3f} in the baseline'.format(
+                    name, record['seconds'], before['seconds']))
+            if (peak is not None) and pd.notnull(before['peak_megabytes']) and \
+                    (peak > max(before['peak_megabytes'], 1.0) * limit):
+                self.failures.append('{} peaked at {:.1f} MB, {:.1f} MB in the baseline'.format(
+                    name, peak, before['peak_megabytes']))
+
+    def run(self, verbose = False):
+        '''
+        run all checks
+        :param verbose: print each path as it finishes, as boolean
+        :return: one row per check and path with seconds, peak_megabytes, equal and difference, as dataframe
+        '''
+
+        self.records = []
+        self.failures = []
+        temporary = self.work_dir is None
+        if temporary:
+            self.work_dir = tempfile.mkdtemp(prefix = 'equivalence_')
+        self.data_path = os.path.join(self.work_dir, 'feeds') + os.sep
+
+        try:
+            generator = SyntheticAgencyData.SyntheticAgencyData(n_bonds = self.n_bonds, seed = self.seed)
+            generator.generate()
+            generator.write_csvs(self.data_path)
+            baml = generator.baml_constituents('2017-01-03')
+            baml_end = generator.baml_constituents('2017-12-31')
+
+            reference_ratings = _load_reference('AgencyRatings')
+            reference_rtm = _load_reference('RatingsTransitionMatrix')
+
+            ref, opt = self._check_load(reference_ratings)
+            lookup = self._check_lookups(ref, opt, baml)
+            shared = self._check_shared_ids(reference_ratings, baml)
+            self._check_modes(reference_ratings, ref, baml, lookup, shared)
+            averages = self._check_averages(ref, opt, lookup)
+            self._check_composite(opt, baml, averages)
+            self._check_time_series(ref, opt, baml)
+            rtm = self._check_rtm(reference_rtm, self._cohort(opt, baml, baml_end, averages[False]))
+            self._check_pipeline(rtm, baml, baml_end)
+        finally:
+            if temporary:
+                shutil.rmtree(self.work_dir, ignore_errors = True)
+                self.work_dir = None
+
+        self._gate()
+        results = self.results()
+        if verbose:
+            print(results.to_string())
+            for failure in self.failures:
+                print('FAILED ' + failure)
+        return results
+
+    def results(self):
+        '''
+        :return: the records of the last run, with the speedup of each path over the reference of its check,
+                 as dataframe
+        '''
+        df = pd.DataFrame(self.records, columns = ['check', 'path', 'name', 'seconds', 'peak_megabytes', 'equal',
+                                                   'difference'])
+        reference = df[df['path'] == 'reference'].set_index('check')['seconds']
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            df['speedup'] = df['check'].map(reference) / df['seconds']
+        return df
+
+    def check(self):
+        '''
+        :return: None, raises an AssertionError listing every difference and gate failure of the last run
+        '''
+        assert len(self.failures) == 0, 'error: ' + '\n'.join(self.failures)
+
+    def save(self, path):
+        '''
+        write the results of the last run to a JSON file, to be used as a baseline later
+        :param path: the file name, as string
+        :return: None
+        '''
+        meta = {'n_bonds': self.n_bonds, 'seed': self.seed, 'created': datetime.datetime.now().isoformat()}
+        results = self.results().replace({np.nan: None})
+        with open(path, 'w') as f:
+            json.dump({'metadata': meta, 'results': results.to_dict(orient = 'records'),
+                       'failures': self.failures}, f, indent = 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'compare the optimized paths to the reference implementations')
+    parser.add_argument('--n-bonds', type = int, default = 5000, help = 'number of synthetic bonds')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed of the synthetic data')
+    parser.add_argument('--baseline', default = None, help = 'JSON results of an earlier run to gate against')
+    parser.add_argument('--tolerance', type = float, default = 0.25, help = 'allowed regression over the baseline')
+    parser.add_argument('--output', default = None, help = 'write the results to this JSON file')
+    parser.add_argument('--work-dir', default = None, help = 'directory for the synthetic data (default: temporary)')
+    parser.add_argument('--no-memory', action = 'store_true', help = "don't trace peak memory (faster)")
+    args = parser.parse_args()
+
+    harness = EquivalenceHarness(n_bonds = args.n_bonds, seed = args.seed, work_dir = args.work_dir,
+                                 trace_memory = not args.no_memory, baseline = args.baseline,
+                                 tolerance = args.tolerance)
+    harness.run(verbose = True)
+    if args.output is not None:
+        harness.save(args.output)
+    sys.exit(1 if harness.failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+'''
+Normalize and validate bond identifiers (cusip and isin) a whole column at a time.
+
+The agency feeds and the BAML constituents identify bonds by 9 digit cusip, 8 digit cusip or isin, with the odd
+stray quote, space or lower case letter. Ids that differ only in those ways silently fail to join, so normalize_ids
+brings every id to the form the lookups join on:
+- cusips are cut to their 8 character base (the check digit is validated first when there is one)
+- isins are kept at 12 characters and their luhn check digit is validated
+- US and CA isins also give their 8 character cusip (the isin body is the country code + the 9 digit cusip)
+- anything that isn't a well formed cusip or isin is flagged as invalid
+
+The check digits are computed on fixed width character arrays, not per id in python, and each distinct id is only
+normalized once (factorize_ids). AgencyRatings.load_agency runs factorize_ids over each feed at ingest, and
+normalize_frame runs normalize_ids over a caller's frame before a lookup.
+'''
+import numpy as np
+import pandas as pd
+
+
+# countries whose isins embed the 9 digit cusip
+CUSIP_COUNTRIES = ['US', 'CA']
+
+
+# value of each ascii character in the check digit sums: 0-9 for digits, 10-35 for letters and 36-38 for the cusip
+# characters *, @ and #, and which characters may appear in an isin body and in a cusip
+_CHAR_VALUES = np.zeros(128, dtype = np.int64)
+_CHAR_VALUES[ord('0'):ord('9') + 1] = np.arange(10)
+_CHAR_VALUES[ord('A'):ord('Z') + 1] = np.arange(10, 36)
+_CHAR_VALUES[[ord('*'), ord('@'), ord('#')]] = [36, 37, 38]
+_ALNUM = np.zeros(128, dtype = bool)
+_ALNUM[ord('0'):ord('9') + 1] = True
+_ALNUM[ord('A'):ord('Z') + 1] = True
+_CUSIP_CHARS = _ALNUM.copy()
+_CUSIP_CHARS[[ord('*'), ord('@'), ord('#')]] = True
+
+
+def _digit_sum(values):
+    return values // 10 + values % 10
+
+
+# what each character value adds to the check digit sums. cusips double every other character, [value, doubled].
+# isin letters expand to two digits, so it depends on whether the ones digit of the value is doubled (the tens digit
+# then isn't), [value, ones digit doubled]
+_VALUES = np.arange(39)
+_CUSIP_SUMS = np.stack([_digit_sum(_VALUES), _digit_sum(_VALUES * 2)], axis = 1)
+_ISIN_SUMS = np.stack([_digit_sum(_VALUES % 10) + _digit_sum(_VALUES // 10 * 2),
+                       _digit_sum(_VALUES % 10 * 2) + _digit_sum(_VALUES // 10)], axis = 1)
+
+
+def _char_values(chars):
+    '''
+    value of each character of a 2d array of single characters (or their code points) in the check digit sums
+    '''
+    codes = chars.view(np.int32) if chars.dtype.kind == 'U' else chars
+    return np.take(_CHAR_VALUES, codes, mode = 'clip')
+
+
+def _char_codes(ids, width):
+    '''
+    code points of every id as a len(ids) x width array (0 past the end of shorter ids)
+    '''
+    chars = np.asarray(ids, dtype = 'U{}'.format(width))
+    return chars.view(np.int32).reshape(-1, width)
+
+
+def _is_alnum(codes):
+    return np.take(_ALNUM, codes, mode = 'clip')
+
+
+def cusip_check_digits(base):
+    '''
+    check digit of every 8 character cusip in base, as array of single characters
+    '''
+    return _cusip_check(_char_codes(base, 8)).astype(str)
+
+
+def _cusip_check(codes):
+    '''
+    check digit of every row of a len x 8 array of cusip code points, as int array
+    '''
+    total = _CUSIP_SUMS[_char_values(codes), np.arange(8) % 2].sum(axis = 1)
+    return (10 - total % 10) % 10
+
+
+def isin_check_digits(body):
+    '''
+    luhn check digit of every 11 character isin body (country code + 9 digit cusip), as array of single characters
+    '''
+    return _isin_check(_char_codes(body, 11)).astype(str)
+
+
+def _isin_check(codes):
+    '''
+    luhn check digit of every row of a len x 11 array of isin body code points, as int array
+    '''
+    values = _char_values(codes)
+
+    # letters expand to two digits. number the digits from the right, the rightmost digit of the body is doubled
+    n_digits = 1 + (values >= 10)
+    right = np.cumsum(n_digits[:, ::-1], axis = 1)[:, ::-1] - n_digits
+    total = _ISIN_SUMS[values, 1 - right % 2].sum(axis = 1)
+    return (10 - total % 10) % 10
+
+
+def clean_ids(ids):
+    '''
+    strip spaces and quotes and upper case a column of ids, empty ids become NaN
+    :param ids: the ids, as list-like
+    :return: the cleaned ids, as object array
+    '''
+    ids = np.asarray(pd.Series(ids, dtype = object), dtype = object).copy()
+    known = np.flatnonzero(pd.notnull(ids))
+    if len(known) == 0:
+        return ids
+
+    # most ids are clean already: find them on the character codes and only clean the rest in python
+    chars = np.asarray(ids[known], dtype = str)
+    codes = chars.view(np.int32).reshape(len(chars), -1)
+    lengths = (codes != 0).sum(axis = 1)
+    edges = np.stack([codes[:, 0], codes[np.arange(len(codes)), np.maximum(lengths - 1, 0)]], axis = 1)
+    dirty = (lengths == 0) | ((codes >= ord('a')) & (codes <= ord('z'))).any(axis = 1) | (codes > 127).any(axis = 1) | \
+            ((edges <= ord(' ')) | (edges == ord('"')) | (edges == ord("'"))).any(axis = 1)
+
+    if pd.api.types.infer_dtype(ids[known], skipna = False) != 'string':
+        ids[known] = chars.astype(object)
+    for i in known[dirty]:
+        cleaned = ids[i].strip().strip('"\'').strip().upper()
+        ids[i] = cleaned if cleaned != '' else np.NaN
+    return ids
+
+
+def _valid_cusips(ids):
+    '''
+    whether each 8 or 9 character id is a well formed cusip, with a matching check digit if it has one
+    '''
+    codes = _char_codes(ids, 9)
+    lengths = (codes != 0).sum(axis = 1)
+    base = codes[:, :8]
+    well_formed = np.take(_CUSIP_CHARS, base, mode = 'clip').all(axis = 1)
+    check = _cusip_check(base) + ord('0')
+    return well_formed & ((lengths == 8) | ((lengths == 9) & (codes[:, 8] == check)))
+
+
+def _valid_isins(ids):
+    '''
+    whether each 12 character id is a well formed isin with a matching check digit
+    '''
+    codes = _char_codes(ids, 12)
+    well_formed = ((codes[:, :2] >= ord('A')) & (codes[:, :2] <= ord('Z'))).all(axis = 1) & \
+                  _is_alnum(codes[:, 2:11]).all(axis = 1) & (codes[:, 11] >= ord('0')) & (codes[:, 11] <= ord('9'))
+    check = _isin_check(codes[:, :11]) + ord('0')
+    return well_formed & (codes[:, 11] == check)
+
+
+def normalize_ids(ids, id_type = None):
+    '''
+    normalize and validate a column of cusips and isins
+    :param ids: the ids, as list-like
+    :param id_type: 'cusip' or 'isin' for every id, as string or list-like (default: tell them apart by their form,
+                    12 characters starting with a country code is an isin, 8 or 9 characters a cusip)
+    :return: one row per id with columns
+             id: the normalized id (8 character cusip, 12 character isin, else the cleaned id)
+             id_type: 'cusip', 'isin' or None if it is neither
+             valid: whether the id is a well formed cusip or isin with a matching check digit
+             cusip: the 8 character cusip of cusips and valid US / CA isins, else None
+             as dataframe
+    '''
+
+    codes, unique = factorize_ids(ids, id_type = id_type)
+    return pd.DataFrame({c: unique[c].to_numpy()[codes] for c in unique.columns})
+
+
+def factorize_ids(ids, id_type = None):
+    '''
+    normalize_ids for the distinct (id, type) pairs only, the feeds repeat each id for every rating action
+    :param ids: the ids, as list-like
+    :param id_type: 'cusip' or 'isin' for every id, as string, list-like or categorical (see normalize_ids)
+    :return: the code of each id's (id, type) pair, as int array, and the normalized pairs (see normalize_ids) in
+             code order, as dataframe
+    '''
+
+    ids = np.asarray(pd.Series(ids, dtype = object), dtype = object)
+    if id_type is not None and np.ndim(id_type) == 0:
+        id_type = np.full(len(ids), id_type, dtype = object)
+
+    # the feeds repeat each id for several rating actions, the size hint saves growing the hash table as it fills.
+    # a categorical id_type is factorized from its codes
+    id_codes, id_uniques = pd.factorize(ids, size_hint = len(ids) // 4)
+    type_codes, type_uniques = pd.factorize(id_type) if id_type is not None else (-1, [])
+
+    # number the pairs that occur. the codes are -1 for missing ids and types, shift them to keep the pairs apart
+    n_types = len(type_uniques) + 1
+    pairs = (id_codes.astype(np.int64) + 1) * n_types + type_codes + 1
+    present = np.zeros((len(id_uniques) + 1) * n_types, dtype = bool)
+    present[pairs] = True
+    codes = (np.cumsum(present) - 1)[pairs]
+    uniques = np.flatnonzero(present)
+    unique_ids = np.append(np.asarray(id_uniques, dtype = object), None)[uniques // n_types - 1]
+    if id_type is None:
+        return codes, _normalize_distinct(unique_ids, None)
+
+    # the types stay categorical, comparing their codes is much faster than comparing strings
+    unique_types = pd.Categorical.from_codes(uniques % n_types - 1, np.asarray(type_uniques, dtype = object))
+    return codes, _normalize_distinct(unique_ids, unique_types)
+
+
+def _normalize_distinct(ids, id_type):
+    '''
+    normalize_ids for an array of ids (and types) without repeats
+    '''
+    ids = clean_ids(ids)
+    n = len(ids)
+    known = pd.notnull(ids)
+    lengths = np.zeros(n, dtype = np.int64)
+    lengths[known] = [len(x) for x in ids[known]]
+
+    if id_type is None:
+        prefix = np.zeros(n, dtype = bool)
+        prefix[known] = [x[:2].isalpha() for x in ids[known]]
+        is_isin = known & (lengths == 12) & prefix
+        is_cusip = known & ((lengths == 8) | (lengths == 9))
+    else:
+        is_isin = known & (id_type == 'isin')
+        is_cusip = known & (id_type == 'cusip')
+
+    normalized = ids.copy()
+    types = np.full(n, None, dtype = object)
+    valid = np.zeros(n, dtype = bool)
+    cusip = np.full(n, None, dtype = object)
+
+    # cusips: validate the check digit of 9 character cusips, then cut to the 8 character base
+    rows = np.flatnonzero(is_cusip)
+    if len(rows) > 0:
+        values = ids[rows]
+        valid[rows] = np.isin(lengths[rows], [8, 9]) & _valid_cusips(values)
+        base = np.asarray([x[:8] for x in values], dtype = object)
+        normalized[rows] = base
+        types[rows] = 'cusip'
+        cusip[rows] = base
+
+    # isins: validate the check digit, US / CA isins embed the cusip (and its check digit)
+    rows = np.flatnonzero(is_isin)
+    if len(rows) > 0:
+        values = ids[rows]
+        ok = (lengths[rows] == 12) & _valid_isins(values)
+        valid[rows] = ok
+        types[rows] = 'isin'
+        embedded = np.asarray([x[2:11] for x in values], dtype = object)
+        derive = ok & np.isin(np.asarray([x[:2] for x in values], dtype = object), CUSIP_COUNTRIES)
+        derive[derive] = _valid_cusips(embedded[derive])
+        cusip[rows[derive]] = [x[:8] for x in embedded[derive]]
+
+    return pd.DataFrame({'id': normalized, 'id_type': types, 'valid': valid, 'cusip': cusip})
+
+
+def normalize_frame(data, id_col, to_cusip = False, inplace = False):
+    '''
+    normalize the id column of a frame before a lookup (see normalize_ids) and flag the ids that aren't valid
+    :param data: a dataset with a column of cusips and / or isins, as dataframe
+    :param id_col: the name of the id column, as string
+    :param to_cusip: replace US / CA isins by their 8 character cusip, eg to join isins to the cusip rows of the
+                     feeds, as boolean
+    :param inplace: change data itself instead of a copy, as boolean
+    :return: data with id_col normalized and an id_col + '_valid' column (0 / 1), as dataframe
+    '''
+
+    assert id_col in data.columns, 'error: could not find the id column in data'
+    ids = normalize_ids(data[id_col])
+
+    df = data if inplace else data.copy()
+    normalized = ids['id'].to_numpy(dtype = object)
+    if to_cusip:
+        normalized = np.where(ids['cusip'].notnull(), ids['cusip'], normalized)
+    df[id_col] = normalized
+    df[id_col + '_valid'] = ids['valid'].to_numpy().astype(np.int8)
+    return df
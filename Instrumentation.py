@@ -0,0 +1,243 @@
+'''
+Lightweight timing and memory instrumentation for AgencyRatings and RatingsTransitionMatrix.
+
+Every instrumented method is wrapped with @instrumented. When the object's instrumentation attribute is None (the
+default) the wrapper calls straight through, so there is nothing to pay in production. After
+obj.enable_instrumentation(), each call records a stage with its wall time, the rows going in and coming out and
+the change in resident memory (plus the traced peak if trace_memory is on). The collected stages can be turned into
+a dataframe, dumped to JSON or written to a logger.
+
+One Instrumentation object can be shared by several threads: stage nesting is kept per thread and the records are
+appended under a lock. tracemalloc is process wide though, so with trace_memory the traced peak of a stage also counts
+what other threads allocated while it ran. If trace_memory started tracemalloc, close() (or disable_instrumentation())
+stops it again.
+'''
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import timeit
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def resident_memory():
+    '''
+    :return: resident memory of this process in bytes, or None if it can't be measured (no psutil and no /proc)
+    '''
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss
+    try:
+        # linux without psutil: the second field of statm is the resident size in pages
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_resident_memory():
+    '''
+    :return: the highest resident memory of this process so far in bytes, or None if it can't be measured
+    '''
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _rows(value):
+    '''
+    number of rows of a dataframe / array, None for anything else
+    '''
+    shape = getattr(value, 'shape', None)
+    if shape is not None and len(shape) > 0:
+        return int(shape[0])
+    return None
+
+
+class Instrumentation():
+
+    '''
+    Collects one record per stage:
+    stage, depth (how deeply the stage is nested in other stages), wall time in seconds, rows in, rows out,
+    resident memory before / after and its change, the peak resident memory of the process at the end of the stage,
+    and the peak traced memory above the start of the stage (only with trace_memory, which uses tracemalloc and does
+    slow the traced code down)
+    '''
+
+    def __init__(self, trace_memory = False):
+        self.records = []
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+
+        # the nesting depth and the traced peaks of the open stages, per thread
+        self._local = threading.local()
+
+        # only stop tracemalloc in close() if this object started it
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def _open_stages(self):
+        '''
+        :return: the open stages of the calling thread, with attributes depth (as int) and peaks (as list)
+        '''
+        local = self._local
+        if not hasattr(local, 'depth'):
+            local.depth = 0
+            local.peaks = []
+        return local
+
+    def close(self):
+        '''
+        stop memory tracing (if this object started tracemalloc), the records are kept
+        '''
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self.trace_memory = False
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in = None):
+        '''
+        time a block of code
+        the yielded record is a dictionary, set record['rows_out'] inside the block to report the output size
+        :param name: name of the stage, as string
+        :param rows_in: number of input rows, as int
+        '''
+
+        local = self._open_stages()
+        record = {'stage': name,
+                  'depth': local.depth,
+                  'seconds': None,
+                  'rows_in': rows_in,
+                  'rows_out': None,
+                  'rss_before': resident_memory(),
+                  'rss_after': None,
+                  'rss_delta': None,
+                  'peak_rss': None,
+                  'peak_traced_bytes': None}
+
+        traced_start = None
+        if self.trace_memory:
+            # remember the peak reached so far by the enclosing stage before restarting the peak for this one
+            current, peak = tracemalloc.get_traced_memory()
+            if local.peaks:
+                local.peaks[-1] = max(local.peaks[-1], peak)
+            tracemalloc.reset_peak()
+            local.peaks.append(current)
+            traced_start = current
+
+        local.depth += 1
+        start = timeit.default_timer()
+        try:
+            yield record
+        finally:
+            record['seconds'] = timeit.default_timer() - start
+            local.depth -= 1
+
+            record['rss_after'] = resident_memory()
+            if (record['rss_before'] is not None) and (record['rss_after'] is not None):
+                record['rss_delta'] = record['rss_after'] - record['rss_before']
+            record['peak_rss'] = peak_resident_memory()
+
+            if traced_start is not None:
+                peak = max(local.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                record['peak_traced_bytes'] = peak - traced_start
+                if local.peaks:
+                    local.peaks[-1] = max(local.peaks[-1], peak)
+
+            with self._lock:
+                self.records.append(record)
+
+    def report(self):
+        '''
+        :return: one row per recorded stage, in the order the stages finished, as dataframe
+        '''
+        columns = ['stage', 'depth', 'seconds', 'rows_in', 'rows_out',
+                   'rss_before', 'rss_after', 'rss_delta', 'peak_rss', 'peak_traced_bytes']
+        return pd.DataFrame(self.records, columns = columns)
+
+    def summary(self):
+        '''
+        :return: number of calls, total time and rows per stage, slowest first, as dataframe
+        '''
+        df = self.report()
+        df = df.groupby('stage').agg(calls = ('seconds', 'size'),
+                                     seconds = ('seconds', 'sum'),
+                                     rows_in = ('rows_in', 'sum'),
+                                     rows_out = ('rows_out', 'sum'),
+                                     max_rss_delta = ('rss_delta', 'max'),
+                                     peak_rss = ('peak_rss', 'max'),
+                                     max_peak_traced_bytes = ('peak_traced_bytes', 'max'))
+        return df.sort_values(by = 'seconds', ascending = False)
+
+    def to_json(self, path = None):
+        '''
+        :param path: write the records to this file, as string (default: only return them)
+        :return: the records, as JSON string
+        '''
+        text = json.dumps(self.records, indent = 1)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def log(self, logger = None, level = logging.INFO):
+        '''
+        write one log line per recorded stage
+        :param logger: the logger to write to (default: this module's logger)
+        '''
+        logger = logger if logger is not None else logging.getLogger(__name__)
+        for r in self.records:
+            logger.log(level, '%s%s: %.4fs rows %s -> %s rss delta %s',
+                       '  ' * r['depth'], r['stage'], r['seconds'], r['rows_in'], r['rows_out'], r['rss_delta'])
+
+    def clear(self):
+        with self._lock:
+            self.records = []
+
+
+def instrumented(func):
+    '''
+    method decorator: record the call as a stage if the object has instrumentation turned on
+    the input rows are taken from the first argument (or data =), the output rows from the return value
+    '''
+
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        inst = self.instrumentation
+        if inst is None:
+            return func(self, *args, **kwargs)
+
+        data = args[0] if len(args) > 0 else kwargs.get('data')
+        with inst.stage(name, rows_in = _rows(data)) as record:
+            result = func(self, *args, **kwargs)
+            record['rows_out'] = _rows(result)
+        return result
+
+    return wrapper
+
+
+def stage(obj, name, rows_in = None):
+    '''
+    time a block of code inside an instrumented object, or do nothing if its instrumentation is turned off
+    '''
+    if obj.instrumentation is None:
+        return contextlib.nullcontext({})
+    return obj.instrumentation.stage(name, rows_in = rows_in)
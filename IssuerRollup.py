@@ -0,0 +1,87 @@
+'''
+Reduce bond-level composite ratings to one rating per issuer (per date).
+
+A bond-level ratings transition matrix counts every bond as a case, so issuers with hundreds of bonds dominate it.
+issuer_ratings rolls a bond-level frame (a cohort, a point-in-time lookup or a daily panel) up to one rating per
+issuer and date in a single grouped pass:
+- 'most_common': the rating most of the issuer's rated bonds have (ties go to the lower rating)
+- 'senior_unsecured': the most common rating of the issuer's senior unsecured bonds, or of all its bonds if none of
+  its senior unsecured bonds is rated
+
+The issuer can be any column that identifies it, eg the BAML ticker or the fitch agent_common_id.
+See RatingsTransitionMatrix.load_issuer_rtm for issuer-level transition matrices.
+'''
+import numpy as np
+import pandas as pd
+from RatingsTransitionMatrix import RATINGS_MAP, RATINGS_MAP_INVERSE
+
+
+# seniority values that mean senior unsecured in the moodys (seniority_short_description) and
+# fitch (issue_debt_level_code) feeds
+SENIOR_UNSECURED = ['Sr Unsec', 'Senior Unsecured', 'SEN', 'SU']
+
+
+def rating_codes(ratings):
+    '''
+    numeric codes (0 = D, 21 = AAA) of a column of composite ratings, -1 for NR and anything else that isn't a rating
+    numeric ratings (eg average_rating_num) are passed through
+    '''
+    ratings = pd.Series(ratings)
+    if pd.api.types.is_numeric_dtype(ratings):
+        values = ratings.to_numpy(dtype = float)
+        return np.where(np.isfinite(values), values, -1).astype(np.int64)
+    codes, uniques = pd.factorize(ratings)
+    lookup = np.array([RATINGS_MAP.get(r, -1) for r in uniques] + [-1], dtype = np.int64)
+    return lookup[codes]
+
+
+def _most_common(groups, codes, n_groups, mask = None):
+    '''
+    most common rating code per group (lowest on ties), -1 for groups without rated bonds
+    '''
+    ok = codes >= 0
+    if mask is not None:
+        ok &= mask
+    counts = np.bincount(groups[ok] * 22 + codes[ok], minlength = n_groups * 22).reshape(n_groups, 22)
+    return np.where(counts.any(axis = 1), counts.argmax(axis = 1), -1)
+
+
+def issuer_ratings(data, issuer_col, rating_col, date_col = None, rule = 'most_common', seniority_col = None,
+                   senior_unsecured = SENIOR_UNSECURED):
+    '''
+    one rating per issuer (and date) from bond-level ratings
+    :param data: bond-level ratings, as dataframe
+    :param issuer_col: the name of the column identifying the issuer, as string
+    :param rating_col: the name of the column with the composite rating, alphanumeric or numeric, as string
+    :param date_col: the name of the date column of a panel, as string (default: one rating per issuer)
+    :param rule: 'most_common' or 'senior_unsecured'
+    :param seniority_col: the name of the column with the seniority, needed for 'senior_unsecured', as string
+    :param senior_unsecured: the seniority values that mean senior unsecured, as list
+    :return: issuer_col, date_col, rating_col (alphanumeric, NR if no bond is rated) and bond_count, as dataframe
+    '''
+
+    assert rule in ['most_common', 'senior_unsecured'], 'error: rule must be most_common or senior_unsecured'
+    assert issuer_col in data.columns, 'error: could not find the issuer column in data'
+    if rule == 'senior_unsecured':
+        assert seniority_col in data.columns, 'error: the senior_unsecured rule needs a seniority column'
+
+    # group number of every bond, rows without an issuer (or date) are left out
+    keys = [issuer_col] if date_col is None else [issuer_col, date_col]
+    grouped = data.groupby(keys, sort = True)
+    sizes = grouped.size()
+    groups = grouped.ngroup().to_numpy(dtype = float)
+    known = np.isfinite(groups)
+    groups = groups[known].astype(np.int64)
+    n_groups = sizes.shape[0]
+    codes = rating_codes(data[rating_col])[known]
+
+    rating = _most_common(groups, codes, n_groups)
+    if rule == 'senior_unsecured':
+        senior = data[seniority_col].isin(senior_unsecured).to_numpy()[known]
+        senior_rating = _most_common(groups, codes, n_groups, mask = senior)
+        rating = np.where(senior_rating >= 0, senior_rating, rating)
+
+    df = sizes.index.to_frame(index = False)
+    df[rating_col] = [RATINGS_MAP_INVERSE.get(r, 'NR') for r in rating]
+    df['bond_count'] = sizes.to_numpy()
+    return df
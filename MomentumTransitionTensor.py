@@ -0,0 +1,277 @@
+import os
+import numpy as np
+import pandas as pd
+import Instrumentation
+import RatingsTransitionMatrix
+
+
+# the matrices get_transition_matrix_1 / _2 can write and the csv file each one is written to ({} is the condition)
+CSV_NAMES = {'probability': 'momentum_transition_matrix_{}.csv',
+             'count': 'momentum_transition_counts_{}.csv'}
+
+
+class MomentumTransitionTensor():
+    '''
+    Second-order ratings transitions: transition counts conditioned on the bond's rating momentum at the start date
+
+    RatingsTransitionMatrix counts start rating -> end rating. This also keys every case on the bond's most recent
+    composite rating change before the start date:
+    condition_on='direction': 'down', 'stable' or 'up'
+    condition_on='rating': the composite rating before that change ('NR' if the bond was not rated before)
+    a change longer than lookback_days before the start date counts as no change ('stable', or the start rating itself)
+
+    The cases come from the composite rating spell history of AgencyRatings (see build_composite_history), in one
+    vectorized pass per cohort. Counts are kept as a dense conditions x 22 x 22 array.
+    Rows with fewer than min_count cases can fall back on the unconditioned (first-order) probabilities.
+    '''
+
+    def __init__(self, condition_on='direction', lookback_days=365, require_two_agencies=True, min_count=0):
+        '''
+        :param condition_on: 'direction' or 'rating'
+        :param lookback_days: how recent the last rating change must be to count as momentum, as int (None: any time)
+        :param require_two_agencies: treat composite ratings with less than two agencies as NR, as boolean
+        :param min_count: conditioned rows with fewer cases use the first-order probabilities instead, as int
+        '''
+        assert condition_on in ['direction', 'rating'], 'error: condition_on must be direction or rating'
+
+        # dictionary from alphanumeric to numeric rating, and from numeric to alphanumeric (the composite scale)
+        self.ratings_map = dict(RatingsTransitionMatrix.RATINGS_MAP)
+        self.ratings_map_inverse = dict(RatingsTransitionMatrix.RATINGS_MAP_INVERSE)
+
+        self.condition_on = condition_on
+        self.lookback_days = lookback_days
+        self.require_two_agencies = require_two_agencies
+        self.min_count = min_count
+
+        # the conditioning states, the previous rating states are indexed by numeric rating with NR last
+        if condition_on == 'direction':
+            self.conditions = ['down', 'stable', 'up']
+        else:
+            self.conditions = [self.ratings_map_inverse[i] for i in range(22)] + ['NR']
+
+        # counts[condition, start rating, end rating], ratings indexed by numeric rating
+        self.counts = np.zeros((len(self.conditions), 22, 22), dtype=np.int64)
+
+        # optional timing and memory instrumentation, see enable_instrumentation
+        self.instrumentation = None
+        self._own_instrumentation = False
+
+    def enable_instrumentation(self, instrumentation=None, trace_memory=False):
+        '''
+        record wall time, rows in / out and memory for loading, see Instrumentation
+        :param instrumentation: collect into this Instrumentation object, eg the one of an AgencyRatings object
+        :param trace_memory: also trace peak memory with tracemalloc (slower), as boolean
+        :return: the Instrumentation object collecting the records
+        '''
+        self.disable_instrumentation()
+        self._own_instrumentation = instrumentation is None
+        if instrumentation is None:
+            instrumentation = Instrumentation.Instrumentation(trace_memory=trace_memory)
+        self.instrumentation = instrumentation
+        return instrumentation
+
+    def disable_instrumentation(self):
+        '''
+        stop recording, an Instrumentation object created by enable_instrumentation is closed (a shared one is not)
+        '''
+        if self._own_instrumentation:
+            self.instrumentation.close()
+        self._own_instrumentation = False
+        self.instrumentation = None
+
+    @property
+    def start_counts(self):
+        '''
+        number of cases per condition and start rating, as conditions x 22 array
+        '''
+        return self.counts.sum(axis=2)
+
+    def _spells(self, history):
+        '''
+        collapse the composite spell history to composite rating changes
+        :return: bond codes, bond ids, change days, rating and previous rating of each change, as arrays
+        '''
+        codes, ids = pd.factorize(history['id'])
+        days = history['valid_from'].to_numpy().astype('datetime64[D]').astype(np.int64)
+        rating = history['average_rating_num'].to_numpy(dtype=float).copy()
+        if self.require_two_agencies:
+            rating[history['agency_rating_count'].to_numpy() < 2] = np.NaN
+
+        order = np.lexsort((days, codes))
+        codes, days, rating = codes[order], days[order], rating[order]
+
+        # spells where the (effective) rating didn't change are not rating changes
+        first = np.ones(len(codes), dtype=bool)
+        first[1:] = codes[1:] != codes[:-1]
+        same = np.zeros(len(codes), dtype=bool)
+        same[1:] = (~first[1:]) & ((rating[1:] == rating[:-1]) | (np.isnan(rating[1:]) & np.isnan(rating[:-1])))
+        keep = ~same
+        codes, days, rating, first = codes[keep], days[keep], rating[keep], first[keep]
+
+        previous = np.full(len(codes), np.NaN)
+        previous[1:] = np.where(first[1:], np.NaN, rating[:-1])
+        return codes, ids, days, rating, previous
+
+    @Instrumentation.instrumented
+    def load_history(self, history, start_date, end_date, ids=None):
+        '''
+        add one cohort of cases: every bond's composite rating on start_date and end_date, conditioned on its momentum
+        cases where the start or end rating is NR are skipped, like RatingsTransitionMatrix.load_rtm
+        :param history: the composite rating spell history, AgencyRatings.composite_history, as dataframe
+        :param start_date: start of the cohort, as datetime.date
+        :param end_date: end of the cohort, as datetime.date
+        :param ids: only use these bonds (eg the index constituents on start_date), as list-like (default: all bonds)
+        :return: number of cases added, as int
+        '''
+
+        codes, all_ids, days, rating, previous = self._spells(history)
+        if len(codes) == 0:
+            return 0
+
+        if ids is None:
+            bonds = np.arange(len(all_ids))
+        else:
+            bonds = all_ids.get_indexer(pd.unique(np.asarray(ids, dtype=object)))
+            bonds = bonds[bonds >= 0]
+
+        # as-of search over (bond, day) keys, as in AgencyRatings.get_composite_ratings_asof
+        first_day = days.min()
+        span = int(days.max() - first_day) + 2
+        keys = codes.astype(np.int64) * span + (days - first_day)
+
+        def asof(day):
+            day = np.datetime64(day, 'D').astype(np.int64)
+            pos = np.searchsorted(keys, bonds.astype(np.int64) * span + np.clip(day - first_day, 0, span - 1),
+                                  side='right') - 1
+            pos_ok = np.clip(pos, 0, None)
+            found = (pos >= 0) & (codes[pos_ok] == bonds) & (days[pos_ok] <= day)
+            return np.where(found, pos_ok, -1)
+
+        pos0 = asof(start_date)
+        pos1 = asof(end_date)
+        r0 = np.where(pos0 >= 0, rating[np.clip(pos0, 0, None)], np.NaN)
+        r1 = np.where(pos1 >= 0, rating[np.clip(pos1, 0, None)], np.NaN)
+        prev = np.where(pos0 >= 0, previous[np.clip(pos0, 0, None)], np.NaN)
+
+        # a change before the lookback window is no momentum: the previous rating is the start rating
+        if self.lookback_days is not None:
+            age = np.datetime64(start_date, 'D').astype(np.int64) - days[np.clip(pos0, 0, None)]
+            prev = np.where(age > self.lookback_days, r0, prev)
+
+        ok = np.isfinite(r0) & np.isfinite(r1)
+        r0, r1, prev = r0[ok].astype(np.int64), r1[ok].astype(np.int64), prev[ok]
+
+        if self.condition_on == 'direction':
+            condition = np.ones(len(r0), dtype=np.int64)
+            known = np.isfinite(prev)
+            condition[known & (prev > r0)] = 0
+            condition[known & (prev < r0)] = 2
+        else:
+            condition = np.where(np.isfinite(prev), prev, 22).astype(np.int64)
+
+        flat = (condition * 22 + r0) * 22 + r1
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+        return int(len(r0))
+
+    def _condition_index(self, condition):
+        assert condition in self.conditions, 'error: unknown condition {}'.format(condition)
+        return self.conditions.index(condition)
+
+    def get_counts(self, condition=None):
+        '''
+        :param condition: one of self.conditions (default: all cases, ie the first-order counts)
+        :return: transition counts, start rating x end rating by numeric rating, as 22 x 22 array
+        '''
+        if condition is None:
+            return self.counts.sum(axis=0)
+        return self.counts[self._condition_index(condition)]
+
+    def get_probabilities(self, condition=None):
+        '''
+        transition probabilities, rows with fewer than min_count cases use the first-order probabilities
+        :param condition: one of self.conditions (default: the first-order probabilities)
+        :return: start rating x end rating by numeric rating, NaN for rows without cases, as 22 x 22 array
+        '''
+        first_order = self.counts.sum(axis=0).astype(float)
+        counts = self.get_counts(condition).astype(float)
+        if condition is not None and self.min_count > 0:
+            sparse = counts.sum(axis=1) < self.min_count
+            counts[sparse] = first_order[sparse]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return counts / counts.sum(axis=1, keepdims=True)
+
+    def get_transition_prob(self, start_rating, end_rating, condition=None):
+        return self.get_probabilities(condition)[self.ratings_map[start_rating], self.ratings_map[end_rating]]
+
+    def get_upgrade_prob(self, start_rating, condition=None):
+        numeric_rating = self.ratings_map[start_rating]
+        row = self.get_probabilities(condition)[numeric_rating]
+        if np.isnan(row).all():
+            return "Sorry, can't calc upgrade prob. No cases with start rating of {}".format(start_rating)
+        return row[numeric_rating + 1:].sum()
+
+    def get_dwngrade_prob(self, start_rating, condition=None):
+        numeric_rating = self.ratings_map[start_rating]
+        row = self.get_probabilities(condition)[numeric_rating]
+        if np.isnan(row).all():
+            return "Sorry, can't calc downgrade prob. No cases with start rating of {}".format(start_rating)
+        return row[:numeric_rating].sum()
+
+    def get_default_prob(self, start_rating, condition=None):
+        return self.get_transition_prob(start_rating, 'D', condition)
+
+    def get_expctd_notch_chng(self, start_rating, condition=None):
+        numeric_rating = self.ratings_map[start_rating]
+        row = self.get_probabilities(condition)[numeric_rating]
+        if np.isnan(row).all():
+            return "Sorry, can't calc expected notch change. No cases with start rating of {}".format(start_rating)
+        return (row * (np.arange(22) - numeric_rating)).sum()
+
+    def _matrix_frame(self, values, counts):
+        '''
+        lay out a 22 x 22 array like RatingsTransitionMatrix.get_transition_matrix_1: Start, Count, then AAA ... D
+        '''
+        df = pd.DataFrame()
+        df['Start'] = [self.ratings_map_inverse[i] for i in range(0, 22)]
+        df['Count'] = counts
+        for end_rating_numeric in range(21, -1, -1):
+            df[self.ratings_map_inverse[end_rating_numeric]] = values[:, end_rating_numeric]
+        df.sort_index(ascending=False, inplace=True)
+        return df
+
+    def get_transition_matrix_1(self, condition=None, csv=False, path=''):
+        '''
+        transition probabilities
+        :param csv: also write the frame to CSV_NAMES['probability'] in path, as boolean
+        :param path: the directory to write the csv to, as string (default: the working directory)
+        '''
+        df = self._matrix_frame(self.get_probabilities(condition), self.get_counts(condition).sum(axis=1))
+        if csv:
+            df.to_csv(os.path.join(path, CSV_NAMES['probability'].format(condition or 'all')))
+        return df
+
+    def get_transition_matrix_2(self, condition=None, csv=False, path=''):
+        '''
+        transitions by bond count
+        :param csv: also write the frame to CSV_NAMES['count'] in path, as boolean
+        :param path: the directory to write the csv to, as string (default: the working directory)
+        '''
+        counts = self.get_counts(condition)
+        df = self._matrix_frame(counts, counts.sum(axis=1))
+        if csv:
+            df.to_csv(os.path.join(path, CSV_NAMES['count'].format(condition or 'all')))
+        return df
+
+    def to_frame(self):
+        '''
+        the non-empty cells of the tensor
+        :return: condition, start, end, count and probability of every cell with cases, as dataframe
+        '''
+        k, i, j = np.nonzero(self.counts)
+        counts = self.counts[k, i, j]
+        start_counts = self.start_counts[k, i]
+        return pd.DataFrame({'condition': np.array(self.conditions, dtype=object)[k],
+                             'start': [self.ratings_map_inverse[x] for x in i],
+                             'end': [self.ratings_map_inverse[x] for x in j],
+                             'count': counts,
+                             'prob': counts / start_counts})
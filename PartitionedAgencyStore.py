@@ -0,0 +1,172 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import ColumnStore
+
+
+# keys of the three independent string hashes: one picks the partition, two drive the bloom filter
+PARTITION_HASH_KEY = '0123456789123456'
+BLOOM_HASH_KEYS = ['bloomfilterkey01', 'bloomfilterkey02']
+
+
+def _hashes(ids, hash_key):
+    return pd.util.hash_array(np.asarray(ids, dtype = object), hash_key = hash_key, categorize = False)
+
+
+def _bloom_positions(ids, bits, k):
+    '''
+    the k bit positions of each id, by double hashing: h1 + i * h2 for i in 0 .. k - 1
+    :return: len(ids) x k array of positions
+    '''
+    h1 = _hashes(ids, BLOOM_HASH_KEYS[0])
+    h2 = _hashes(ids, BLOOM_HASH_KEYS[1]) | np.uint64(1)
+    i = np.arange(k, dtype = np.uint64)
+    return ((h1[:, None] + i[None, :] * h2[:, None]) % np.uint64(bits)).astype(np.int64)
+
+
+class PartitionedAgencyStore():
+
+    '''
+    Use this class to store the normalized agency histories so a small universe of bonds can be loaded on its own.
+
+    The rating actions of each agency are hash-partitioned on the bond identifier (8 digit cusip or isin, the id the
+    lookups join on). Each partition is a ColumnStore directory with its rows sorted by id, plus:
+    - ids.npy / offsets.npy: the distinct ids in the partition and where their rows start
+    - bloom.npy: a bloom filter of the partition's ids
+
+    read(agency, ids) hashes the requested ids to their partitions, asks each partition's bloom filter whether it
+    can hold any of them and only opens the partitions that can. Within a partition only the rows of the matching
+    ids are read from the memory-mapped column files. AgencyRatings.load_partitioned_store uses this to load just
+    the ratings of a universe of bonds.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+        # partitions considered / opened / skipped by the bloom filter and rows read by the last read, per agency
+        self.read_stats = {}
+
+    def write(self, ratings, n_partitions = 64, false_positive_rate = 0.01):
+        '''
+        write the agency data of an AgencyRatings object to the store, replacing anything already stored there
+        :param ratings: an AgencyRatings object (agencies that aren't loaded yet are loaded), as AgencyRatings
+        :param n_partitions: number of hash partitions per agency, as int
+        :param false_positive_rate: target false positive rate of the bloom filters, as float
+        :return: None
+        '''
+
+        # AgencyRatings imports this module, so its feed layout is only imported when a store is written
+        import AgencyRatings
+
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+        meta = {'n_partitions': n_partitions, 'agencies': {}}
+        for agency in ['moodys', 'sp', 'fitch']:
+            id_field = AgencyRatings.AGENCY_FIELDS[agency]['id']
+            df = getattr(ratings, agency)
+
+            # rows without an identifier can never be found by an id lookup
+            df = df[df[id_field].notnull()]
+            ids = df[id_field].astype(str).to_numpy(dtype = object)
+            partition = (_hashes(ids, PARTITION_HASH_KEY) % np.uint64(n_partitions)).astype(np.int64)
+
+            # sort by partition and id, keeping the feed order of each bond's actions
+            order = np.lexsort((ids, partition))
+            df = df.iloc[order].reset_index(drop = True)
+            ids = ids[order]
+            partition = partition[order]
+            bounds = np.searchsorted(partition, np.arange(n_partitions + 1))
+
+            partitions = []
+            for p in range(n_partitions):
+                start, end = bounds[p], bounds[p + 1]
+                part_ids = ids[start:end]
+                name = 'part={:05d}'.format(p)
+                part_path = os.path.join(self.path, agency, name)
+                ColumnStore.write_frame(df.iloc[start:end], part_path)
+
+                # distinct ids of the partition and the row where each one starts (part_ids is sorted)
+                first = np.ones(len(part_ids), dtype = bool)
+                first[1:] = part_ids[1:] != part_ids[:-1]
+                distinct = part_ids[first]
+                offsets = np.append(np.flatnonzero(first), len(part_ids))
+                np.save(os.path.join(part_path, 'ids.npy'), distinct.astype(str))
+                np.save(os.path.join(part_path, 'offsets.npy'), offsets)
+
+                # bloom filter sized for the number of distinct ids and the target false positive rate
+                n = max(len(distinct), 1)
+                bits = int(np.ceil(-n * np.log(false_positive_rate) / np.log(2) ** 2))
+                bits = max(64, int(np.ceil(bits / 8)) * 8)
+                k = max(1, int(round(bits / n * np.log(2))))
+                bloom = np.zeros(bits, dtype = bool)
+                if len(distinct) > 0:
+                    bloom[_bloom_positions(distinct, bits, k).ravel()] = True
+                np.save(os.path.join(part_path, 'bloom.npy'), np.packbits(bloom))
+
+                partitions.append({'name': name, 'rows': int(end - start), 'ids': int(len(distinct)),
+                                   'bits': bits, 'k': k})
+
+            meta['agencies'][agency] = {'id': id_field, 'columns': [str(c) for c in df.columns],
+                                        'partitions': partitions}
+
+        with open(os.path.join(self.path, 'store.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def read(self, agency, ids, columns = None):
+        '''
+        read the rating actions of a set of bonds for one agency
+        :param agency: 'moodys', 'sp' or 'fitch'
+        :param ids: the bond identifiers (8 digit cusip or isin), as list-like
+        :param columns: only read these columns, as list of strings (default: all columns)
+        :return: the rating actions of the bonds, in the same layout as AgencyRatings.moodys / sp / fitch, as dataframe
+        '''
+
+        with open(os.path.join(self.path, 'store.json')) as f:
+            meta = json.load(f)
+        n_partitions = meta['n_partitions']
+        agency_meta = meta['agencies'][agency]
+
+        requested = pd.unique(pd.Series(ids).dropna().astype(str).to_numpy(dtype = object))
+        partition = (_hashes(requested, PARTITION_HASH_KEY) % np.uint64(n_partitions)).astype(np.int64)
+
+        stats = {'partitions': 0, 'bloom_skipped': 0, 'opened': 0, 'rows': 0}
+        frames = []
+        for p in np.unique(partition):
+            p_meta = agency_meta['partitions'][p]
+            part_path = os.path.join(self.path, agency, p_meta['name'])
+            candidates = requested[partition == p]
+            stats['partitions'] += 1
+
+            # ask the bloom filter before touching the partition's data
+            bloom = np.unpackbits(np.load(os.path.join(part_path, 'bloom.npy')))[:p_meta['bits']].astype(bool)
+            maybe = bloom[_bloom_positions(candidates, p_meta['bits'], p_meta['k'])].all(axis = 1)
+            if not maybe.any():
+                stats['bloom_skipped'] += 1
+                continue
+
+            # the ids that are really there and their row ranges
+            stats['opened'] += 1
+            part_ids = np.load(os.path.join(part_path, 'ids.npy'))
+            offsets = np.load(os.path.join(part_path, 'offsets.npy'))
+            if len(part_ids) == 0:
+                continue
+            candidates = candidates[maybe].astype(str)
+            pos = np.searchsorted(part_ids, candidates)
+            found = (pos < len(part_ids)) & (part_ids[np.clip(pos, 0, len(part_ids) - 1)] == candidates)
+            if not found.any():
+                continue
+            pos = np.sort(pos[found])
+            rows = ColumnStore.row_ranges(offsets[pos], offsets[pos + 1])
+
+            frames.append(ColumnStore.read_frame(part_path, columns = columns, rows = rows))
+            stats['rows'] += len(rows)
+
+        self.read_stats[agency] = stats
+
+        if len(frames) == 0:
+            return pd.DataFrame(columns = columns if columns is not None else agency_meta['columns'])
+        return pd.concat(frames, ignore_index = True)
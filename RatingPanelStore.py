@@ -0,0 +1,189 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import ColumnStore
+
+
+class RatingPanelStore():
+
+    '''
+    Use this class to write rating panels and time series to disk and read them back selectively:
+    1. daily time series from AgencyRatings.get_time_series_by_id
+    2. cohort frames like the baml start / end view used to build a ratings transition matrix
+
+    Instead of a text csv with full string ratings, a store is a directory of column files (see ColumnStore):
+    - rows are partitioned by year (or month) of the date column, one sub directory per partition
+    - within a partition the rows are sorted by bond and date
+    - bond identifiers are dictionary encoded: ids.npy holds every id once and the partitions store int32 codes
+    - string columns (the ratings, seniorities, ...) are stored as categoricals, so a rating is a single int8 code
+
+    read supports predicate pushdown on date and id: partitions outside the date range are never opened, and
+    within a partition only the rows of the requested bonds are read from the memory-mapped column files.
+    This means a job can load one month of one sector without scanning the whole panel.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, data, id_col, date_col = 'date', partition = 'year'):
+        '''
+        write a rating panel to the store, replacing anything already stored there
+        :param data: the panel or cohort frame with one row per bond (and date), as dataframe
+        :param id_col: the name of the column with the bond identifiers, as string
+        :param date_col: the name of the date column, as string, or None for a cohort frame without dates
+        :param partition: partition the rows by 'year' or by 'month' of date_col
+        :return: None
+        '''
+
+        assert id_col in data.columns, 'error: could not find the id column in data'
+        assert partition in ['year', 'month'], 'error: partition must be year or month'
+        if date_col is not None:
+            assert date_col in data.columns, 'error: could not find the date column in data'
+
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+        df = data.reset_index(drop = True)
+
+        # dictionary encode the ids: a sorted array of distinct ids plus an int32 code per row
+        ids = np.sort(df[id_col].dropna().astype(str).unique()).astype(str)
+        codes = np.full(df.shape[0], -1, dtype = np.int32)
+        mask = df[id_col].notnull().to_numpy()
+        codes[mask] = np.searchsorted(ids, df.loc[mask, id_col].astype(str).to_numpy())
+        np.save(os.path.join(self.path, 'ids.npy'), ids)
+
+        columns = {id_col: codes}
+        if date_col is not None:
+            columns[date_col] = pd.to_datetime(df[date_col]).to_numpy()
+
+        # every other string column becomes a categorical (int8 codes for rating columns)
+        # the categories are taken from the whole panel so every partition uses the same codes
+        for c in df.columns:
+            if c in [id_col, date_col]:
+                continue
+            if pd.api.types.is_object_dtype(df[c]) or pd.api.types.is_string_dtype(df[c]):
+                columns[c] = pd.Categorical(df[c].where(df[c].isnull(), df[c].astype(str)))
+            else:
+                columns[c] = df[c].to_numpy()
+        df = pd.DataFrame(columns)
+
+        # sort by bond and date so the rows of a bond sit together within a partition
+        df.sort_values(by = [id_col] if date_col is None else [id_col, date_col], kind = 'mergesort', inplace = True)
+        df.reset_index(drop = True, inplace = True)
+
+        if date_col is None:
+            keys = pd.Series('all', index = df.index)
+        elif partition == 'year':
+            keys = df[date_col].dt.strftime('%Y')
+        else:
+            keys = df[date_col].dt.strftime('%Y-%m')
+        keys = keys.fillna('none')
+
+        partitions = []
+        for key, rows in df.groupby(keys, sort = True).indices.items():
+            part = df.iloc[rows]
+            ColumnStore.write_frame(part, os.path.join(self.path, '{}={}'.format(partition, key)))
+            p = {'name': '{}={}'.format(partition, key), 'rows': int(part.shape[0])}
+            if date_col is not None and part[date_col].notnull().any():
+                p['min_date'] = str(part[date_col].min().date())
+                p['max_date'] = str(part[date_col].max().date())
+            partitions.append(p)
+
+        meta = {'id_col': id_col, 'date_col': date_col, 'partition': partition, 'partitions': partitions,
+                'columns': [str(c) for c in df.columns]}
+        with open(os.path.join(self.path, 'panel.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def read(self, start_date = None, end_date = None, ids = None, columns = None, categorical = False):
+        '''
+        read a rating panel back from the store
+        :param start_date: only read rows on or after this date, as datetime.date or 'YYYY-MM-DD'
+        :param end_date: only read rows on or before this date, as datetime.date or 'YYYY-MM-DD'
+        :param ids: only read these bonds, as a list (or series) of identifiers
+        :param columns: only read these columns, as list of strings (the id and date columns are always read)
+        :param categorical: keep string columns as categoricals instead of converting back to strings, as boolean
+        :return: the selected part of the panel, as dataframe
+        '''
+
+        with open(os.path.join(self.path, 'panel.json')) as f:
+            meta = json.load(f)
+        id_col = meta['id_col']
+        date_col = meta['date_col']
+
+        start = pd.Timestamp(start_date) if start_date is not None else None
+        end = pd.Timestamp(end_date) if end_date is not None else None
+
+        all_ids = np.load(os.path.join(self.path, 'ids.npy'))
+
+        # translate the requested ids to their codes, ids that were never stored cannot match anything
+        wanted = None
+        if ids is not None:
+            requested = pd.Series(ids).dropna().astype(str).to_numpy()
+            wanted = np.searchsorted(all_ids, np.intersect1d(all_ids, requested))
+
+        read_columns = None
+        if columns is not None:
+            read_columns = [id_col] + ([date_col] if date_col is not None else []) + \
+                           [c for c in columns if c not in [id_col, date_col]]
+
+        frames = []
+        for p in meta['partitions']:
+
+            # date pushdown: skip partitions entirely outside the date range
+            if (start is not None) and ('max_date' in p) and (pd.Timestamp(p['max_date']) < start):
+                continue
+            if (end is not None) and ('min_date' in p) and (pd.Timestamp(p['min_date']) > end):
+                continue
+
+            part_path = os.path.join(self.path, p['name'])
+
+            # id pushdown: rows are sorted by id code, so each bond is one contiguous block of rows
+            rows = None
+            if wanted is not None:
+                codes = ColumnStore.read_frame(part_path, columns = [id_col])[id_col].to_numpy()
+                left = np.searchsorted(codes, wanted, side = 'left')
+                right = np.searchsorted(codes, wanted, side = 'right')
+                keep = right > left
+                if not keep.any():
+                    continue
+                rows = ColumnStore.row_ranges(left[keep], right[keep])
+
+            # date filter within the partition
+            if (date_col is not None) and ((start is not None) or (end is not None)):
+                dates = ColumnStore.read_frame(part_path, columns = [date_col], rows = rows)[date_col]
+                mask = np.ones(dates.shape[0], dtype = bool)
+                if start is not None:
+                    mask &= (dates >= start).to_numpy()
+                if end is not None:
+                    mask &= (dates <= end).to_numpy()
+                if not mask.any():
+                    continue
+                rows = np.flatnonzero(mask) if rows is None else rows[mask]
+
+            frames.append(ColumnStore.read_frame(part_path, columns = read_columns, rows = rows))
+
+        if len(frames) == 0:
+            if len(meta['partitions']) == 0:
+                stored = meta.get('columns', [id_col] + ([date_col] if date_col is not None else []))
+                return pd.DataFrame(columns = read_columns if read_columns is not None else stored)
+            # nothing matched: no rows, but the columns and types of the panel
+            part_path = os.path.join(self.path, meta['partitions'][0]['name'])
+            frames.append(ColumnStore.read_frame(part_path, columns = read_columns, rows = np.zeros(0, dtype = int)))
+
+        df = pd.concat(frames, ignore_index = True)
+
+        # decode the ids
+        codes = df[id_col].to_numpy()
+        decoded = np.full(codes.shape[0], np.NaN, dtype = object)
+        decoded[codes >= 0] = all_ids[codes[codes >= 0]]
+        df[id_col] = decoded
+
+        if not categorical:
+            for c in df.columns:
+                if isinstance(df[c].dtype, pd.CategoricalDtype):
+                    df[c] = df[c].astype(object)
+
+        return df
@@ -0,0 +1,481 @@
+'''
+Local ratings query service.
+
+Loading the full agency histories takes a long time and several GB of memory, so rather than every notebook
+loading its own copy, one RatingsService process keeps a warm AgencyRatings object (agency data, composite
+history and optionally the identifier crosswalk and lookup cache) and answers queries over HTTP on a local port:
+
+    python RatingsService.py --port 8765
+    python RatingsService.py --snapshot D:\\agency_snapshot --port 8765
+
+Notebooks then use a RatingsClient, which has the same methods as AgencyRatings:
+
+    ratings = RatingsClient(port = 8765)
+    baml = ratings.get_agency_ratings_by_id(baml, 'cusip', datetime.date(2017, 12, 29))
+    baml = ratings.get_average_ratings(baml)
+
+Requests are served by one thread each. Only the columns a lookup needs (the ids, dates or ratings) are sent to the
+service, and the results are joined back onto the caller's dataframe by the client.
+
+refresh reloads the agency data in a background thread while the old data keeps answering queries, then swaps
+the new object in. Requests that are already running finish on the data they started with.
+'''
+import argparse
+import datetime
+import http.server
+import json
+import threading
+import timeit
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+import AgencyRatings
+
+
+# the AgencyRatings methods the service answers
+SERVICE_METHODS = ['get_fitch_ratings',
+                   'get_moodys_ratings',
+                   'get_sp_ratings',
+                   'get_agency_ratings_by_id',
+                   'get_agency_ratings_by_dates',
+                   'get_average_ratings',
+                   'get_composite_ratings_asof',
+                   'get_time_series_by_id']
+
+
+def _frame_to_json(df):
+    '''
+    encode a dataframe column by column, keeping enough type information to rebuild it
+    '''
+    columns = []
+    for c in df.columns:
+        s = df[c]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            values = [None if pd.isnull(v) else v.isoformat() for v in s]
+            columns.append({'name': c, 'kind': 'datetime', 'values': values})
+        elif pd.api.types.is_bool_dtype(s) or pd.api.types.is_numeric_dtype(s):
+            columns.append({'name': c, 'kind': 'numeric', 'dtype': s.dtype.str, 'values': s.to_numpy().tolist()})
+        elif pd.api.types.infer_dtype(s, skipna = True) == 'date':
+            values = [None if pd.isnull(v) else v.isoformat() for v in s]
+            columns.append({'name': c, 'kind': 'date', 'values': values})
+        else:
+            columns.append({'name': c, 'kind': 'object', 'values': s.astype(object).to_numpy().tolist()})
+    return {'columns': columns}
+
+
+def _frame_from_json(payload):
+    '''
+    rebuild a dataframe encoded by _frame_to_json
+    '''
+    df = pd.DataFrame()
+    for col in payload['columns']:
+        if col['kind'] == 'datetime':
+            df[col['name']] = pd.to_datetime(pd.Series(col['values'], dtype = object))
+        elif col['kind'] == 'numeric':
+            df[col['name']] = np.array(col['values'], dtype = np.dtype(col['dtype']))
+        elif col['kind'] == 'date':
+            df[col['name']] = [None if v is None else datetime.date.fromisoformat(v) for v in col['values']]
+        else:
+            values = np.empty(len(col['values']), dtype = object)
+            values[:] = [np.NaN if v is None else v for v in col['values']]
+            df[col['name']] = values
+    return df
+
+
+def _encode_arg(value):
+    '''
+    dates are sent as {'date': 'YYYY-MM-DD'} so they can be told apart from column names and 'current'
+    '''
+    if isinstance(value, datetime.date):
+        return {'date': value.isoformat()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_arg(v) for v in value]
+    return value
+
+
+def _decode_arg(value):
+    if isinstance(value, dict) and list(value.keys()) == ['date']:
+        return datetime.date.fromisoformat(value['date'])
+    if isinstance(value, list):
+        return [_decode_arg(v) for v in value]
+    return value
+
+
+def _json_default(value):
+    '''
+    json encoder for the numpy and datetime values found in results
+    '''
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, (datetime.date, pd.Timestamp)):
+        return value.isoformat()
+    raise TypeError('cannot encode {} as json'.format(type(value)))
+
+
+class RatingsService():
+
+    '''
+    Holds one warm AgencyRatings object and answers queries for it over HTTP, see the module docstring
+    '''
+
+    def __init__(self, data_path = None, snapshot_path = None, compact = False, crosswalk = False,
+                 cache_megabytes = 512, loader = None, host = '127.0.0.1', port = 8765):
+        '''
+        :param data_path: the directory with the data warehouse exports, as string (default: the AgencyRatings default)
+        :param snapshot_path: load the agency data from this snapshot (see AgencyRatings.save_snapshot), as string
+        :param compact: compact the rating histories when they are loaded, as boolean
+        :param crosswalk: build the identifier crosswalk, as boolean
+        :param cache_megabytes: size of the lookup cache (0 turns it off), as number of megabytes
+        :param loader: function returning a loaded AgencyRatings object, used instead of the options above
+        :param host: the address to listen on, as string
+        :param port: the port to listen on (0 picks a free port), as int
+        '''
+
+        self.data_path = data_path
+        self.snapshot_path = snapshot_path
+        self.compact = compact
+        self.crosswalk = crosswalk
+        self.cache_megabytes = cache_megabytes
+        self.loader = loader
+        self.host = host
+        self.port = port
+
+        # the AgencyRatings object answering queries, replaced as a whole by refresh
+        self.ratings = None
+        self.loaded_at = None
+        self.load_seconds = None
+        self.refreshing = False
+        self.refresh_error = None
+        self.refresh_lock = threading.Lock()
+
+        self.server = None
+        self.thread = None
+
+    def load(self):
+        '''
+        build and warm up a new AgencyRatings object
+        :return: the loaded AgencyRatings object
+        '''
+
+        if self.loader is not None:
+            ratings = self.loader()
+        elif self.snapshot_path is not None:
+            ratings = AgencyRatings.AgencyRatings(data_path = None)
+            ratings.load_snapshot(self.snapshot_path)
+        elif self.data_path is not None:
+            ratings = AgencyRatings.AgencyRatings(data_path = self.data_path, compact = self.compact)
+        else:
+            ratings = AgencyRatings.AgencyRatings(compact = self.compact)
+
+        # load everything up front, so no query pays for loading
+        if ratings.data_path is not None:
+            ratings.preload()
+        if self.cache_megabytes > 0:
+            ratings.enable_cache(max_megabytes = self.cache_megabytes)
+        if self.crosswalk and ratings.crosswalk is None:
+            ratings.build_crosswalk()
+        if ratings.composite_history is None:
+            ratings.build_composite_history()
+        return ratings
+
+    def refresh(self, wait = False):
+        '''
+        reload the agency data without interrupting queries: the new data is loaded next to the old data,
+        which keeps answering queries until the new data is swapped in
+        :param wait: return only once the new data is in use, as boolean
+        :return: False if a refresh was already running, else True
+        '''
+
+        with self.refresh_lock:
+            if self.refreshing:
+                return False
+            self.refreshing = True
+
+        def run():
+            start = timeit.default_timer()
+            try:
+                ratings = self.load()
+                # swapping the reference is atomic, requests hold on to the object they started with
+                self.ratings = ratings
+                self.loaded_at = datetime.datetime.now()
+                self.load_seconds = timeit.default_timer() - start
+                self.refresh_error = None
+            except Exception as e:
+                self.refresh_error = repr(e)
+            finally:
+                self.refreshing = False
+
+        if wait:
+            run()
+        else:
+            threading.Thread(target = run, daemon = True).start()
+        return True
+
+    def status(self):
+        '''
+        :return: what the service is serving, as dictionary
+        '''
+        ratings = self.ratings
+        status = {'loaded': ratings is not None,
+                  'loaded_at': None if self.loaded_at is None else self.loaded_at.isoformat(),
+                  'load_seconds': self.load_seconds,
+                  'refreshing': self.refreshing,
+                  'refresh_error': self.refresh_error}
+        if ratings is not None:
+            status['data_version'] = ratings.data_version
+            status['rows'] = {agency: int(getattr(ratings, '_' + agency).shape[0])
+                              for agency in ratings.loaded_agencies()}
+            status['cache'] = ratings.cache_info()
+        return status
+
+    def call(self, method, data, kwargs):
+        '''
+        run one query against the current AgencyRatings object
+        :param method: one of SERVICE_METHODS, as string
+        :param data: the data argument of the method, as dataframe
+        :param kwargs: the other arguments of the method, as dictionary
+        :return: the result of the method, as dataframe
+        '''
+        assert method in SERVICE_METHODS, 'error: unknown method {}'.format(method)
+        ratings = self.ratings
+        assert ratings is not None, 'error: the agency data is not loaded yet'
+        return getattr(ratings, method)(data, **kwargs)
+
+    def start(self, background = True):
+        '''
+        load the agency data (if needed) and start answering queries
+        :param background: serve from a background thread and return, rather than serving until interrupted, as boolean
+        :return: the (host, port) the service listens on
+        '''
+
+        if self.ratings is None:
+            self.refresh(wait = True)
+            assert self.ratings is not None, 'error: could not load the agency data: {}'.format(self.refresh_error)
+
+        self.server = http.server.ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+
+        if background:
+            self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+            self.thread.start()
+        else:
+            try:
+                self.server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.server.server_close()
+        return self.host, self.port
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.thread = None
+
+
+def _make_handler(service):
+    '''
+    request handler class bound to a service
+    GET /status, POST /refresh and POST /call/<method> with a json body {'data': ..., 'kwargs': ...}
+    '''
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def _send(self, code, body):
+            text = json.dumps(body, default = _json_default).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(text)))
+            self.end_headers()
+            self.wfile.write(text)
+
+        def do_GET(self):
+            if self.path == '/status':
+                self._send(200, service.status())
+            else:
+                self._send(404, {'error': 'error: unknown path {}'.format(self.path)})
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length).decode('utf-8')) if length > 0 else {}
+
+                if self.path == '/refresh':
+                    started = service.refresh(wait = body.get('wait', False))
+                    self._send(200, {'started': started, 'status': service.status()})
+                elif self.path.startswith('/call/'):
+                    kwargs = {k: _decode_arg(v) for k, v in body.get('kwargs', {}).items()}
+                    result = service.call(self.path[len('/call/'):], _frame_from_json(body['data']), kwargs)
+                    self._send(200, {'result': _frame_to_json(result)})
+                else:
+                    self._send(404, {'error': 'error: unknown path {}'.format(self.path)})
+            except AssertionError as e:
+                self._send(400, {'error': str(e), 'type': 'AssertionError'})
+            except Exception as e:
+                self._send(500, {'error': repr(e), 'type': type(e).__name__})
+
+        def log_message(self, format, *args):
+            # keep the console quiet, one line per request is too much for a busy service
+            pass
+
+    return Handler
+
+
+class RatingsClient():
+
+    '''
+    Queries a RatingsService with the same methods (and arguments) as AgencyRatings
+    '''
+
+    def __init__(self, host = '127.0.0.1', port = 8765, timeout = 600):
+        '''
+        :param host: the address of the service, as string
+        :param port: the port of the service, as int
+        :param timeout: seconds to wait for a query, as number
+        '''
+        self.url = 'http://{}:{}'.format(host, port)
+        self.timeout = timeout
+
+    def _request(self, path, body = None):
+        data = None if body is None else json.dumps(body, default = _json_default).encode('utf-8')
+        request = urllib.request.Request(self.url + path, data = data,
+                                         headers = {'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout = self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            error = json.loads(e.read().decode('utf-8'))
+            if error.get('type') == 'AssertionError':
+                raise AssertionError(error['error'])
+            raise RuntimeError('error: the ratings service failed: {}'.format(error['error']))
+
+    def _call(self, method, data, **kwargs):
+        body = {'data': _frame_to_json(data), 'kwargs': {k: _encode_arg(v) for k, v in kwargs.items()}}
+        return _frame_from_json(self._request('/call/' + method, body)['result'])
+
+    def status(self):
+        '''
+        :return: what the service is serving, as dictionary
+        '''
+        return self._request('/status')
+
+    def refresh(self, wait = False):
+        '''
+        ask the service to reload the agency data, see RatingsService.refresh
+        :return: False if a refresh was already running, else True
+        '''
+        return self._request('/refresh', {'wait': wait})['started']
+
+    def _bonds(self, data, id_col):
+        assert id_col in data.columns, 'error: could not find the id column in data'
+        return data[[id_col]].drop_duplicates()
+
+    def get_fitch_ratings(self, data, id_col, date = 'current'):
+        return self._call('get_fitch_ratings', self._bonds(data, id_col), id_col = id_col, date = date)
+
+    def get_moodys_ratings(self, data, id_col, date):
+        return self._call('get_moodys_ratings', self._bonds(data, id_col), id_col = id_col, date = date)
+
+    def get_sp_ratings(self, data, id_col, date):
+        return self._call('get_sp_ratings', self._bonds(data, id_col), id_col = id_col, date = date)
+
+    def get_time_series_by_id(self, data, id_col, start_date, end_date, verbose = False):
+        return self._call('get_time_series_by_id', self._bonds(data, id_col), id_col = id_col,
+                          start_date = start_date, end_date = end_date)
+
+    def get_agency_ratings_by_dates(self, data, id_col, dates):
+        return self._call('get_agency_ratings_by_dates', self._bonds(data, id_col), id_col = id_col,
+                          dates = list(dates))
+
+    def get_agency_ratings_by_id(self, data, id_col, date = 'current', inplace = False):
+        '''
+        same as AgencyRatings.get_agency_ratings_by_id: only the distinct bonds are sent, the ratings are joined here
+        '''
+
+        ratings = self._call('get_agency_ratings_by_id', self._bonds(data, id_col), id_col = id_col, date = date)
+
+        if inplace:
+            df = data
+            aligned = ratings.set_index(id_col).reindex(data[id_col].to_numpy())
+            for c in aligned.columns:
+                df[c] = aligned[c].to_numpy()
+        else:
+            df = data.merge(ratings, how = 'left', left_on = id_col, right_on = id_col)
+
+        for rating in ['moodys_rating', 'sp_rating', 'fitch_rating']:
+            df.loc[df[rating].isnull(), rating] = 'NR'
+
+        return df
+
+    def get_average_ratings(self, data, require_two_agencies = True, inplace = False, notching = None):
+        '''
+        same as AgencyRatings.get_average_ratings: only the three rating columns (and the seniorities) are sent
+        without a notching table the service's own AgencyRatings.seniority_notching is used
+        '''
+
+        ratings = ['moodys_rating', 'sp_rating', 'fitch_rating']
+        for c in ratings:
+            assert c in data.columns, 'error: cannot find {} in data'.format(c)
+        columns = ratings + [c for c in AgencyRatings.SENIORITY_COLUMNS.values() if c in data.columns]
+
+        kwargs = {'require_two_agencies': require_two_agencies}
+        if notching is not None:
+            # json has no tuple keys, so the table is sent as (agency, seniority, notches) triples
+            items = notching.items() if isinstance(notching, dict) else [((a, s), n) for a, s, n in notching]
+            kwargs['notching'] = [[a, s, int(n)] for (a, s), n in items]
+        result = self._call('get_average_ratings', data[columns], **kwargs)
+
+        df = data if inplace else data.copy()
+        for c in ['average_rating_num', 'agency_rating_count', 'average_rating']:
+            df[c] = result[c].to_numpy()
+        return df
+
+    def get_composite_ratings_asof(self, data, id_col, date, require_two_agencies = True, inplace = False):
+        '''
+        same as AgencyRatings.get_composite_ratings_asof: only the id (and date) columns are sent
+        '''
+
+        assert id_col in data.columns, 'error: could not find the id column in data'
+        columns = [id_col] if not isinstance(date, str) else list(dict.fromkeys([id_col, date]))
+        result = self._call('get_composite_ratings_asof', data[columns], id_col = id_col, date = date,
+                            require_two_agencies = require_two_agencies)
+
+        df = data if inplace else data.copy()
+        for c in ['average_rating_num', 'agency_rating_count', 'average_rating']:
+            df[c] = result[c].to_numpy()
+        return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'serve agency ratings from one warm AgencyRatings object')
+    parser.add_argument('--data-path', default = None, help = 'directory with the data warehouse exports')
+    parser.add_argument('--snapshot', default = None, help = 'load the agency data from this snapshot')
+    parser.add_argument('--compact', action = 'store_true', help = 'compact the rating histories')
+    parser.add_argument('--crosswalk', action = 'store_true', help = 'build the identifier crosswalk')
+    parser.add_argument('--cache-megabytes', type = int, default = 512)
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8765)
+    args = parser.parse_args()
+
+    service = RatingsService(data_path = args.data_path, snapshot_path = args.snapshot, compact = args.compact,
+                             crosswalk = args.crosswalk, cache_megabytes = args.cache_megabytes,
+                             host = args.host, port = args.port)
+    print('loading agency data')
+    service.refresh(wait = True)
+    assert service.ratings is not None, 'error: could not load the agency data: {}'.format(service.refresh_error)
+    print('loaded in {:.1f} seconds, serving on {}:{}'.format(service.load_seconds, service.host, service.port))
+    service.start(background = False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,182 +1,553 @@
 import collections
+import os
 import pandas as pd
 import numpy as np
 import timeit
 import datetime
 import urllib.parse
 from sqlalchemy import create_engine
+import Instrumentation
+
+
+# the matrices a RatingsTransitionMatrix can export and the csv file each one is written to
+MATRIX_KINDS = ['probability', 'count', 'market_value', 'oas_change']
+CSV_NAMES = {'probability': 'ratings_transition_probabilities.csv',
+             'count': 'ratings_transition_counts.csv',
+             'market_value': 'ratings_transition_market_values.csv',
+             'oas_change': 'ratings_transition_oas_changes.csv'}
+
+
+# the composite rating scale: the numeric rating of each rating is its position (0 = D ... 21 = AAA)
+COMPOSITE_STATES = ['D', 'C', 'CC', 'CCC3', 'CCC2', 'CCC1', 'B3', 'B2', 'B1', 'BB3', 'BB2', 'BB1',
+                    'BBB3', 'BBB2', 'BBB1', 'A3', 'A2', 'A1', 'AA3', 'AA2', 'AA1', 'AAA']
+
+# dictionary from alphanumeric to numeric composite rating, and from numeric to alphanumeric
+RATINGS_MAP = {r: i for i, r in enumerate(COMPOSITE_STATES)}
+RATINGS_MAP_INVERSE = {i: r for i, r in enumerate(COMPOSITE_STATES)}
+
+# the native scale of each agency: its ratings from worst to best, followed by the states that aren't ratings
+# (withdrawn / not rated), and the states that count as default. moodys has no D, its C is the default state
+NATIVE_SCALES = {'moodys': {'states': ['C', 'Ca', 'Caa3', 'Caa2', 'Caa1', 'B3', 'B2', 'B1', 'Ba3', 'Ba2', 'Ba1',
+                                       'Baa3', 'Baa2', 'Baa1', 'A3', 'A2', 'A1', 'Aa3', 'Aa2', 'Aa1', 'Aaa',
+                                       'WR', 'NR'],
+                            'n_ratings': 21,
+                            'default_states': ['C']},
+                 'sp': {'states': ['D', 'SD', 'C', 'CC', 'CCC-', 'CCC', 'CCC+', 'B-', 'B', 'B+', 'BB-', 'BB', 'BB+',
+                                   'BBB-', 'BBB', 'BBB+', 'A-', 'A', 'A+', 'AA-', 'AA', 'AA+', 'AAA',
+                                   'NR'],
+                        'n_ratings': 23,
+                        'default_states': ['D', 'SD']},
+                 'fitch': {'states': ['D', 'RD', 'C', 'CC', 'CCC-', 'CCC', 'CCC+', 'B-', 'B', 'B+', 'BB-', 'BB', 'BB+',
+                                      'BBB-', 'BBB', 'BBB+', 'A-', 'A', 'A+', 'AA-', 'AA', 'AA+', 'AAA',
+                                      'WD', 'NR'],
+                           'n_ratings': 23,
+                           'default_states': ['D', 'RD']}}
 
 
 class RatingsTransitionMatrix():
-    def __init__(self):
-        # dictionary from alphanumeric to numeric rating
-        self.ratings_map = {'AAA': 21,
-                            'AA1': 20, 'AA2': 19, 'AA3': 18,
-                            'A1': 17, 'A2': 16, 'A3': 15,
-                            'BBB1': 14, 'BBB2': 13, 'BBB3': 12,
-                            'BB1': 11, 'BB2': 10, 'BB3': 9,
-                            'B1': 8, 'B2': 7, 'B3': 6,
-                            'CCC1': 5, 'CCC2': 4, 'CCC3': 3, 'CC': 2, 'C': 1,
-                            'D': 0}
+    def __init__(self, states=None, n_ratings=None, default_states=None):
+        '''
+        by default the matrix is over the 22 ratings of the composite scale, any other state space can be given as a
+        list of states: the ratings from worst to best, optionally followed by states that aren't ratings (eg WR)
+        which are left out of upgrades, downgrades and notch changes. see NATIVE_SCALES and native()
+        :param states: the states, the code of each state is its position, as list of strings
+        :param n_ratings: the number of states that are ratings, as int (default: all of them)
+        :param default_states: the states that count as default, as list of strings (default: the worst rating)
+        '''
+        self.states = list(COMPOSITE_STATES if states is None else states)
+        self.n_states = len(self.states)
+        self.n_ratings = self.n_states if n_ratings is None else n_ratings
+        self.default_states = [self.states[0]] if default_states is None else list(default_states)
+        assert 0 < self.n_ratings <= self.n_states, 'error: n_ratings must be between 1 and the number of states'
+        assert all(d in self.states for d in self.default_states), 'error: default states must be states'
+
+        # dictionary from alphanumeric to numeric rating (the state code)
+        self.ratings_map = {r: i for i, r in enumerate(self.states)}
         # dictionary from numeric to alphanumeric rating
         self.ratings_map_inverse = {v: k for k, v in self.ratings_map.items()}
+        self.default_codes = np.array([self.ratings_map[d] for d in self.default_states], dtype=np.int64)
+
+        # the accumulators are n x n arrays, [start rating, end rating] by numeric rating (0 = D, 21 = AAA on the
+        # composite scale). they only ever add up cases, so matrices can be added and subtracted (see add, subtract
+        # and RollingTransitionMatrix). the transition_dict, start_counts and oas_change_dict properties give the
+        # dictionary views of the original implementation
+        n = self.n_states
 
         # 1. track the number of issues transitioning from one rating to another
-        # dictionary of dictionaries with rating transition **counts**.
-        # Ex: dict['A1']['BBB1'] is the number of cases where ratings went from A1 to BBB1
-        self.transition_dict = {r: collections.defaultdict(int) for r in self.ratings_map.keys()}
+        self.counts = np.zeros((n, n), dtype=np.int64)
+
+        # 2. track the sum of market value transitioning from one rating to another (of the cases with an oas change)
+        self.mkt_val = np.zeros((n, n))
+
+        # 3. track the market value weighted oas change, the weighted average is wghtd_oas_change / mkt_val
+        self.wghtd_oas_change = np.zeros((n, n))
+
+        # probabilities cached by get_probability_matrix, reset whenever the accumulators change
+        self._probabilities = None
+
+        # optional timing and memory instrumentation, see enable_instrumentation
+        self.instrumentation = None
+        self._own_instrumentation = False
+
+    @classmethod
+    def native(cls, agency):
+        '''
+        :param agency: 'moodys', 'sp' or 'fitch'
+        :return: an empty matrix over the native rating scale of the agency, see NATIVE_SCALES
+        '''
+        assert agency in NATIVE_SCALES, 'error: unknown agency {}'.format(agency)
+        return cls(**NATIVE_SCALES[agency])
+
+    def empty(self):
+        '''
+        :return: a new RatingsTransitionMatrix over the same states, without any cases
+        '''
+        return RatingsTransitionMatrix(states=self.states, n_ratings=self.n_ratings,
+                                       default_states=self.default_states)
+
+    def _display_order(self):
+        '''
+        state codes in the order of the exported frames: ratings best first, then the other states
+        '''
+        return np.concatenate([np.arange(self.n_ratings - 1, -1, -1), np.arange(self.n_ratings, self.n_states)])
+
+    def enable_instrumentation(self, instrumentation=None, trace_memory=False):
+        '''
+        record wall time, rows in / out and memory for loading and matrix building, see Instrumentation
+        :param instrumentation: collect into this Instrumentation object, eg the one of an AgencyRatings object
+        :param trace_memory: also trace peak memory with tracemalloc (slower), as boolean
+        :return: the Instrumentation object collecting the records
+        '''
+        self.disable_instrumentation()
+        self._own_instrumentation = instrumentation is None
+        if instrumentation is None:
+            instrumentation = Instrumentation.Instrumentation(trace_memory=trace_memory)
+        self.instrumentation = instrumentation
+        return instrumentation
+
+    def disable_instrumentation(self):
+        '''
+        stop recording, an Instrumentation object created by enable_instrumentation is closed (a shared one is not)
+        '''
+        if self._own_instrumentation:
+            self.instrumentation.close()
+        self._own_instrumentation = False
+        self.instrumentation = None
+
+    @property
+    def transition_dict(self):
+        '''
+        dictionary of dictionaries with rating transition **counts**.
+        Ex: dict['A1']['BBB1'] is the number of cases where ratings went from A1 to BBB1
+        '''
+        inverse = self.ratings_map_inverse
+        n = self.n_states
+        return {inverse[i]: collections.defaultdict(int, {inverse[j]: int(self.counts[i, j])
+                                                          for j in range(n) if self.counts[i, j] != 0})
+                for i in range(n)}
+
+    @transition_dict.setter
+    def transition_dict(self, value):
+        self.counts = np.array([[value[self.ratings_map_inverse[i]][self.ratings_map_inverse[j]]
+                                 for j in range(self.n_states)] for i in range(self.n_states)], dtype=np.int64)
+        self._probabilities = None
+
+    @property
+    def start_counts(self):
+        '''
+        dictionary with the number of times a bond started with rating X
+        '''
+        counts = self.counts.sum(axis=1)
+        return {self.ratings_map_inverse[i]: float(counts[i]) for i in range(self.n_states)}
 
-        # 2. track the sum of market value transitioning from one rating to another
-        # dictionary of dictionary with rating transitions by market value
+    @property
+    def oas_change_dict(self):
+        '''
+        dictionary of dictionaries with the market value weighted average oas change of each rating transition
+        '''
+        inverse = self.ratings_map_inverse
+        oas = self.get_oas_change_matrix()
+        n = self.n_states
+        return {inverse[i]: collections.defaultdict(float, {inverse[j]: oas[i, j]
+                                                            for j in range(n) if self.mkt_val[i, j] != 0})
+                for i in range(n)}
 
-        # 3. track the weighted average oas
-        self.oas_change_dict = {r: collections.defaultdict(float) for r in self.ratings_map.keys()}
+    def _changed(self):
+        self._probabilities = None
 
-        # dictionary with the number of times a bond started with rating X
-        self.start_counts = {r: 0.0 for r in self.ratings_map.keys()}
+    def _codes(self, ratings):
+        '''
+        numeric codes of a column of alphanumeric ratings, -1 for NR and anything else that isn't a rating
+        '''
+        codes, uniques = pd.factorize(ratings)
+        lookup = np.array([self.ratings_map.get(r, -1) for r in uniques] + [-1], dtype=np.int64)
+        return lookup[codes]
 
     def load_case(self, start_rating, end_rating):
 
         # 1. add to the ratings transition matrix
-        self.transition_dict[start_rating][end_rating] += 1
-
-        # add to total count of cases that start with a given rating
-        self.start_counts[start_rating] += 1
+        # (which also adds to the total count of cases that start with a given rating)
+        self.counts[self.ratings_map[start_rating], self.ratings_map[end_rating]] += 1
+        self._changed()
 
+    @Instrumentation.instrumented
     def load_rtm(self, data):
-        for i in range(data.shape[0]):
-            r1 = data.loc[i, 'average_rating_0']
-            r2 = data.loc[i, 'average_rating_1']
-            if (r1 != 'NR') and (r2 != 'NR'):
-                self.load_case(r1, r2)
+        '''
+        add the rating transitions of a cohort, cases where either rating is NR are skipped
+        :param data: a dataset with average_rating_0 (start) and average_rating_1 (end) columns, as dataframe
+        :return: None
+        '''
+        self.load_codes(self._codes(data['average_rating_0']), self._codes(data['average_rating_1']))
         return None
 
-    def load_oas_change_matrix(self, data):
+    def load_codes(self, start, end):
+        '''
+        add cases given as state codes (see ratings_map), cases where either code is -1 are skipped
+        :param start: the start state of each case, as int array
+        :param end: the end state of each case, as int array
+        :return: None
+        '''
+        n = self.n_states
+        start = np.asarray(start, dtype=np.int64)
+        end = np.asarray(end, dtype=np.int64)
+        ok = (start >= 0) & (end >= 0)
+        self.counts += np.bincount(start[ok] * n + end[ok], minlength=n * n).reshape(n, n)
+        self._changed()
 
-        # make a copy of the data
-        temp = data[['cusip', 'mkt_val', 'average_rating_0', 'average_rating_1', 'oas_0', 'oas_1', 'oas_change']].copy()
-        mask1 = temp['average_rating_0'] != 'NR'
-        mask2 = temp['average_rating_1'] != 'NR'
-        mask3 = temp['oas_change'].notnull()
-        temp = temp[mask1 & mask2 & mask3]
+    @Instrumentation.instrumented
+    def load_oas_change_matrix(self, data):
+        '''
+        add the market value weighted oas changes of a cohort, cases where either rating is NR or the market value or
+        oas change is missing are skipped
+        :param data: a dataset with mkt_val, average_rating_0, average_rating_1 and oas_change columns, as dataframe
+        :return: None
+        '''
+        r1 = self._codes(data['average_rating_0'])
+        r2 = self._codes(data['average_rating_1'])
+        mkt_val = data['mkt_val'].to_numpy(dtype=float)
+        oas_change = data['oas_change'].to_numpy(dtype=float)
+        ok = (r1 >= 0) & (r2 >= 0) & np.isfinite(mkt_val) & np.isfinite(oas_change)
 
         # calc the weighted oas change for each rating transition
-        temp['wghtd_oas_change'] = temp['mkt_val'] * temp['oas_change']
-        top = temp.groupby(by=['average_rating_0', 'average_rating_1'])['wghtd_oas_change'].sum()
-        bottom = temp.groupby(by=['average_rating_0', 'average_rating_1'])['mkt_val'].sum()
-        wghtd_changes = top / bottom
-
-        # convert to dataframe with columns average_rating_0, average_rating_1, wghtd_oas_change
-        wghtd_changes = wghtd_changes.to_frame('wghtd_oas_change')
-        wghtd_changes.reset_index(inplace=True, drop=False)
-        wghtd_changes
-
-        # load into a dictionary
-        # iterate through each row of the dataframe and load info
-        for i in range(wghtd_changes.shape[0]):
-            r1 = wghtd_changes.loc[i, 'average_rating_0']
-            r2 = wghtd_changes.loc[i, 'average_rating_1']
-            val = wghtd_changes.loc[i, 'wghtd_oas_change']
-            if (r1 != 'NR') and (r2 != 'NR'):
-                self.oas_change_dict[r1][r2] = val
+        n = self.n_states
+        cell = r1[ok] * n + r2[ok]
+        self.mkt_val += np.bincount(cell, weights=mkt_val[ok], minlength=n * n).reshape(n, n)
+        self.wghtd_oas_change += np.bincount(cell, weights=mkt_val[ok] * oas_change[ok],
+                                             minlength=n * n).reshape(n, n)
+        self._changed()
         return None
 
+    @Instrumentation.instrumented
+    def load_issuer_rtm(self, data, issuer_col='ticker', rule='most_common', seniority_col=None):
+        '''
+        add the rating transitions of a cohort with one case per issuer instead of one per bond
+        each issuer's start and end ratings are rolled up from its bonds (see IssuerRollup.issuer_ratings), its
+        market value is the sum over its bonds and its oas change the market value weighted average over its bonds
+        :param data: a bond-level cohort with average_rating_0, average_rating_1, the issuer column and optionally
+                     mkt_val and oas_change columns, as dataframe
+        :param issuer_col: the name of the column identifying the issuer, eg ticker, as string
+        :param rule: 'most_common' or 'senior_unsecured', see IssuerRollup.issuer_ratings
+        :param seniority_col: the name of the column with the bond seniority, for the 'senior_unsecured' rule, as string
+        :return: the issuer-level cohort, one row per issuer, as dataframe
+        '''
+        # IssuerRollup takes the rating scale from this module
+        import IssuerRollup
+
+        issuers = IssuerRollup.issuer_ratings(data, issuer_col, 'average_rating_0', rule=rule,
+                                              seniority_col=seniority_col)
+        end = IssuerRollup.issuer_ratings(data, issuer_col, 'average_rating_1', rule=rule,
+                                          seniority_col=seniority_col)
+        issuers = issuers.merge(end[[issuer_col, 'average_rating_1']], how='left', on=issuer_col)
+
+        with_oas = ('mkt_val' in data.columns) and ('oas_change' in data.columns)
+        if with_oas:
+            mkt_val = data['mkt_val'].to_numpy(dtype=float)
+            oas_change = data['oas_change'].to_numpy(dtype=float)
+            ok = np.isfinite(mkt_val) & np.isfinite(oas_change)
+            sums = pd.DataFrame({issuer_col: data[issuer_col].to_numpy(),
+                                 'mkt_val': mkt_val,
+                                 'oas_weight': np.where(ok, mkt_val, 0.0),
+                                 'wghtd_oas_change': np.where(ok, mkt_val * oas_change, 0.0)})
+            sums = sums.groupby(issuer_col, sort=True).sum().reset_index()
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sums['oas_change'] = np.where(sums['oas_weight'] != 0,
+                                              sums['wghtd_oas_change'] / sums['oas_weight'], np.NaN)
+            issuers = issuers.merge(sums[[issuer_col, 'mkt_val', 'oas_change']], how='left', on=issuer_col)
+
+        self.load_rtm(issuers)
+        if with_oas:
+            self.load_oas_change_matrix(issuers)
+        return issuers
+
+    def copy(self):
+        '''
+        :return: a new RatingsTransitionMatrix with the same cases
+        '''
+        other = self.empty()
+        other.counts = self.counts.copy()
+        other.mkt_val = self.mkt_val.copy()
+        other.wghtd_oas_change = self.wghtd_oas_change.copy()
+        return other
+
+    def add(self, other):
+        '''
+        add the cases of another RatingsTransitionMatrix (eg a new period) to this one
+        :param other: a RatingsTransitionMatrix over the same states
+        :return: None
+        '''
+        assert other.states == self.states, 'error: cannot add a matrix over different states'
+        self.counts += other.counts
+        self.mkt_val += other.mkt_val
+        self.wghtd_oas_change += other.wghtd_oas_change
+        self._changed()
+
+    def subtract(self, other):
+        '''
+        remove the cases of another RatingsTransitionMatrix (eg a period leaving a rolling window) from this one
+        other must have been added before
+        :param other: a RatingsTransitionMatrix over the same states
+        :return: None
+        '''
+        assert other.states == self.states, 'error: cannot subtract a matrix over different states'
+        assert (other.counts <= self.counts).all(), 'error: cannot subtract cases that were never added'
+        self.counts -= other.counts
+        self.mkt_val -= other.mkt_val
+        self.wghtd_oas_change -= other.wghtd_oas_change
+        # clear rounding residue of the floating point sums in the cells whose cases were all removed
+        empty = (self.counts == 0) & (other.counts != 0)
+        self.mkt_val[empty] = 0.0
+        self.wghtd_oas_change[empty] = 0.0
+        self._changed()
+
+    def get_oas_change_matrix(self):
+        '''
+        market value weighted average oas changes as an array, [start rating, end rating] by numeric rating
+        cells without cases are NaN
+        :return: n x n array (22 x 22 on the composite scale)
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.mkt_val != 0, self.wghtd_oas_change / self.mkt_val, np.NaN)
+
     def get_transition_prob(self, start_rating, end_rating):
         try:
-            return self.transition_dict[start_rating][end_rating] / self.start_counts[start_rating]
-        except ZeroDivisionError:
+            start = self.ratings_map[start_rating]
+            end = self.ratings_map[end_rating]
+        except KeyError:
+            return 'unknown problem'
+        start_count = self.counts[start].sum()
+        if start_count == 0:
             # return 'Error - divide by zero error. There are no cases with a starting rating of {}'.format(start_rating)
             return np.NaN
-        except:
-            return 'unknown problem'
+        return self.counts[start, end] / start_count
 
     def get_upgrade_prob(self, start_rating):
-        if self.start_counts[start_rating] == 0:
+        numeric_rating = self.ratings_map[start_rating]
+        if self.counts[numeric_rating].sum() == 0:
             return "Sorry, can't calc upgrade prob. No cases with start rating of {}".format(start_rating)
         else:
-            numeric_rating = self.ratings_map[start_rating]
-            tot_prob = 0.0
-            for i in range(numeric_rating + 1, 22):
-                tot_prob += self.get_transition_prob(start_rating, self.ratings_map_inverse[i])
-            return tot_prob
+            return self.get_probability_matrix()[numeric_rating, numeric_rating + 1:self.n_ratings].sum()
 
     def get_dwngrade_prob(self, start_rating):
-        if self.start_counts[start_rating] == 0:
+        numeric_rating = self.ratings_map[start_rating]
+        if self.counts[numeric_rating].sum() == 0:
             return "Sorry, can't calc downgrade prob. No cases with start rating of {}".format(start_rating)
         else:
-            numeric_rating = self.ratings_map[start_rating]
-            tot_prob = 0.0
-            for i in range(numeric_rating):
-                tot_prob += self.get_transition_prob(start_rating, self.ratings_map_inverse[i])
-            return tot_prob
+            return self.get_probability_matrix()[numeric_rating, :numeric_rating].sum()
 
     def get_default_prob(self, start_rating):
-        return self.get_transition_prob(start_rating, 'D')
+        probs = [self.get_transition_prob(start_rating, d) for d in self.default_states]
+        return probs[0] if len(probs) == 1 else sum(probs)
 
     def get_expctd_notch_chng(self, start_rating):
-        if self.start_counts[start_rating] == 0:
+        numeric_rating = self.ratings_map[start_rating]
+        if self.counts[numeric_rating].sum() == 0:
             return "Sorry, can't calc expected notch change. No cases with start rating of {}".format(start_rating)
         else:
-            numeric_rating = self.ratings_map[start_rating]
-            wghtd_sum = 0.0  # the weighted average notch change
+            # the weighted average notch change over all possible end ratings (states that aren't ratings count as 0)
+            notch_diff = np.arange(self.n_ratings) - numeric_rating
+            return (notch_diff * self.get_probability_matrix()[numeric_rating, :self.n_ratings]).sum()
+
+    def get_probability_matrix(self):
+        '''
+        transition probabilities as an array, rows and columns indexed by numeric rating (0 = D, 21 = AAA)
+        rows without any cases are NaN
+        :return: n x n array (22 x 22 on the composite scale)
+        '''
+        if self._probabilities is None:
+            start = self.counts.sum(axis=1).astype(float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._probabilities = self.counts / start[:, None]
+        return self._probabilities.copy()
 
-            # iterate over all possible end ratings
-            for i in range(0, 22):
-                end_rating = self.ratings_map_inverse[i]  # get the alphanumeric of the end rating
-                notch_diff = i - numeric_rating  # get the notches diff between end and start rating
-                end_rating_count = self.transition_dict[start_rating][
-                    end_rating]  # get the number of times the rating transitioned from start to end
-                wght = end_rating_count / self.start_counts[start_rating]
-                wghtd_sum += (notch_diff * wght)
+    @Instrumentation.instrumented
+    def simulate_portfolio(self, ratings, market_values=None, n_paths=1000, n_periods=1, recovery_rate=0.4,
+                           absorbing_default=True, seed=None, chunk_size=4000000):
+        '''
+        Monte Carlo simulation of the rating migrations of a portfolio
+
+        every period each bond moves to a new rating drawn from its row of the transition probabilities (the matrix
+        is the one-period matrix, eg the 1 year matrix for annual periods). the draws for a block of paths are made at
+        once: one uniform number per bond and path, looked up with a binary search in the cumulative rows.
+        paths are simulated in chunks of about chunk_size bond-paths, so memory stays bounded for large portfolios.
+
+        start ratings without cases in the matrix keep their rating. bonds rated NR are left out
+        :param ratings: start ratings, alphanumeric (eg average_rating) or numeric, as list-like
+        :param market_values: market value of each bond, as list-like (default: 1 per bond)
+        :param n_paths: number of simulated paths, as int
+        :param n_periods: number of periods per path, as int
+        :param recovery_rate: fraction of market value recovered on default, as float
+        :param absorbing_default: a defaulted bond stays in default, as boolean
+        :param seed: random seed, results are reproducible for the same seed and chunk_size, as int
+        :param chunk_size: number of bond-paths simulated at once, as int
+        :return: dictionary with
+                 defaults: number of defaulted bonds per path, as array
+                 losses: default loss per path, as array
+                 ending_counts: number of bonds per path and ending rating (numeric), as n_paths x n array
+                 ending_market_value: market value per path and ending rating (numeric), as n_paths x n array
+                 cumulative_default_rate: average share of bonds defaulted by the end of each period, as array
+                 ending_mix: average number of bonds and market value share per ending rating, as dataframe
+                 loss_quantiles: quantiles of the loss distribution, as series
+                 excluded: number of NR bonds left out, as int
+        '''
+
+        # numeric start ratings, NR bonds can't be simulated
+        ratings = pd.Series(np.asarray(ratings))
+        if ratings.dtype == object:
+            ratings = ratings.map(self.ratings_map)
+        ratings = ratings.to_numpy(dtype=float)
+        if market_values is None:
+            market_values = np.ones(len(ratings))
+        market_values = np.asarray(market_values, dtype=float)
+        rated = np.isfinite(ratings)
+        start = ratings[rated].astype(np.int8)
+        market_values = market_values[rated]
+        n_bonds = len(start)
+
+        # cumulative transition rows, each shifted by its start rating so one binary search covers every row
+        probs = self.get_probability_matrix()
+        empty = ~np.isfinite(probs).all(axis=1)
+        probs[empty] = 0.0
+        probs[empty, np.nonzero(empty)[0]] = 1.0
+        if absorbing_default:
+            probs[self.default_codes] = 0.0
+            probs[self.default_codes, self.default_codes] = 1.0
+        cum = np.cumsum(probs, axis=1)
+        cum[:, -1] = 1.0
+        n = self.n_states
+        flat = (cum + np.arange(n)[:, None]).ravel()
 
-            return wghtd_sum
+        rng = np.random.default_rng(seed)
+        defaults = np.zeros(n_paths, dtype=np.int64)
+        losses = np.zeros(n_paths)
+        ending_counts = np.zeros((n_paths, n), dtype=np.int64)
+        ending_market_value = np.zeros((n_paths, n))
+        defaulted_by_period = np.zeros(n_periods)
+        loss_given_default = market_values * (1 - recovery_rate)
 
+        paths_per_chunk = max(1, chunk_size // max(n_bonds, 1))
+        for first_path in range(0, n_paths, paths_per_chunk):
+            paths = min(paths_per_chunk, n_paths - first_path)
+            state = np.broadcast_to(start, (paths, n_bonds)).copy()
+            defaulted = np.zeros((paths, n_bonds), dtype=bool)
+            draws = np.empty((paths, n_bonds))
+            for t in range(n_periods):
+                rng.random(out=draws)
+                row = state.astype(np.intp)
+                draws += row
+                state = (np.searchsorted(flat, draws, side='right') - n * row).clip(0, n - 1).astype(np.int8)
+                defaulted |= np.isin(state, self.default_codes)
+                defaulted_by_period[t] += defaulted.sum()
+
+            chunk = slice(first_path, first_path + paths)
+            defaults[chunk] = defaulted.sum(axis=1)
+            losses[chunk] = defaulted.astype(float) @ loss_given_default
+            for r in range(n):
+                at_r = state == r
+                ending_counts[chunk, r] = at_r.sum(axis=1)
+                ending_market_value[chunk, r] = at_r.astype(float) @ market_values
+
+        order = self._display_order()
+        ending_mix = pd.DataFrame({'rating': [self.ratings_map_inverse[r] for r in order],
+                                   'count': ending_counts.mean(axis=0)[order],
+                                   'market_value_share': ending_market_value.mean(axis=0)[order] /
+                                                         max(market_values.sum(), 1e-300)})
+
+        return {'defaults': defaults,
+                'losses': losses,
+                'ending_counts': ending_counts,
+                'ending_market_value': ending_market_value,
+                'cumulative_default_rate': defaulted_by_period / (n_paths * max(n_bonds, 1)),
+                'ending_mix': ending_mix,
+                'loss_quantiles': pd.Series(np.quantile(losses, [0.5, 0.9, 0.95, 0.99, 0.999]) if n_paths > 0
+                                            else np.full(5, np.NaN), index=[0.5, 0.9, 0.95, 0.99, 0.999]),
+                'excluded': int((~rated).sum())}
+
+    @Instrumentation.instrumented
     def get_transition_matrix_1(self, csv=False):
         '''
         transition probabilities
         '''
-        df = pd.DataFrame()
-        df['Start'] = [self.ratings_map_inverse[x] for x in sorted(self.ratings_map_inverse.keys(), reverse=False)]
-        df['Count'] = [self.start_counts[self.ratings_map_inverse[i]] for i in range(0, 22)]
-        for end_rating_numeric in range(21, -1, -1):
-            df[self.ratings_map_inverse[end_rating_numeric]] = \
-                [self.get_transition_prob(self.ratings_map_inverse[i], self.ratings_map_inverse[end_rating_numeric]) for
-                 i in range(0, 22)]
-        df.sort_index(ascending=False, inplace=True)
-        if csv:
-            df.to_csv('ratings_transition_matrix.csv')
-        return df
+        return self.get_matrix_frame('probability', csv=csv)
 
+    @Instrumentation.instrumented
     def get_transition_matrix_2(self, csv=False):
         '''
         transitions by bond count
         '''
-        df = pd.DataFrame()
-        df['Start'] = [self.ratings_map_inverse[x] for x in sorted(self.ratings_map_inverse.keys(), reverse=False)]
-        df['Count'] = [self.start_counts[self.ratings_map_inverse[i]] for i in range(0, 22)]
-        for end_rating_numeric in range(21, -1, -1):
-            df[self.ratings_map_inverse[end_rating_numeric]] = \
-                [self.transition_dict[self.ratings_map_inverse[i]][self.ratings_map_inverse[end_rating_numeric]] for i
-                 in range(0, 22)]
-        df.sort_index(ascending=False, inplace=True)
-        if csv:
-            df.to_csv('ratings_transition_matrix.csv')
-        return df
+        return self.get_matrix_frame('count', csv=csv)
 
+    @Instrumentation.instrumented
     def get_transition_matrix_3(self, csv=False):
         '''
         weighted-average oas changes
         '''
-        df = pd.DataFrame()
-        df['Start'] = [self.ratings_map_inverse[x] for x in sorted(self.ratings_map_inverse.keys(), reverse=False)]
-        df['Count'] = [self.start_counts[self.ratings_map_inverse[i]] for i in range(0, 22)]
-        for end_rating_numeric in range(21, -1, -1):
-            df[self.ratings_map_inverse[end_rating_numeric]] = \
-                [self.oas_change_dict[self.ratings_map_inverse[i]][self.ratings_map_inverse[end_rating_numeric]] for i
-                 in range(0, 22)]
-        df.sort_index(ascending=False, inplace=True)
+        return self.get_matrix_frame('oas_change', csv=csv)
+
+    def get_matrix_array(self, kind):
+        '''
+        one of the matrices as an array, [start rating, end rating] by numeric rating (0 = D, 21 = AAA on the
+        composite scale)
+        :param kind: 'probability' (NaN rows without cases), 'count', 'market_value' (market value of the cases with an
+                     oas change) or 'oas_change' (market value weighted average, 0 in cells without cases)
+        :return: n x n array
+        '''
+        assert kind in MATRIX_KINDS, 'error: kind must be one of {}'.format(', '.join(MATRIX_KINDS))
+        if kind == 'probability':
+            return self.get_probability_matrix()
+        if kind == 'count':
+            return self.counts.copy()
+        if kind == 'market_value':
+            return self.mkt_val.copy()
+        return np.nan_to_num(self.get_oas_change_matrix(), nan=0.0)
+
+    def get_matrix_frame(self, kind, csv=False, path=''):
+        '''
+        one of the matrices in the layout of the notebooks: a Start and a Count column, then one column per end rating,
+        best rating first in both directions (followed by the states that aren't ratings)
+        :param kind: see get_matrix_array
+        :param csv: also write the frame to CSV_NAMES[kind] in path, as boolean
+        :param path: the directory to write the csv to, as string (default: the working directory)
+        :return: dataframe
+        '''
+        values = self.get_matrix_array(kind)
+        order = self._display_order()
+
+        df = pd.DataFrame(index=order)
+        df['Start'] = [self.ratings_map_inverse[i] for i in order]
+        df['Count'] = self.counts.sum(axis=1)[order].astype(float)
+        df = pd.concat([df, pd.DataFrame(values[np.ix_(order, order)], index=order,
+                                         columns=[self.ratings_map_inverse[j] for j in order])], axis=1)
         if csv:
-            df.to_csv('ratings_transition_matrix.csv')
+            df.to_csv(os.path.join(path, CSV_NAMES[kind]))
         return df
 
-
+    def export(self, kinds=None, csv=False, path=''):
+        '''
+        all matrices as frames (see get_matrix_frame), each written to its own csv if requested
+        :param kinds: the matrices to export, as list (default: MATRIX_KINDS)
+        :param csv: write each frame to CSV_NAMES[kind] in path, as boolean
+        :param path: the directory to write the csvs to, as string (default: the working directory)
+        :return: kind -> dataframe, as dictionary
+        '''
+        kinds = MATRIX_KINDS if kinds is None else kinds
+        return {kind: self.get_matrix_frame(kind, csv=csv, path=path) for kind in kinds}
@@ -0,0 +1,84 @@
+import collections
+import RatingsTransitionMatrix
+
+
+class RollingTransitionMatrix():
+    '''
+    Transition matrix over a trailing window of periods (eg the trailing 12 months)
+
+    Each period's cases are kept as their own RatingsTransitionMatrix. Adding a period adds its accumulators to the
+    current matrix and subtracts those of the period falling out of the window, so updating the window only costs the
+    new period's data, not a rebuild of the whole window. The current matrix is self.matrix, a regular
+    RatingsTransitionMatrix with all its accessors (its cached probabilities are reset on every update).
+
+    Periods are evicted in the order they were added, so add them in chronological order.
+    '''
+
+    def __init__(self, window=12, template=None):
+        '''
+        :param window: number of periods in the window, as int (None: never evict)
+        :param template: a matrix over the states to use, eg RatingsTransitionMatrix.native('sp'), as
+                         RatingsTransitionMatrix (default: the composite scale)
+        '''
+        self.window = window
+
+        # period -> RatingsTransitionMatrix with the cases of that period, oldest first
+        self.periods = collections.OrderedDict()
+
+        # the matrix of the current window
+        self.matrix = template.empty() if template is not None else RatingsTransitionMatrix.RatingsTransitionMatrix()
+
+    def add_period(self, period, data):
+        '''
+        add the cases of one period, evicting the oldest periods if the window is full
+        :param period: label of the period, eg '2017-12', as any hashable
+        :param data: the period's cohort with average_rating_0, average_rating_1 and optionally mkt_val and
+                     oas_change columns (see RatingsTransitionMatrix.load_rtm / load_oas_change_matrix), as dataframe
+        :return: the periods evicted from the window, as list
+        '''
+        contribution = self.matrix.empty()
+        contribution.load_rtm(data)
+        if ('mkt_val' in data.columns) and ('oas_change' in data.columns):
+            contribution.load_oas_change_matrix(data)
+        return self.add_contribution(period, contribution)
+
+    def add_contribution(self, period, contribution):
+        '''
+        add an already built RatingsTransitionMatrix as one period, evicting the oldest periods if the window is full
+        :param period: label of the period, as any hashable
+        :param contribution: the cases of the period, as RatingsTransitionMatrix
+        :return: the periods evicted from the window, as list
+        '''
+        assert period not in self.periods, 'error: period {} is already in the window'.format(period)
+
+        self.periods[period] = contribution
+        self.matrix.add(contribution)
+
+        evicted = []
+        while (self.window is not None) and (len(self.periods) > self.window):
+            old_period, old_contribution = self.periods.popitem(last=False)
+            self.matrix.subtract(old_contribution)
+            evicted.append(old_period)
+        return evicted
+
+    def remove_period(self, period):
+        '''
+        take one period's cases out of the window, eg to restate it
+        :param period: label of the period, as any hashable
+        :return: None
+        '''
+        assert period in self.periods, 'error: period {} is not in the window'.format(period)
+        self.matrix.subtract(self.periods.pop(period))
+
+    def rebuild(self):
+        '''
+        recompute the current matrix from the periods in the window (clears any floating point drift)
+        :return: None
+        '''
+        self.matrix.counts[:] = 0
+        self.matrix.mkt_val[:] = 0.0
+        self.matrix.wghtd_oas_change[:] = 0.0
+        for contribution in self.periods.values():
+            self.matrix.add(contribution)
+        # the cached probabilities are stale even when the window is empty
+        self.matrix._changed()
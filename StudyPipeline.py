@@ -0,0 +1,205 @@
+'''
+The ratings transition study of the RTM notebooks as a pipeline with a concurrent acquisition stage.
+
+The notebook runs every step one after the other: load the agency csv exports, query the BAML start snapshot, query
+the end snapshot, then run the agency lookups. The loads are all I/O bound and independent, so the acquisition
+stage runs them on a thread pool: the three agency feeds are read while the start and end constituent snapshots are
+fetched. The lookup for the start view begins as soon as the agency data and the start snapshot are in, while the end
+snapshot may still be loading; the end view (the start constituents a period later) also needs the end snapshot.
+
+    ratings = AgencyRatings.AgencyRatings()
+    source = SqlConstituentSource(engine)
+    pipeline = StudyPipeline(ratings, source, datetime.date(2016, 12, 31), datetime.date(2017, 12, 31),
+                             start_snapshot = '2017-01-03', end_snapshot = '2017-12-31')
+    rtm = pipeline.run()
+
+For testing, the constituents can come from csv files (FileConstituentSource) or a SQLite database
+(SqlConstituentSource with a sqlite3 connection and table = 'flattened_w_index').
+'''
+import concurrent.futures
+import os
+import sqlite3
+import timeit
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+import Identifiers
+import RatingsTransitionMatrix
+
+
+class SqlConstituentSource():
+
+    '''
+    BAML index constituents from the BAML database (or any database with the same table layout)
+    '''
+
+    def __init__(self, connection, table = 'dbo.flattened_w_index', index_names = ('C0A0', 'H0A0')):
+        '''
+        :param connection: a sqlalchemy engine, a sqlalchemy url (eg 'sqlite:///baml.db') or a sqlite3 connection
+                           (opened with check_same_thread = False, the snapshots are fetched on worker threads)
+        :param table: the table with one row per constituent and date, as string
+        :param index_names: the BAML indices to take the constituents from, as list of strings
+        '''
+        self.connection = create_engine(connection) if isinstance(connection, str) else connection
+        self.table = table
+        self.index_names = list(index_names)
+
+    def fetch(self, date):
+        '''
+        :param date: the constituent date, as 'YYYY-MM-DD' or datetime.date
+        :return: the constituents on that date, as dataframe
+        '''
+        # the date and index names are bound parameters, only the (configured) table name is part of the sql
+        params = {'date': str(date)}
+        params.update({'index_{}'.format(i): name for i, name in enumerate(self.index_names)})
+        sql = """SELECT *
+        FROM {}
+        WHERE date = :date
+        AND ({})
+        """.format(self.table, ' OR '.join('index_name = :index_{}'.format(i) for i in range(len(self.index_names))))
+
+        # sqlite3 connections take the named parameters as they are, sqlalchemy engines need a text clause
+        if isinstance(self.connection, sqlite3.Connection):
+            return pd.read_sql_query(sql, self.connection, params = params)
+        return pd.read_sql_query(text(sql), self.connection, params = params)
+
+
+class FileConstituentSource():
+
+    '''
+    BAML index constituents from csv files, one file per date
+    '''
+
+    def __init__(self, path, pattern = 'baml_{date}.csv'):
+        '''
+        :param path: the directory with the files, as string
+        :param pattern: the file name, {date} is replaced by the date in 'YYYY-MM-DD' format, as string
+        '''
+        self.path = path
+        self.pattern = pattern
+
+    def fetch(self, date):
+        return pd.read_csv(os.path.join(self.path, self.pattern.format(date = str(date))), dtype = {'cusip': str})
+
+
+class StudyPipeline():
+
+    '''
+    acquisition -> lookup -> transition matrix, for one start / end cohort
+    '''
+
+    def __init__(self, ratings, constituents, start_date, end_date, start_snapshot = None, end_snapshot = None,
+                 require_two_agencies = False, max_workers = 5):
+        '''
+        :param ratings: the agency data, as AgencyRatings (agencies that aren't loaded yet are loaded concurrently)
+        :param constituents: where the BAML constituents come from, eg SqlConstituentSource, anything with fetch(date)
+        :param start_date: the date of the start ratings, as datetime.date
+        :param end_date: the date of the end ratings, as datetime.date
+        :param start_snapshot: the date of the start constituents and spreads (default: start_date)
+        :param end_snapshot: the date of the end spreads (default: end_date)
+        :param require_two_agencies: see AgencyRatings.get_average_ratings, as boolean
+        :param max_workers: number of acquisition threads, as int
+        '''
+        self.ratings = ratings
+        self.constituents = constituents
+        self.start_date = start_date
+        self.end_date = end_date
+        self.start_snapshot = start_snapshot if start_snapshot is not None else start_date
+        self.end_snapshot = end_snapshot if end_snapshot is not None else end_date
+        self.require_two_agencies = require_two_agencies
+        self.max_workers = max_workers
+
+        # seconds from the start of the run until each task finished
+        self.timings = {}
+
+        # the cohort frame of the last run
+        self.cohort = None
+
+    def _timed(self, name, func, *args):
+        '''
+        run func and remember when it finished, relative to the start of the run
+        '''
+        result = func(*args)
+        self.timings[name] = timeit.default_timer() - self._run_start
+        return result
+
+    def _start_view(self, baml):
+        '''
+        lookup stage for the start of the period: ratings, market value and spread of the start constituents
+        '''
+        baml = self.ratings.get_agency_ratings_by_id(data = baml, id_col = 'cusip', date = self.start_date)
+        baml = self.ratings.get_average_ratings(data = baml, require_two_agencies = self.require_two_agencies)
+
+        baml['mkt_val'] = (baml['price'] / 100) * baml['face_value_loc']
+        baml['mkt_val'] += (baml['face_value_loc'] / 100) * baml['accrued_interest']
+
+        # keep selected columns and rename them
+        baml_start = baml[['cusip', 'ticker', 'description', 'ml_industry_lvl_3', 'ml_industry_lvl_4',
+                           'average_rating', 'prevmend_oas', 'mkt_val']]
+        return baml_start.rename(columns = {'average_rating': 'average_rating_0', 'prevmend_oas': 'oas_0'})
+
+    def _end_view(self, baml, baml_end):
+        '''
+        lookup stage for the end of the period: ratings and spread of the start constituents a period later
+        '''
+        baml = baml[['cusip']].merge(baml_end[['cusip', 'oas']], how = 'left', on = 'cusip')
+        baml_end = self.ratings.get_agency_ratings_by_id(data = baml, id_col = 'cusip', date = self.end_date)
+        baml_end = self.ratings.get_average_ratings(data = baml_end, require_two_agencies = self.require_two_agencies)
+
+        # keep selected columns and rename them
+        baml_end = baml_end[['cusip', 'average_rating', 'oas']]
+        return baml_end.rename(columns = {'average_rating': 'average_rating_1', 'oas': 'oas_1'})
+
+    def build_cohort(self):
+        '''
+        acquire the agency data and the constituent snapshots concurrently, then run the lookups
+        :return: one row per start constituent with the start / end ratings, spreads, spread change and market value,
+                 as dataframe
+        '''
+
+        self.timings = {}
+        self._run_start = timeit.default_timer()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = self.max_workers) as pool:
+
+            # acquisition stage: the agency feeds that aren't loaded yet and both constituent snapshots
+            # the feeds are only read on the threads, they are stored (and the caches reset) once, on this thread
+            loads = {agency: pool.submit(self._timed, 'load ' + agency, self.ratings.read_agency, agency)
+                     for agency in ['moodys', 'sp', 'fitch'] if agency not in self.ratings.loaded_agencies()}
+            start = pool.submit(self._timed, 'fetch start constituents', self.constituents.fetch, self.start_snapshot)
+            end = pool.submit(self._timed, 'fetch end constituents', self.constituents.fetch, self.end_snapshot)
+
+            # lookup stage: both views need all of the agency data and the start constituents, the start view is
+            # submitted before waiting for the end constituents, which only the end view needs
+            # (the constituent cusips are normalized the same way as the agency ids, see Identifiers)
+            for agency, f in loads.items():
+                setattr(self.ratings, agency, f.result())
+            if len(loads) > 0:
+                self.ratings.data_reloaded()
+            baml = Identifiers.normalize_frame(start.result(), 'cusip')
+            start_view = pool.submit(self._timed, 'start lookup', self._start_view, baml)
+            baml_end = Identifiers.normalize_frame(end.result(), 'cusip')
+            end_view = pool.submit(self._timed, 'end lookup', self._end_view, baml, baml_end)
+            baml_start = start_view.result()
+            baml_end = end_view.result()
+
+        # combine the 'start' view with the 'end' view
+        baml = baml_start.merge(baml_end, how = 'left', on = 'cusip')
+
+        # get the change in oas over the period
+        baml['oas_change'] = baml['oas_1'] - baml['oas_0']
+        self.timings['cohort'] = timeit.default_timer() - self._run_start
+        return baml
+
+    def run(self):
+        '''
+        build the cohort and load it into a transition matrix
+        :return: the transition matrix, as RatingsTransitionMatrix
+        '''
+        baml = self.build_cohort()
+        rtm = RatingsTransitionMatrix.RatingsTransitionMatrix()
+        rtm.load_rtm(data = baml)
+        rtm.load_oas_change_matrix(data = baml)
+        self.cohort = baml
+        return rtm
@@ -0,0 +1,295 @@
+import os
+import numpy as np
+import pandas as pd
+import Identifiers
+
+
+# agency symbols by numeric rating (0 = default ... 21 = AAA), as in AgencyRatings.numeric_dict
+MOODYS_SCALE = ['C', 'C', 'Ca', 'Caa3', 'Caa2', 'Caa1', 'B3', 'B2', 'B1', 'Ba3', 'Ba2', 'Ba1',
+                'Baa3', 'Baa2', 'Baa1', 'A3', 'A2', 'A1', 'Aa3', 'Aa2', 'Aa1', 'Aaa']
+SP_SCALE = ['D', 'C', 'CC', 'CCC-', 'CCC', 'CCC+', 'B-', 'B', 'B+', 'BB-', 'BB', 'BB+',
+            'BBB-', 'BBB', 'BBB+', 'A-', 'A', 'A+', 'AA-', 'AA', 'AA+', 'AAA']
+FITCH_SCALE = ['D', 'C', 'CC', 'CCC-', 'CCC', 'CCC+', 'B-', 'B', 'B+', 'BB-', 'BB', 'BB+',
+               'BBB-', 'BBB', 'BBB+', 'A-', 'A', 'A+', 'AA-', 'AA', 'AA+', 'AAA']
+
+_CUSIP_CHARS = np.array(list('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+
+
+class SyntheticAgencyData():
+
+    '''
+    Use this class to generate synthetic agency rating feeds and baml-like index constituents, so the project can
+    be run, tested and benchmarked without access to the data warehouse exports on Y:\\
+
+    the feeds have the same columns as the exports AgencyRatings.load_agency_data reads:
+    - moodys_issue_rating_history.csv: CUSIP and ISIN identifier rows, REG / MTN bond ratings plus bank credit
+      facility (BCF) and LGD rows that load_agency_data filters out
+    - s_p_issue_rating_history.csv: Cusip1 and ISIN identifier rows
+    - fitch_issue_rating_history.csv: Cusip1 and ISIN identifier rows, with issuer and seniority fields
+
+    every bond follows a random walk on the 22 notch composite scale. each agency rates it with its own notch offset
+    and acts at random times (about action_rate actions per bond per year, many of them affirmations), bonds can
+    default and ratings can be withdrawn
+    '''
+
+    def __init__(self, n_bonds = 10000, start_date = '2000-01-01', end_date = '2017-12-31', action_rate = 0.6,
+                 bonds_per_issuer = 8, seed = 0):
+        self.n_bonds = n_bonds
+        self.start_date = pd.Timestamp(start_date)
+        self.end_date = pd.Timestamp(end_date)
+        self.action_rate = action_rate
+        self.bonds_per_issuer = bonds_per_issuer
+        self.seed = seed
+
+        self.bonds = None
+        self.moodys = None
+        self.sp = None
+        self.fitch = None
+
+    def generate(self):
+        '''
+        generate the bonds and the three agency feeds, saved in self.bonds, self.moodys, self.sp, self.fitch
+        :return: None
+        '''
+
+        rng = np.random.default_rng(self.seed)
+        n = self.n_bonds
+        self.bonds = self._generate_bonds(rng, n)
+
+        self.moodys = self._generate_moodys(rng)
+        self.sp = self._generate_sp(rng)
+        self.fitch = self._generate_fitch(rng)
+
+    def _generate_bonds(self, rng, n):
+        '''
+        identifiers, issuers, issue / maturity dates and the starting credit quality of every bond
+        '''
+
+        issuer = np.arange(n) // self.bonds_per_issuer
+        issue = np.arange(n) % self.bonds_per_issuer
+
+        # 6 character issuer code + 2 character issue number + check digit
+        digits = np.zeros((n, 6), dtype = int)
+        rest = issuer.copy()
+        for j in range(5, -1, -1):
+            digits[:, j] = rest % 36
+            rest = rest // 36
+        issuer_code = np.array([''.join(row) for row in _CUSIP_CHARS[digits]]) if n > 0 else np.array([], dtype = str)
+        cusip8 = np.char.add(issuer_code, np.char.zfill(issue.astype(str), 2))
+        cusip9 = np.char.add(cusip8, Identifiers.cusip_check_digits(cusip8))
+        isin_body = np.char.add('US', cusip9)
+        isin = np.char.add(isin_body, Identifiers.isin_check_digits(isin_body))
+
+        days = (self.end_date - self.start_date).days
+        issue_date = self.start_date + pd.to_timedelta(rng.integers(-3650, days, n), unit = 'D')
+        maturity = issue_date + pd.to_timedelta(rng.integers(365 * 2, 365 * 30, n), unit = 'D')
+
+        # issuer credit quality, bonds of an issuer start close to each other
+        issuer_quality = rng.normal(12, 4, issuer.max() + 1 if n > 0 else 0)
+        quality = np.clip(np.round(issuer_quality[issuer] + rng.normal(0, 0.7, n)), 1, 21).astype(int)
+
+        return pd.DataFrame({'cusip': cusip8,
+                             'cusip9': cusip9,
+                             'isin': isin,
+                             'issuer': issuer,
+                             'ticker': np.char.add('T', issuer_code),
+                             'issue_date': issue_date,
+                             'maturity': maturity,
+                             'quality': quality,
+                             'seniority': rng.choice([0, 0, 0, 0, 1, 2], n)})
+
+    def _generate_actions(self, rng, offset_sd):
+        '''
+        rating actions of one agency: bond, date and numeric rating (NaN for a withdrawal)
+        '''
+
+        bonds = self.bonds
+        n = bonds.shape[0]
+
+        # not every agency rates every bond
+        first = bonds['issue_date'].clip(lower = self.start_date - pd.Timedelta(days = 3650)).to_numpy()
+        last = bonds['maturity'].clip(upper = self.end_date).to_numpy()
+        rated = (rng.random(n) < 0.85) & (last > first)
+        years = np.maximum((last - first) / np.timedelta64(365, 'D'), 0)
+        n_actions = np.where(rated, 1 + rng.poisson(self.action_rate * years), 0)
+
+        bond = np.repeat(np.arange(n), n_actions)
+        span = np.repeat((last - first) / np.timedelta64(1, 's'), n_actions)
+        date = np.repeat(first, n_actions) + (rng.random(len(bond)) * span).astype('timedelta64[s]')
+
+        # whole hour timestamps, sorted within each bond
+        date = date.astype('datetime64[h]')
+        order = np.lexsort((date, bond))
+        bond, date = bond[order], date[order]
+
+        # rating walk: about half the actions are affirmations, most changes are one or two notches
+        step = rng.choice([-3, -2, -1, 0, 0, 0, 0, 1, 2], len(bond))
+        start = np.ones(len(bond), dtype = bool)
+        start[1:] = bond[1:] != bond[:-1]
+        step[start] = 0
+        group_start = np.maximum.accumulate(np.where(start, np.arange(len(bond)), 0))
+        walk = np.cumsum(step)
+        walk -= walk[group_start]
+        offset = np.round(rng.normal(0, offset_sd, n)).astype(int)
+        rating = np.clip(bonds['quality'].to_numpy()[bond] + offset[bond] + walk, 0, 21).astype(float)
+
+        # defaults: a small chance per action for low rated bonds, no actions after a default
+        defaulted = (rating <= 5) & (rng.random(len(bond)) < 0.08)
+        rating[defaulted] = 0
+        seen_before = np.cumsum(defaulted) - defaulted
+        after = (seen_before - seen_before[group_start]) > 0
+
+        # some ratings get withdrawn at the end of their history
+        end = np.ones(len(bond), dtype = bool)
+        end[:-1] = bond[1:] != bond[:-1]
+        withdrawn = end & (rating > 0) & (rng.random(len(bond)) < 0.1)
+        rating[withdrawn] = np.NaN
+
+        keep = ~after
+        bond, date, rating, start = bond[keep], date[keep], rating[keep], start[keep]
+
+        # the feeds hold the dates as text
+        date = np.char.replace(np.datetime_as_string(date.astype('datetime64[s]')), 'T', ' ')
+        return bond, date, rating, start
+
+    def _symbols(self, rating, scale, withdrawn, default = None, rng = None):
+        '''
+        numeric ratings to agency symbols
+        '''
+        scale = np.array(scale, dtype = object)
+        symbols = scale[np.nan_to_num(rating, nan = 0).astype(int)]
+        symbols[np.isnan(rating)] = withdrawn
+        if default is not None:
+            mask = rating == 0
+            symbols[mask] = np.where(rng.random(mask.sum()) < 0.5, default, symbols[mask])
+        return symbols
+
+    def _id_rows(self, rng, bond, with_isin = 0.7):
+        '''
+        repeat every action for the identifier rows: the cusip, and the isin for bonds that have one
+        :return: row positions into the actions, whether the row is the isin row
+        '''
+        has_isin = rng.random(self.bonds.shape[0]) < with_isin
+        cusip_rows = np.arange(len(bond))
+        isin_rows = cusip_rows[has_isin[bond]]
+        rows = np.concatenate([cusip_rows, isin_rows])
+        is_isin = np.concatenate([np.zeros(len(cusip_rows), dtype = bool), np.ones(len(isin_rows), dtype = bool)])
+        order = np.argsort(rows, kind = 'mergesort')
+        return rows[order], is_isin[order]
+
+    def _generate_moodys(self, rng):
+        bond, date, rating, start = self._generate_actions(rng, 0.6)
+        symbols = self._symbols(rating, MOODYS_SCALE, 'WR')
+        rows, is_isin = self._id_rows(rng, bond)
+        b = bond[rows]
+        n = len(rows)
+
+        id_value = np.where(is_isin, self.bonds['isin'].to_numpy()[b], self.bonds['cusip9'].to_numpy()[b])
+        previous = np.concatenate([[np.NaN], rating[:-1]])
+        previous[start] = np.NaN
+        direction = np.select([rating > previous, rating < previous], ['UPG', 'DNG'], 'AFF')
+
+        df = pd.DataFrame({'instrument_id': 800000000 + b,
+                           'moodys_rating_id': 1 + rows,
+                           'security_class_short_description': rng.choice(['REG', 'REG', 'REG', 'MTN'], n),
+                           'id_type_text': np.where(is_isin, 'ISIN', 'CUSIP'),
+                           'instrument_id_value': id_value,
+                           'rating_date': date[rows],
+                           'rating_class_text': 'Senior Unsecured - Fgn Curr LT',
+                           'rating_direction_short_description': direction[rows],
+                           'rating_type_short_description': 'LT',
+                           'rating_currency_iso_code': 'USD',
+                           'rating_text': symbols[rows],
+                           'seniority_short_description': np.array(['Sr Unsec', 'Sr Sec', 'Sub'])[
+                               self.bonds['seniority'].to_numpy()[b]]})
+
+        # loss given default rows and bank credit facility ratings, which load_agency_data filters out
+        lgd = df.sample(frac = 0.08, random_state = self.seed)
+        lgd = lgd.assign(rating_class_text = 'LGD Rating', rating_text = 'LGD4 - 55%')
+        bcf = df.sample(frac = 0.03, random_state = self.seed + 1)
+        bcf = bcf.assign(security_class_short_description = 'BCF')
+        df = pd.concat([df, lgd, bcf], ignore_index = True)
+        df['moodys_rating_id'] = np.arange(df.shape[0]) + 1
+        return df
+
+    def _generate_sp(self, rng):
+        bond, date, rating, start = self._generate_actions(rng, 0.5)
+        symbols = self._symbols(rating, SP_SCALE, 'NR', default = 'SD', rng = rng)
+        rows, is_isin = self._id_rows(rng, bond)
+        b = bond[rows]
+
+        return pd.DataFrame({'security_id': 500000 + b,
+                             'security_symbol_value': np.char.add('SYM', b.astype(str)),
+                             'id_type': np.where(is_isin, 'ISIN', 'Cusip1'),
+                             'id_value': np.where(is_isin, self.bonds['isin'].to_numpy()[b],
+                                                  self.bonds['cusip9'].to_numpy()[b]),
+                             'rating_date': date[rows],
+                             'rating': symbols[rows]})
+
+    def _generate_fitch(self, rng):
+        bond, date, rating, start = self._generate_actions(rng, 0.5)
+        symbols = self._symbols(rating, FITCH_SCALE, 'WD', default = 'RD', rng = rng)
+        rows, is_isin = self._id_rows(rng, bond)
+        b = bond[rows]
+        issuer = self.bonds['issuer'].to_numpy()[b]
+
+        return pd.DataFrame({'agent_common_id': 100000 + issuer,
+                             'issuer_name': np.char.add('Issuer ', issuer.astype(str)),
+                             'fitch_issue_id_number': 90000000 + b,
+                             'id_type': np.where(is_isin, 'ISIN', 'Cusip1'),
+                             'id_value': np.where(is_isin, self.bonds['isin'].to_numpy()[b],
+                                                  self.bonds['cusip9'].to_numpy()[b]),
+                             'issue_description': np.char.add('Bond ', b.astype(str)),
+                             'long_term_issue_rating_effective_date': date[rows],
+                             'long_term_issue_rating': symbols[rows],
+                             'issue_debt_level_code': np.array(['SEN', 'SEC', 'SUB'])[
+                                 self.bonds['seniority'].to_numpy()[b]]})
+
+    def write_csvs(self, path):
+        '''
+        write the three feeds as csv files with the data warehouse export names, so that
+        AgencyRatings.load_agency_data(path = path) can load them
+        :param path: the directory to write to, as string
+        :return: None
+        '''
+        if self.moodys is None:
+            self.generate()
+        os.makedirs(path, exist_ok = True)
+        self.moodys.to_csv(os.path.join(path, 'moodys_issue_rating_history.csv'), index = False)
+        self.sp.to_csv(os.path.join(path, 's_p_issue_rating_history.csv'), index = False)
+        self.fitch.to_csv(os.path.join(path, 'fitch_issue_rating_history.csv'), index = False)
+
+    def baml_constituents(self, date, seed = None):
+        '''
+        a baml-like index constituent snapshot: the bonds outstanding on date with prices and spreads
+        :param date: the snapshot date, as datetime.date or 'YYYY-MM-DD'
+        :param seed: seed for the prices and spreads (default: derived from the date), as int
+        :return: one row per bond with the columns the study notebook uses, as dataframe
+        '''
+
+        if self.bonds is None:
+            self.generate()
+
+        date = pd.Timestamp(date)
+        rng = np.random.default_rng(seed if seed is not None else self.seed + date.toordinal())
+        bonds = self.bonds[(self.bonds['issue_date'] <= date) & (self.bonds['maturity'] > date)]
+        n = bonds.shape[0]
+
+        # spreads widen as credit quality falls
+        oas = np.exp(2.5 + (21 - bonds['quality'].to_numpy()) * 0.22 + rng.normal(0, 0.25, n))
+        industries = np.array(['Banking', 'Energy', 'Technology', 'Utility', 'Healthcare', 'Media'])
+        industry = industries[bonds['issuer'].to_numpy() % len(industries)]
+
+        return pd.DataFrame({'date': date,
+                             'cusip': bonds['cusip'].to_numpy(),
+                             'isin': bonds['isin'].to_numpy(),
+                             'ticker': bonds['ticker'].to_numpy(),
+                             'description': np.char.add(bonds['ticker'].to_numpy().astype(str), ' bond'),
+                             'ml_industry_lvl_3': industry,
+                             'ml_industry_lvl_4': np.char.add(industry.astype(str), ' sub'),
+                             'index_name': np.where(bonds['quality'].to_numpy() >= 12, 'C0A0', 'H0A0'),
+                             'price': np.round(100 + rng.normal(0, 6, n), 3),
+                             'face_value_loc': rng.choice([250, 500, 750, 1000, 1500], n) * 1e6,
+                             'accrued_interest': np.round(rng.random(n) * 3, 4),
+                             'oas': np.round(oas, 1),
+                             'prevmend_oas': np.round(oas * np.exp(rng.normal(0, 0.05, n)), 1)})
@@ -0,0 +1,269 @@
+import numpy as np
+import pandas as pd
+import RatingsTransitionMatrix
+
+
+class TransitionDiagnostics():
+    '''
+    Diagnostics of a stack of transition matrices (eg one per cohort, segment or rolling period), all k at once
+
+    The per-rating getters of RatingsTransitionMatrix (get_upgrade_prob, get_expctd_notch_chng, ...) work on one
+    matrix and one rating at a time. This class takes the k x n x n count arrays of k matrices over the same states
+    and computes the same numbers, plus mobility indices and distances between matrices, with batched numpy
+    operations:
+
+    - by_rating(): one row per matrix and start rating with persistence, upgrade / downgrade / default probabilities
+      and expected notch change
+    - summary(): one row per matrix with the number of cases, mobility indices and case-weighted rates
+    - distances(): the distance of each matrix to the one before it (or to a reference matrix)
+    - pairwise_distances(): k x k distances between all matrices
+
+    Both frames are tidy (one observation per row), so they can be plotted straight away, eg
+    summary().plot(x='label', y='shorrocks') to look for regime changes over hundreds of periods.
+
+    Ratings are the state codes of RatingsTransitionMatrix (0 = D ... 21 = AAA on the composite scale, see
+    RatingsTransitionMatrix.native for the agency scales). Start ratings without any cases have NaN probabilities;
+    for the singular value mobility index and the distances they are treated as absorbing (they stay where they
+    are), the eigenvalue mobility index leaves them out.
+    '''
+
+    def __init__(self, counts, labels=None, states=None, n_ratings=None, default_states=None):
+        '''
+        :param counts: transition counts, [matrix, start rating, end rating], as k x n x n array
+        :param labels: a label for each matrix, eg its period, as list (default: 0 .. k - 1)
+        :param states: the states of the matrices, see RatingsTransitionMatrix, as list of strings (default: the 22
+                       ratings of the composite scale)
+        :param n_ratings: the number of states that are ratings, as int (default: all of them)
+        :param default_states: the states that count as default, as list of strings (default: the worst rating)
+        '''
+        counts = np.asarray(counts)
+        if counts.ndim == 2:
+            counts = counts[None, :, :]
+        scale = RatingsTransitionMatrix.RatingsTransitionMatrix(states=states, n_ratings=n_ratings,
+                                                                default_states=default_states)
+        n = scale.n_states
+        assert counts.ndim == 3 and counts.shape[1:] == (n, n), \
+            'error: counts must be a k x {} x {} array, one row and column per state'.format(n, n)
+        assert labels is None or len(labels) == counts.shape[0], 'error: need one label per matrix'
+
+        self.counts = counts.astype(float)
+        self.labels = list(range(counts.shape[0])) if labels is None else list(labels)
+        self.states = scale.states
+        self.n_states = n
+        self.n_ratings = scale.n_ratings
+        self.default_states = scale.default_states
+        self.default_codes = scale.default_codes
+        self.ratings_map_inverse = scale.ratings_map_inverse
+
+        # cases per start rating and transition probabilities, rows without cases are NaN
+        self.start_counts = self.counts.sum(axis=2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.probabilities = self.counts / self.start_counts[:, :, None]
+
+    @classmethod
+    def from_matrices(cls, matrices, labels=None):
+        '''
+        :param matrices: the matrices, all over the same states, as list of RatingsTransitionMatrix
+        :param labels: a label for each matrix, as list
+        :return: TransitionDiagnostics
+        '''
+        if len(matrices) == 0:
+            return cls(np.zeros((0,) + RatingsTransitionMatrix.RatingsTransitionMatrix().counts.shape), labels=labels)
+        return cls(np.stack([m.counts for m in matrices]), labels=labels, **cls._scale(matrices[0]))
+
+    @staticmethod
+    def _scale(rtm):
+        '''
+        the state space of a RatingsTransitionMatrix, as keyword arguments
+        '''
+        return {'states': rtm.states, 'n_ratings': rtm.n_ratings, 'default_states': rtm.default_states}
+
+    @classmethod
+    def from_bundle(cls, bundle):
+        '''
+        :param bundle: the matrices, labelled by their names in the bundle, as TransitionMatrixBundle
+        :return: TransitionDiagnostics
+        '''
+        if len(bundle) == 0:
+            return cls(np.zeros((0,) + RatingsTransitionMatrix.RatingsTransitionMatrix().counts.shape))
+        return cls(bundle.stack('count'), labels=bundle.names, **cls._scale(bundle[bundle.names[0]]))
+
+    def _filled(self):
+        '''
+        the probabilities with the rows without cases replaced by identity rows
+        '''
+        empty = self.start_counts == 0
+        return np.where(empty[:, :, None], np.eye(self.n_states)[None, :, :], self.probabilities)
+
+    def persistence(self):
+        '''
+        probability of keeping the start rating, [matrix, start rating]
+        :return: k x n array
+        '''
+        return np.diagonal(self.probabilities, axis1=1, axis2=2).copy()
+
+    def upgrade_probabilities(self):
+        '''
+        :return: k x n array of the probabilities of ending in a better rating (states that aren't ratings, eg WR,
+                 are neither upgrades nor downgrades)
+        '''
+        upper = np.triu(np.ones((self.n_states, self.n_states)), k=1)
+        upper[:, self.n_ratings:] = 0
+        return (self.probabilities * upper[None, :, :]).sum(axis=2)
+
+    def downgrade_probabilities(self):
+        '''
+        :return: k x n array of the probabilities of ending in a worse rating
+        '''
+        lower = np.tril(np.ones((self.n_states, self.n_states)), k=-1)
+        lower[:, self.n_ratings:] = 0
+        return (self.probabilities * lower[None, :, :]).sum(axis=2)
+
+    def default_rates(self):
+        '''
+        :return: k x n array of the probabilities of ending in a default state (D on the composite scale)
+        '''
+        return self.probabilities[:, :, self.default_codes].sum(axis=2)
+
+    def expected_notch_changes(self):
+        '''
+        expected change in notches (end rating - start rating) per start rating, as get_expctd_notch_chng
+        (states that aren't ratings count as no change)
+        :return: k x n array
+        '''
+        notches = np.arange(self.n_states)[None, :] - np.arange(self.n_states)[:, None]
+        notches[:, self.n_ratings:] = 0
+        return np.einsum('kij,ij->ki', self.probabilities, notches)
+
+    def mobility(self):
+        '''
+        mobility indices of every matrix, 0 for a matrix where nothing moves
+        shorrocks: (n - trace(P)) / (n - 1) over the n start ratings with cases
+        eigenvalue: 1 - the modulus of the second largest eigenvalue of P over the start ratings with cases and the
+                    default states, merged into one (absorbing if it has no cases). the other start ratings without
+                    cases are left out: as identity rows each of them would add an eigenvalue of 1 and the index
+                    would be 0
+        svd: the average singular value of P - I (Jafry and Schuermann), start ratings without cases stay put
+        :return: shorrocks, eigenvalue and svd indices, as dictionary of length k arrays
+        '''
+        k = self.counts.shape[0]
+        rated = self.start_counts > 0
+        n = rated.sum(axis=1)
+        trace = np.where(rated, self.persistence(), 0.0).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            shorrocks = np.where(n > 1, (n - trace) / (n - 1), np.NaN)
+
+        filled = self._filled()
+        if k > 0:
+            # the default states are merged into one absorbing state (several would each add an eigenvalue of 1)
+            merge = np.eye(self.n_states)
+            merge[self.default_codes, :] = 0
+            merge[self.default_codes, self.default_codes[0]] = 1
+            merged = np.einsum('ia,kij,jb->kab', merge, self.counts, merge)
+            merged_start = merged.sum(axis=2)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                merged = merged / merged_start[:, :, None]
+            default = self.default_codes[0]
+            merged[:, default, :] = np.where(merged_start[:, default, None] > 0, merged[:, default, :],
+                                             np.eye(self.n_states)[default][None, :])
+
+            # zeroing the rows and columns of the left out states leaves the eigenvalues of the submatrix of the
+            # kept states plus zeros, so all matrices still go through one batched call
+            kept = merged_start > 0
+            kept[:, default] = True
+            submatrix = np.where(kept[:, :, None] & kept[:, None, :], merged, 0.0)
+            moduli = np.sort(np.abs(np.linalg.eigvals(submatrix)), axis=1)
+            eigenvalue = np.where(kept.sum(axis=1) > 1, 1 - moduli[:, -2], np.NaN)
+            svd = np.linalg.svd(filled - np.eye(self.n_states)[None, :, :], compute_uv=False).mean(axis=1)
+        else:
+            eigenvalue = np.zeros(0)
+            svd = np.zeros(0)
+        return {'shorrocks': shorrocks, 'eigenvalue': eigenvalue, 'svd': svd}
+
+    def by_rating(self):
+        '''
+        the per start rating diagnostics of every matrix, start ratings without cases are left out
+        :return: label, start_rating, start_rating_num, count, persistence, upgrade, downgrade, default and
+                 expected_notch_change columns, one row per matrix and start rating, as dataframe
+        '''
+        labels = np.empty(len(self.labels), dtype=object)
+        labels[:] = self.labels
+        matrix, rating = np.nonzero(self.start_counts > 0)
+        return pd.DataFrame({'label': labels[matrix],
+                             'start_rating': [self.ratings_map_inverse[r] for r in rating],
+                             'start_rating_num': rating,
+                             'count': self.start_counts[matrix, rating],
+                             'persistence': self.persistence()[matrix, rating],
+                             'upgrade': self.upgrade_probabilities()[matrix, rating],
+                             'downgrade': self.downgrade_probabilities()[matrix, rating],
+                             'default': self.default_rates()[matrix, rating],
+                             'expected_notch_change': self.expected_notch_changes()[matrix, rating]})
+
+    def summary(self):
+        '''
+        one row of diagnostics per matrix: the mobility indices and the rates over all cases
+        (ie the per start rating numbers weighted by the number of cases)
+        :return: label, cases, shorrocks, eigenvalue, svd, persistence, upgrade, downgrade, default and
+                 expected_notch_change columns, as dataframe
+        '''
+        cases = self.start_counts.sum(axis=1)
+        df = pd.DataFrame({'label': self.labels, 'cases': cases})
+        for name, values in self.mobility().items():
+            df[name] = values
+
+        rated = self.start_counts > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for name, values in [('persistence', self.persistence()),
+                                 ('upgrade', self.upgrade_probabilities()),
+                                 ('downgrade', self.downgrade_probabilities()),
+                                 ('default', self.default_rates()),
+                                 ('expected_notch_change', self.expected_notch_changes())]:
+                df[name] = np.where(rated, values * self.start_counts, 0.0).sum(axis=1) / cases
+        return df
+
+    def _distance(self, a, b, metric):
+        '''
+        distances between the matrices of a and b (filled probabilities), elementwise over the leading axes
+        '''
+        diff = a - b
+        if metric == 'l1':
+            # average over the start ratings of the total absolute difference in each row
+            return np.abs(diff).sum(axis=-1).mean(axis=-1)
+        if metric == 'frobenius':
+            return np.sqrt((diff ** 2).sum(axis=(-2, -1)))
+        if metric == 'svd':
+            # Jafry and Schuermann: the average singular value of the difference
+            shape = diff.shape
+            values = np.linalg.svd(diff.reshape((-1,) + shape[-2:]), compute_uv=False).mean(axis=-1)
+            return values.reshape(shape[:-2])
+        raise ValueError('error: metric must be l1, frobenius or svd')
+
+    def distances(self, reference=None, metric='l1'):
+        '''
+        distance of every matrix to the matrix before it, or to a reference matrix
+        start ratings without cases count as staying put (see the class docstring)
+        :param reference: compare to this matrix instead of the previous one, as RatingsTransitionMatrix or n x n
+                          array of counts over the same states
+        :param metric: 'l1' (mean absolute row difference), 'frobenius' or 'svd'
+        :return: label, previous (None with a reference) and distance columns, as dataframe
+        '''
+        filled = self._filled()
+        if reference is None:
+            distance = self._distance(filled[1:], filled[:-1], metric) if filled.shape[0] > 1 else np.zeros(0)
+            return pd.DataFrame({'label': self.labels[1:], 'previous': self.labels[:-1], 'distance': distance})
+
+        counts = reference.counts if isinstance(reference, RatingsTransitionMatrix.RatingsTransitionMatrix) \
+            else np.asarray(reference)
+        reference = TransitionDiagnostics(counts, states=self.states, n_ratings=self.n_ratings,
+                                          default_states=self.default_states)._filled()
+        distance = self._distance(filled, reference, metric)
+        return pd.DataFrame({'label': self.labels, 'previous': None, 'distance': distance})
+
+    def pairwise_distances(self, metric='l1'):
+        '''
+        :param metric: see distances
+        :return: k x k distances, indexed by label, as dataframe
+        '''
+        filled = self._filled()
+        distance = self._distance(filled[:, None, :, :], filled[None, :, :, :], metric)
+        return pd.DataFrame(distance, index=self.labels, columns=self.labels)
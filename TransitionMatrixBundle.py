@@ -0,0 +1,143 @@
+import json
+import numpy as np
+import RatingsTransitionMatrix
+
+
+# the on-disk format of save / load
+BUNDLE_VERSION = 1
+
+
+class TransitionMatrixBundle():
+    '''
+    Many transition matrices (eg one per cohort or segment of a run) with their metadata in one binary file
+
+    The accumulators of all matrices are stacked into k x 22 x 22 arrays and saved with numpy's npz format together
+    with a json header (names, period, universe, filters, case counts, ...), so a bundle reloads without parsing any
+    csv and every matrix comes back as a full RatingsTransitionMatrix. Matrices over other state spaces (eg the
+    native agency scales) are stacked per state space:
+
+        bundle = TransitionMatrixBundle()
+        bundle.add('IG 2017', rtm, period='2017', universe='C0A0', filters={'require_two_agencies': True})
+        bundle.save('rtm_2017.npz')
+        rtm = TransitionMatrixBundle.load('rtm_2017.npz')['IG 2017']
+    '''
+
+    def __init__(self):
+        # name -> RatingsTransitionMatrix, in the order they were added
+        self.matrices = {}
+
+        # name -> metadata dictionary (json serializable)
+        self.metadata = {}
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def __contains__(self, name):
+        return name in self.matrices
+
+    def __getitem__(self, name):
+        return self.matrices[name]
+
+    @property
+    def names(self):
+        return list(self.matrices.keys())
+
+    def add(self, name, rtm, period=None, universe=None, filters=None, **metadata):
+        '''
+        add a matrix to the bundle, the case counts are added to its metadata
+        :param name: a unique name for the matrix, as string
+        :param rtm: the matrix, as RatingsTransitionMatrix
+        :param period: the period of the cohort, eg '2017-01-03 - 2017-12-31', as string
+        :param universe: the universe of the cohort, eg 'C0A0 + H0A0', as string
+        :param filters: the filters applied to the cohort, as dictionary
+        :param metadata: anything else to keep with the matrix (json serializable)
+        :return: None
+        '''
+        assert name not in self.matrices, 'error: there already is a matrix called {} in the bundle'.format(name)
+        meta = {'period': period, 'universe': universe, 'filters': filters if filters is not None else {}}
+        meta.update(metadata)
+        meta['cases'] = int(rtm.counts.sum())
+        meta['start_counts'] = {rtm.ratings_map_inverse[i]: int(c)
+                                for i, c in enumerate(rtm.counts.sum(axis=1)) if c != 0}
+        self.matrices[name] = rtm
+        self.metadata[name] = meta
+
+    def stack(self, kind='count'):
+        '''
+        one matrix kind of all matrices in the bundle as one array, see RatingsTransitionMatrix.get_matrix_array
+        the matrices must all be over the same states
+        :param kind: 'probability', 'count', 'market_value' or 'oas_change'
+        :return: k x n x n array (n = 22 on the composite scale), in the order of self.names
+        '''
+        if len(self.matrices) == 0:
+            return np.zeros((0, 22, 22))
+        assert len(set(tuple(rtm.states) for rtm in self.matrices.values())) == 1, \
+            'error: the matrices in the bundle are over different states'
+        return np.stack([rtm.get_matrix_array(kind) for rtm in self.matrices.values()])
+
+    def export(self, kinds=None):
+        '''
+        the frames of every matrix in the bundle, see RatingsTransitionMatrix.export
+        :return: name -> (kind -> dataframe), as dictionary
+        '''
+        return {name: rtm.export(kinds=kinds) for name, rtm in self.matrices.items()}
+
+    def save(self, path, compressed=True):
+        '''
+        write the bundle to one npz file
+        :param path: the file name, as string
+        :param compressed: zip-compress the arrays, as boolean
+        :return: None
+        '''
+        names = self.names
+        rtms = [self.matrices[n] for n in names]
+
+        # one stack of accumulators per state space
+        scales = []
+        scale_of = []
+        for rtm in rtms:
+            scale = {'states': rtm.states, 'n_ratings': rtm.n_ratings, 'default_states': rtm.default_states}
+            if scale not in scales:
+                scales.append(scale)
+            scale_of.append(scales.index(scale))
+
+        header = {'version': BUNDLE_VERSION, 'names': names, 'metadata': [self.metadata[n] for n in names],
+                  'scales': scales, 'scale_of': scale_of}
+        arrays = {'header': np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8)}
+        for s in range(len(scales)):
+            members = [rtm for rtm, of in zip(rtms, scale_of) if of == s]
+            arrays['counts_{}'.format(s)] = np.stack([r.counts for r in members])
+            arrays['mkt_val_{}'.format(s)] = np.stack([r.mkt_val for r in members])
+            arrays['wghtd_oas_change_{}'.format(s)] = np.stack([r.wghtd_oas_change for r in members])
+
+        with open(path, 'wb') as f:
+            if compressed:
+                np.savez_compressed(f, **arrays)
+            else:
+                np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        read a bundle written by save
+        :param path: the file name, as string
+        :return: TransitionMatrixBundle
+        '''
+        with np.load(path, allow_pickle=False) as npz:
+            header = json.loads(npz['header'].tobytes().decode('utf-8'))
+            assert header['version'] == BUNDLE_VERSION, 'error: {} is not a bundle written by save'.format(path)
+            arrays = {key: npz[key] for key in npz.files if key != 'header'}
+
+        bundle = cls()
+        position = [0] * len(header['scales'])
+        for i, name in enumerate(header['names']):
+            s = header['scale_of'][i]
+            j = position[s]
+            position[s] += 1
+            rtm = RatingsTransitionMatrix.RatingsTransitionMatrix(**header['scales'][s])
+            rtm.counts = arrays['counts_{}'.format(s)][j].astype(np.int64)
+            rtm.mkt_val = arrays['mkt_val_{}'.format(s)][j].astype(float)
+            rtm.wghtd_oas_change = arrays['wghtd_oas_change_{}'.format(s)][j].astype(float)
+            bundle.matrices[name] = rtm
+            bundle.metadata[name] = header['metadata'][i]
+        return bundle
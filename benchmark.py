@@ -0,0 +1,139 @@
+'''
+Benchmark suite for AgencyRatings and RatingsTransitionMatrix on synthetic agency feeds.
+
+For every scale (number of bonds) it generates feeds and baml-like constituents with SyntheticAgencyData, writes
+the csv exports, and times the main steps of the transition matrix study:
+load_agency_data, a point-in-time lookup, get_average_ratings, get_time_series_by_id, load_rtm and
+load_oas_change_matrix. Each step records wall time, rows in / out and resident memory (see Instrumentation).
+
+The results are written to a JSON file so releases can be compared:
+
+    python benchmark.py --scales 10000 100000 1000000 --output benchmark_results.json
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import AgencyRatings
+import Instrumentation
+import RatingsTransitionMatrix
+import SyntheticAgencyData
+
+
+def run_benchmark(n_bonds, work_dir, ts_days = 30, seed = 0, verbose = False):
+    '''
+    run the benchmark steps at one scale
+    :param n_bonds: number of bonds in the synthetic universe, as int
+    :param work_dir: directory for the generated csv files, as string
+    :param ts_days: number of days in the get_time_series_by_id window, as int
+    :param seed: random seed for the synthetic data, as int
+    :return: one record per step, as list of dictionaries
+    '''
+
+    inst = Instrumentation.Instrumentation()
+    start_date = datetime.date(2016, 12, 31)
+    end_date = datetime.date(2017, 12, 31)
+
+    with inst.stage('generate feeds') as record:
+        generator = SyntheticAgencyData.SyntheticAgencyData(n_bonds = n_bonds, seed = seed)
+        generator.generate()
+        record['rows_out'] = generator.moodys.shape[0] + generator.sp.shape[0] + generator.fitch.shape[0]
+
+    with inst.stage('write csv'):
+        generator.write_csvs(work_dir)
+
+    baml_start = generator.baml_constituents('2017-01-03')
+    baml_end = generator.baml_constituents('2017-12-31')
+
+    ar = AgencyRatings.AgencyRatings()
+    with inst.stage('load_agency_data') as record:
+        ar.load_agency_data(path = work_dir)
+        record['rows_out'] = ar.moodys.shape[0] + ar.sp.shape[0] + ar.fitch.shape[0]
+
+    with inst.stage('point-in-time lookup', rows_in = baml_start.shape[0]) as record:
+        baml = ar.get_agency_ratings_by_id(data = baml_start, id_col = 'cusip', date = start_date)
+        record['rows_out'] = baml.shape[0]
+
+    with inst.stage('get_average_ratings', rows_in = baml.shape[0]) as record:
+        baml = ar.get_average_ratings(data = baml, require_two_agencies = False)
+        record['rows_out'] = baml.shape[0]
+
+    ts_end = start_date + datetime.timedelta(days = ts_days - 1)
+    with inst.stage('get_time_series_by_id', rows_in = baml_start.shape[0]) as record:
+        ts = ar.get_time_series_by_id(baml_start, 'cusip', str(start_date), str(ts_end))
+        record['rows_out'] = ts.shape[0]
+    del ts
+
+    # the cohort frame of the study notebook: start and end composite ratings and spreads
+    baml['mkt_val'] = (baml['price'] / 100) * baml['face_value_loc']
+    baml['mkt_val'] += (baml['face_value_loc'] / 100) * baml['accrued_interest']
+    cohort = baml[['cusip', 'ticker', 'average_rating', 'prevmend_oas', 'mkt_val']]
+    cohort = cohort.rename(columns = {'average_rating': 'average_rating_0', 'prevmend_oas': 'oas_0'})
+    end = baml_start[['cusip']].merge(baml_end[['cusip', 'oas']], how = 'left', on = 'cusip')
+    end = ar.get_average_ratings(ar.get_agency_ratings_by_id(end, 'cusip', end_date), require_two_agencies = False)
+    end = end[['cusip', 'average_rating', 'oas']].rename(columns = {'average_rating': 'average_rating_1',
+                                                                   'oas': 'oas_1'})
+    cohort = cohort.merge(end, how = 'left', on = 'cusip')
+    cohort['oas_change'] = cohort['oas_1'] - cohort['oas_0']
+
+    rtm = RatingsTransitionMatrix.RatingsTransitionMatrix()
+    with inst.stage('load_rtm', rows_in = cohort.shape[0]):
+        rtm.load_rtm(cohort)
+
+    with inst.stage('load_oas_change_matrix', rows_in = cohort.shape[0]):
+        rtm.load_oas_change_matrix(cohort)
+
+    records = []
+    for r in inst.records:
+        r = dict(r)
+        r['n_bonds'] = n_bonds
+        records.append(r)
+        if verbose:
+            print('{:>9} bonds  {:<24} {:10.3f}s  rows {} -> {}'.format(n_bonds, r['stage'], r['seconds'],
+                                                                        r['rows_in'], r['rows_out']))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'benchmark the ratings transition matrix pipeline')
+    parser.add_argument('--scales', type = int, nargs = '+', default = [10000, 100000, 1000000],
+                        help = 'numbers of bonds to benchmark')
+    parser.add_argument('--ts-days', type = int, default = 30, help = 'days in the time series window')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', default = 'benchmark_results.json', help = 'file to write the results to')
+    parser.add_argument('--work-dir', default = None, help = 'where to write the synthetic csv files')
+    args = parser.parse_args()
+
+    results = []
+    for n_bonds in args.scales:
+        work_dir = args.work_dir or tempfile.mkdtemp(prefix = 'rtm_benchmark_')
+        try:
+            results.extend(run_benchmark(n_bonds, os.path.join(work_dir, str(n_bonds)), ts_days = args.ts_days,
+                                         seed = args.seed, verbose = True))
+        finally:
+            if args.work_dir is None:
+                shutil.rmtree(work_dir, ignore_errors = True)
+
+    output = {'created': datetime.datetime.now().isoformat(),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'numpy': np.__version__,
+              'machine': platform.platform(),
+              'cpus': os.cpu_count(),
+              'ts_days': args.ts_days,
+              'seed': args.seed,
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent = 1)
+    print('results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+'''
+Shared fixtures: a small synthetic data set (see SyntheticAgencyData), loaded into AgencyRatings, and yearly cohorts
+of the study built from it with StudyPipeline.
+'''
+import datetime
+import os
+import sys
+
+import pytest
+
+# the modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AgencyRatings
+import StudyPipeline
+import SyntheticAgencyData
+
+
+class SyntheticConstituentSource():
+    '''
+    constituent snapshots straight from the synthetic data, see StudyPipeline.FileConstituentSource
+    '''
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def fetch(self, date):
+        return self.generator.baml_constituents(str(date))
+
+
+@pytest.fixture(scope='session')
+def synthetic():
+    generator = SyntheticAgencyData.SyntheticAgencyData(n_bonds=400, seed=0)
+    generator.generate()
+    return generator
+
+
+@pytest.fixture(scope='session')
+def ratings(synthetic, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('feeds'))
+    synthetic.write_csvs(path)
+    ratings = AgencyRatings.AgencyRatings(data_path=path)
+    ratings.load_agency_data()
+    return ratings
+
+
+@pytest.fixture(scope='session')
+def cohorts(synthetic, ratings):
+    '''
+    year -> the cohort of the bonds outstanding at the start of the year, rated at the start and the end of the year
+    '''
+    source = SyntheticConstituentSource(synthetic)
+    cohorts = {}
+    for year in [2014, 2015, 2016, 2017]:
+        start = datetime.date(year - 1, 12, 31)
+        end = datetime.date(year, 12, 31)
+        pipeline = StudyPipeline.StudyPipeline(ratings, source, start, end, require_two_agencies=False)
+        cohorts[year] = pipeline.build_cohort()
+    return cohorts
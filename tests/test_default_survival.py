@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from DefaultSurvival import DefaultSurvival
+
+
+def test_kaplan_meier_by_hand():
+    # day 1: 1 of 4 defaults, day 2: 1 of 3 defaults and 1 is censored, day 3: the last one is censored
+    survival = DefaultSurvival(days=[1, 2, 2, 3], defaulted=[True, True, False, False])
+    table = survival.table
+    assert table['at_risk'].tolist() == [4, 3, 1]
+    assert table['defaults'].tolist() == [1, 1, 0]
+    assert table['censored'].tolist() == [0, 1, 1]
+    assert table['survival'].to_numpy() == pytest.approx([0.75, 0.5, 0.5])
+
+    curve = survival.curves(days=[0, 1, 2, 10])['all']
+    assert curve.to_numpy() == pytest.approx([0.0, 0.25, 0.5, 0.5])
+
+
+def test_groups_are_estimated_separately():
+    survival = DefaultSurvival(days=[5, 5, 3, 7], defaulted=[True, True, False, True], groups=['a', 'a', 'b', 'b'])
+    curves = survival.curves(days=[4, 5, 7])
+    # everyone in group a defaults on day 5
+    assert curves['a'].to_numpy() == pytest.approx([0.0, 1.0, 1.0])
+    # group b: one censored on day 3, the other defaults on day 7
+    assert curves['b'].to_numpy() == pytest.approx([0.0, 0.0, 1.0])
+    assert survival.sizes == {'a': 2, 'b': 2}
+
+
+def test_from_spells(ratings):
+    spells = ratings.get_default_spells()
+    survival = DefaultSurvival.from_spells(spells)
+
+    summary = survival.summary(days=[365, 1825])
+    assert summary['spells'].sum() == spells.shape[0]
+    assert summary['defaults'].sum() == spells['defaulted'].sum()
+    assert summary['defaults'].sum() + summary['censored'].sum() == spells.shape[0]
+
+    # groups come best rating first, the curves are cumulative probabilities
+    numeric = spells.drop_duplicates('initial_rating').set_index('initial_rating')['initial_rating_num']
+    assert (np.diff(numeric[survival.groups].to_numpy()) < 0).all()
+    curves = survival.curves(days=np.arange(0, 3650, 30)).to_numpy()
+    assert ((curves >= 0) & (curves <= 1)).all()
+    assert (np.diff(curves, axis=0) >= 0).all()
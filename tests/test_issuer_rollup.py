@@ -0,0 +1,39 @@
+import pandas as pd
+
+import IssuerRollup
+import RatingsTransitionMatrix
+
+
+def test_most_common():
+    data = pd.DataFrame({'ticker': ['A', 'A', 'A', 'B', 'B', 'C'],
+                         'average_rating': ['AA1', 'AA1', 'BBB2', 'BB1', 'BBB3', 'NR']})
+    df = IssuerRollup.issuer_ratings(data, 'ticker', 'average_rating')
+    assert df['ticker'].tolist() == ['A', 'B', 'C']
+    # a tie goes to the lower rating, an issuer without rated bonds is NR
+    assert df['average_rating'].tolist() == ['AA1', 'BB1', 'NR']
+    assert df['bond_count'].tolist() == [3, 2, 1]
+
+
+def test_senior_unsecured_and_dates():
+    data = pd.DataFrame({'ticker': ['A', 'A', 'A', 'B', 'B', 'A'],
+                         'date': ['d1', 'd1', 'd1', 'd1', 'd1', 'd2'],
+                         'rating': ['BB1', 'BB1', 'A2', 'B1', 'B1', 'CCC1'],
+                         'seniority': ['SUB', 'SUB', 'SEN', 'SUB', 'SUB', 'SEC']})
+    df = IssuerRollup.issuer_ratings(data, 'ticker', 'rating', date_col='date', rule='senior_unsecured',
+                                     seniority_col='seniority')
+    # issuers without a rated senior unsecured bond fall back on all their bonds
+    assert list(zip(df['ticker'], df['date'], df['rating'])) == [('A', 'd1', 'A2'), ('A', 'd2', 'CCC1'),
+                                                                 ('B', 'd1', 'B1')]
+
+
+def test_issuer_rtm(cohorts):
+    cohort = cohorts[2017]
+    rtm = RatingsTransitionMatrix.RatingsTransitionMatrix()
+    issuers = rtm.load_issuer_rtm(cohort, issuer_col='ticker')
+    assert issuers.shape[0] == cohort['ticker'].nunique()
+    assert issuers['bond_count'].sum() == cohort.shape[0]
+
+    start = IssuerRollup.rating_codes(issuers['average_rating_0'])
+    end = IssuerRollup.rating_codes(issuers['average_rating_1'])
+    assert rtm.counts.sum() == ((start >= 0) & (end >= 0)).sum()
+    assert rtm.mkt_val.sum() <= cohort['mkt_val'].sum()
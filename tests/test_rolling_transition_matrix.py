@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import RatingsTransitionMatrix
+from RollingTransitionMatrix import RollingTransitionMatrix
+
+
+def _matrix(*frames):
+    rtm = RatingsTransitionMatrix.RatingsTransitionMatrix()
+    for df in frames:
+        rtm.load_rtm(df)
+        rtm.load_oas_change_matrix(df)
+    return rtm
+
+
+def test_window_matches_a_rebuilt_matrix(cohorts):
+    rolling = RollingTransitionMatrix(window=2)
+    evicted = [rolling.add_period(year, cohort) for year, cohort in cohorts.items()]
+    assert evicted == [[], [], [2014], [2015]]
+    assert list(rolling.periods.keys()) == [2016, 2017]
+
+    expected = _matrix(cohorts[2016], cohorts[2017])
+    assert (rolling.matrix.counts == expected.counts).all()
+    assert rolling.matrix.mkt_val == pytest.approx(expected.mkt_val)
+    assert rolling.matrix.wghtd_oas_change == pytest.approx(expected.wghtd_oas_change)
+    np.testing.assert_allclose(rolling.matrix.get_probability_matrix(), expected.get_probability_matrix())
+
+
+def test_remove_period_and_rebuild(cohorts):
+    rolling = RollingTransitionMatrix(window=None)
+    for year, cohort in cohorts.items():
+        rolling.add_period(year, cohort)
+    rolling.remove_period(2015)
+
+    expected = _matrix(cohorts[2014], cohorts[2016], cohorts[2017])
+    assert (rolling.matrix.counts == expected.counts).all()
+    rolling.rebuild()
+    assert (rolling.matrix.counts == expected.counts).all()
+    assert rolling.matrix.wghtd_oas_change == pytest.approx(expected.wghtd_oas_change)
+
+    with pytest.raises(AssertionError):
+        rolling.add_period(2016, cohorts[2016])
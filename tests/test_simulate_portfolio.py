@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import RatingsTransitionMatrix
+
+
+def _matrix(start, end):
+    rtm = RatingsTransitionMatrix.RatingsTransitionMatrix()
+    rtm.load_codes([rtm.ratings_map[r] for r in start], [rtm.ratings_map[r] for r in end])
+    return rtm
+
+
+def test_certain_migrations():
+    # every AA1 bond defaults, every BBB2 bond stays, B1 has no cases so it keeps its rating
+    rtm = _matrix(['AA1', 'BBB2'], ['D', 'BBB2'])
+    result = rtm.simulate_portfolio(['AA1', 'BBB2', 'B1', 'NR'], market_values=[10.0, 20.0, 30.0, 40.0], n_paths=50,
+                                    n_periods=2, recovery_rate=0.25, seed=1)
+    assert result['excluded'] == 1
+    assert (result['defaults'] == 1).all()
+    assert result['losses'] == pytest.approx(np.full(50, 7.5))
+    assert result['cumulative_default_rate'] == pytest.approx([1 / 3, 1 / 3])
+
+    ending = result['ending_counts']
+    for rating, count in [('D', 1), ('BBB2', 1), ('B1', 1), ('AA1', 0)]:
+        assert (ending[:, rtm.ratings_map[rating]] == count).all()
+    mix = result['ending_mix'].set_index('rating')
+    assert mix.loc['B1', 'market_value_share'] == pytest.approx(0.5)
+
+
+def test_reproducible_and_consistent(cohorts):
+    rtm = RatingsTransitionMatrix.RatingsTransitionMatrix()
+    rtm.load_rtm(cohorts[2016])
+    portfolio = cohorts[2017]
+
+    kwargs = dict(market_values=portfolio['mkt_val'], n_paths=200, n_periods=3, seed=7, chunk_size=5000)
+    first = rtm.simulate_portfolio(portfolio['average_rating_0'], **kwargs)
+    second = rtm.simulate_portfolio(portfolio['average_rating_0'], **kwargs)
+    np.testing.assert_array_equal(first['ending_counts'], second['ending_counts'])
+    np.testing.assert_array_equal(first['losses'], second['losses'])
+
+    simulated = portfolio.shape[0] - first['excluded']
+    assert first['excluded'] == (portfolio['average_rating_0'] == 'NR').sum()
+    assert (first['ending_counts'].sum(axis=1) == simulated).all()
+    assert (first['ending_counts'][:, 0] == first['defaults']).all()
+    # defaults are absorbing, so the default rate can only go up
+    assert (np.diff(first['cumulative_default_rate']) >= 0).all()
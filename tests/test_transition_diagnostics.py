@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import RatingsTransitionMatrix
+from TransitionDiagnostics import TransitionDiagnostics
+
+
+def test_no_migration():
+    counts = np.diag(np.arange(1, 23))[None, :, :]
+    diagnostics = TransitionDiagnostics(counts, labels=['static'])
+    assert diagnostics.persistence()[0] == pytest.approx(np.ones(22))
+    assert diagnostics.upgrade_probabilities()[0] == pytest.approx(np.zeros(22))
+    assert diagnostics.default_rates()[0, 1:] == pytest.approx(np.zeros(21))
+
+    mobility = diagnostics.mobility()
+    assert mobility['shorrocks'] == pytest.approx([0.0])
+    assert mobility['svd'] == pytest.approx([0.0])
+
+
+def test_by_rating_matches_the_matrices(cohorts):
+    matrices = []
+    for cohort in cohorts.values():
+        rtm = RatingsTransitionMatrix.RatingsTransitionMatrix()
+        rtm.load_rtm(cohort)
+        matrices.append(rtm)
+    diagnostics = TransitionDiagnostics.from_matrices(matrices, labels=list(cohorts.keys()))
+
+    by_rating = diagnostics.by_rating()
+    for label, rtm in zip(cohorts.keys(), matrices):
+        rows = by_rating[by_rating['label'] == label]
+        assert rows['count'].sum() == rtm.counts.sum()
+        for _, row in rows.iterrows():
+            assert row['default'] == pytest.approx(rtm.get_default_prob(row['start_rating']))
+            assert row['upgrade'] == pytest.approx(rtm.get_upgrade_prob(row['start_rating']))
+            assert row['downgrade'] == pytest.approx(rtm.get_dwngrade_prob(row['start_rating']))
+            assert row['expected_notch_change'] == pytest.approx(rtm.get_expctd_notch_chng(row['start_rating']))
+
+    summary = diagnostics.summary()
+    assert summary['cases'].tolist() == [rtm.counts.sum() for rtm in matrices]
+
+
+def test_distances(cohorts):
+    rtm = RatingsTransitionMatrix.RatingsTransitionMatrix()
+    rtm.load_rtm(cohorts[2017])
+    other = RatingsTransitionMatrix.RatingsTransitionMatrix()
+    other.load_rtm(cohorts[2016])
+    diagnostics = TransitionDiagnostics.from_matrices([rtm, other], labels=['2017', '2016'])
+
+    assert diagnostics.distances(reference=rtm)['distance'].to_numpy()[0] == pytest.approx(0.0)
+    for metric in ['l1', 'frobenius', 'svd']:
+        pairwise = diagnostics.pairwise_distances(metric=metric).to_numpy()
+        assert np.diag(pairwise) == pytest.approx([0.0, 0.0])
+        assert pairwise[0, 1] == pytest.approx(pairwise[1, 0])
+        assert diagnostics.distances(metric=metric)['distance'].to_numpy() == pytest.approx([pairwise[1, 0]])
@@ -0,0 +1,37 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import RatingsTransitionMatrix
+from TransitionMatrixBundle import TransitionMatrixBundle
+
+
+@pytest.mark.parametrize('compressed', [True, False])
+def test_round_trip(cohorts, ratings, tmp_path, compressed):
+    bundle = TransitionMatrixBundle()
+    for year, cohort in cohorts.items():
+        rtm = RatingsTransitionMatrix.RatingsTransitionMatrix()
+        rtm.load_rtm(cohort)
+        rtm.load_oas_change_matrix(cohort)
+        bundle.add(str(year), rtm, period=str(year), universe='C0A0 + H0A0', filters={'require_two_agencies': False})
+    # matrices over another state space go in the same file
+    native = ratings.get_native_transition_matrices(datetime.date(2016, 12, 31), datetime.date(2017, 12, 31))
+    for agency, rtm in native.items():
+        bundle.add(agency, rtm)
+
+    path = str(tmp_path / 'bundle.npz')
+    bundle.save(path, compressed=compressed)
+    loaded = TransitionMatrixBundle.load(path)
+
+    assert loaded.names == bundle.names
+    assert loaded.metadata == bundle.metadata
+    for name in bundle.names:
+        before, after = bundle[name], loaded[name]
+        assert after.states == before.states
+        assert after.default_states == before.default_states
+        assert (after.counts == before.counts).all()
+        np.testing.assert_array_equal(after.mkt_val, before.mkt_val)
+        np.testing.assert_array_equal(after.wghtd_oas_change, before.wghtd_oas_change)
+        np.testing.assert_array_equal(after.get_probability_matrix(), before.get_probability_matrix())
+    assert loaded.metadata['2017']['cases'] == bundle['2017'].counts.sum()